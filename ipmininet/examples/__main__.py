@@ -1,9 +1,11 @@
 """This files lets you start all examples"""
 import argparse
+import sys
 
 import ipmininet
 from ipmininet.ipnet import IPNet
 from ipmininet.cli import IPCLI
+from ipmininet.offline import generate_configs
 
 from .simple_ospf_network import SimpleOSPFNet
 from .simple_ospfv3_network import SimpleOSPFv3Net
@@ -110,6 +112,9 @@ def parse_args():
     parser.add_argument('--args', help='Additional arguments to give'
                         'to the topology constructor (key=val, key=val, ...)',
                         default='')
+    parser.add_argument('--offline', metavar='DIRECTORY',
+                        help='Only write the configuration files of the nodes'
+                        ' in this directory, without starting the network')
     return parser.parse_args()
 
 
@@ -128,6 +133,10 @@ if __name__ == '__main__':
             kwargs[k] = v
         except ValueError:
             lg.error('Ignoring args:', arg)
+    if args.offline:
+        failures = generate_configs(TOPOS[args.topo](**kwargs), args.offline,
+                                    **NET_ARGS.get(args.topo, {}))
+        sys.exit(1 if failures else 0)
     net = IPNet(topo=TOPOS[args.topo](**kwargs), **NET_ARGS.get(args.topo, {}))
     net.start()
     IPCLI(net)
@@ -5,13 +5,13 @@ configuration for a host."""
 import abc
 import os
 
-from mako.lookup import TemplateLookup
-
 from ipmininet.router.config.base import NodeConfig, Daemon
+from ipmininet.templating import CachedTemplateLookup
 
 
 __TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
-host_template_lookup = TemplateLookup(directories=[__TEMPLATES_DIR])
+host_template_lookup = CachedTemplateLookup(__TEMPLATES_DIR)
+host_template_lookup.warm_up()
 
 
 class HostDaemon(Daemon, metaclass=abc.ABCMeta):
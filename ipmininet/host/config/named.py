@@ -45,16 +45,19 @@ class Named(HostDaemon):
     @property
     def startup_line(self):
         # This runs the daemon outside of AppArmor's restrictions
+        apparmor = "%s -p unconfined " % self._executable("aa-exec") \
+            if self.apparmor else ""
         return '{apparmor}{name} -c {cfg} -f -u root -p {port}' \
-            .format(apparmor="aa-exec -p unconfined " if self.apparmor else "",
-                    name=self.NAME,
+            .format(apparmor=apparmor,
+                    name=self._executable(),
                     cfg=self.cfg_filename,
                     port=self.options.dns_server_port)
 
     @property
     def dry_run(self):
         return '{name} {cfg}' \
-            .format(name='named-checkconf', cfg=self.cfg_filename)
+            .format(name=self._executable('named-checkconf'),
+                    cfg=self.cfg_filename)
 
     def build(self):
         cfg = super().build()
@@ -2,28 +2,46 @@
 This modules will auto-generate all needed configuration properties if
 unspecified by the user"""
 import math
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter, methodcaller
 from typing import Union, List, Optional, Type, Iterable, Mapping, Tuple, \
-    Iterator, Dict, Set
+    Iterator, Dict, Set, Deque, Any
 
 from ipaddress import ip_network, ip_interface, IPv4Address, IPv6Address, \
     IPv4Network, IPv6Network, IPv4Interface, IPv6Interface
 
 from . import MIN_IGP_METRIC, OSPF_DEFAULT_AREA
-from .utils import otherIntf, realIntfList, L3Router, address_pair, has_cmd, \
-    is_subnet_of
+from .utils import otherIntf, realIntfList, L3Router, address_pair, find_cmd
 from .host import IPHost
-from .router import Router
-from .router.config import BasicRouterConfig, RouterConfig
-from .link import IPIntf, IPLink, PhysicalInterface
+from .router import Router, IPNode
+from .router.config import BasicRouterConfig, RouterConfig, NodeConfig, \
+    RouterIdRegistry, HostsTable
+from .router.config.base import render_daemons
+from .router.config.manifest import ConfigManifest
+from .link import IPIntf, IPLink, PhysicalInterface, AddressPlan, \
+    address_event, refresh_addresses
+from .lpm import AddressIndex
+from .templating import render_stats
+from .netlink import AddressMonitor
+from .supervisor import ResourceSample
 from .ipswitch import IPSwitch
 
 from mininet.net import Mininet
 from mininet.node import Host, Controller, Node
 from mininet.log import lg as log
 
-# ping6 is not provided by default on newer systems
-PING6_CMD = 'ping6' if has_cmd('ping6') else 'ping -6'
+
+def ping_cmd(v4=True) -> str:
+    """Return the command pinging an IPv4 or IPv6 address"""
+    ping = find_cmd('ping') or 'ping'
+    if v4:
+        return ping
+    # ping6 is not provided by default on newer systems
+    ping6 = find_cmd('ping6')
+    return ping6 if ping6 is not None else '%s -6' % ping
 
 
 class IPNet(Mininet):
@@ -45,6 +63,10 @@ class IPNet(Mininet):
                  intf: Type[IPIntf] = IPIntf,
                  switch: Type[IPSwitch] = IPSwitch,
                  controller: Optional[Type[Controller]] = None,
+                 start_workers=1,
+                 monitor_addresses=False,
+                 render_workers=1,
+                 config_manifest: Optional[str] = None,
                  *args, **kwargs):
         """Extends Mininet by adding IP-related ivars/functions and
         configuration knobs.
@@ -60,12 +82,31 @@ class IPNet(Mininet):
         :param max_v6_prefixlen: Maximal IPv6 prefixlen to auto-allocate
         :param allocate_IPs: whether to auto-allocate subnets in the network
         :param igp_metric: The default IGP metric for the links
-        :param igp_area: The default IGP area for the links"""
+        :param igp_area: The default IGP area for the links
+        :param start_workers: The maximal number of nodes that are started
+                              concurrently. Daemons are always started in
+                              sequence inside a given node.
+        :param monitor_addresses: Follow the address changes made outside
+                                  of IPMininet, e.g. by the daemons or with
+                                  the CLI, to keep the address view of the
+                                  interfaces up-to-date. Otherwise,
+                                  node_for_ip and intf_for_ip only read the
+                                  addresses again when they find no single
+                                  match.
+        :param render_workers: The number of processes rendering the
+                               configuration templates of the nodes. The
+                               workers are forked from this process, which
+                               is unsafe while it runs other threads, such
+                               as the address monitor, the output pump or
+                               the supervisor of a previous network.
+        :param config_manifest: The file recording the configuration files
+                                of the nodes across runs, so that the
+                                unchanged ones are not written again"""
         self.router = router
         self.config = config
         self.routers = []  # type: List[Router]
         # We need this to be able to do inverse-lookups
-        self._ip_allocs = {}  # type: Dict[str, Node]
+        self.address_index = AddressIndex()
         self.max_v4_prefixlen = max_v4_prefixlen
         self._unallocated_ipbase = [ip_network(ipBase)]
         self.use_v4 = use_v4
@@ -74,10 +115,17 @@ class IPNet(Mininet):
         self.max_v6_prefixlen = max_v6_prefixlen
         self._unallocated_ip6base = [ip_network(ip6Base)]
         self.broadcast_domains = None
+        self.domain_index = None  # type: Optional[DomainIndex]
+        self.hosts_tables = None  # type: Optional[List[HostsTable]]
         self.igp_metric = igp_metric
         self.igp_area = igp_area
         self.allocate_IPs = allocate_IPs
         self.physical_interface = {}  # type: Dict[IPIntf, Node]
+        self.start_workers = max(1, start_workers)
+        self.monitor_addresses = monitor_addresses
+        self.render_workers = render_workers
+        self._address_monitor = None  # type: Optional[AddressMonitor]
+        self.config_manifest = ConfigManifest(config_manifest)
         super().__init__(ipBase=ipBase, host=host, switch=switch, link=link,
                          intf=intf, controller=controller, *args, **kwargs)
 
@@ -167,23 +215,86 @@ class IPNet(Mininet):
         return super().addHost(name, **params)
 
     def node_for_ip(self, ip: Union[str, IPv4Address, IPv6Address]) -> Node:
-        """Return the node owning a given IP address
+        """Return the node owning a given IP address, or the only node
+        having an address in the most specific subnet containing it
+
+        :param ip: an IP address
+        :return: a node
+        :raise KeyError: if no single node matches the address"""
+        nodes = {i.node for i in self._lookup_ip(ip)}
+        if len(nodes) != 1 and not self.monitor_addresses:
+            nodes = {i.node for i in self._lookup_ip(ip, refresh=True)}
+        if len(nodes) != 1:
+            raise KeyError(ip)
+        return nodes.pop()
+
+    def intf_for_ip(self, ip: Union[str, IPv4Address, IPv6Address]) \
+            -> IPIntf:
+        """Return the interface owning a given IP address, or the only
+        interface having an address in the most specific subnet containing
+        it
+
+        :param ip: an IP address
+        :raise KeyError: if no single interface matches the address"""
+        intfs = self._lookup_ip(ip)
+        if len(intfs) != 1 and not self.monitor_addresses:
+            intfs = self._lookup_ip(ip, refresh=True)
+        if len(intfs) != 1:
+            raise KeyError(ip)
+        return intfs[0]
+
+    def domain_for_ip(self, ip: Union[str, IPv4Address, IPv6Address]) \
+            -> 'BroadcastDomain':
+        """Return the broadcast domain containing a given IP address
+
+        :param ip: an IP address
+        :raise KeyError: if the address is not in any broadcast domain"""
+        for i in self._lookup_ip(ip):
+            if i.broadcast_domain is not None:
+                return i.broadcast_domain
+        raise KeyError(ip)
+
+    def _lookup_ip(self, ip: Union[str, IPv4Address, IPv6Address],
+                   refresh=False) -> List[IPIntf]:
+        """Return the interfaces matching an address
 
         :param ip: an IP address
-        :return: a node name"""
-        return self._ip_allocs[str(ip)]
+        :param refresh: Whether the addresses of the nodes are read again
+                        first. The addresses set outside of IPNet, e.g. by
+                        SLAAC, are otherwise only known when
+                        monitor_addresses is set.
+        :raise KeyError: if ip is not a valid address"""
+        if refresh:
+            refresh_addresses(self.nameToNode.values())
+        try:
+            return self.address_index.lookup(ip)
+        except ValueError:
+            raise KeyError(ip)
 
     def start(self):
         super().start()
+        self.update_hosts_tables()
+        compile_time, render_time = render_stats.snapshot()
+        failures = self._render_configs(self.routers + self.hosts)
+        new_compile_time, new_render_time = render_stats.snapshot()
+        log.info('*** Configuration templates: %.3fs compiling, %.3fs '
+                 'rendering\n' % (new_compile_time - compile_time,
+                                  new_render_time - render_time))
         log.info('*** Starting, ', len(self.routers), 'routers\n')
-        for router in self.routers:
-            log.info(router.name + ' ')
-            router.start()
+        failures.update(self._start_nodes([r for r in self.routers
+                                           if r.name not in failures]))
         log.info('*** Starting, ', len(self.hosts), 'hosts\n')
-        for host in self.hosts:
-            log.info(host.name + ' ')
-            host.start()
+        failures.update(self._start_nodes([h for h in self.hosts
+                                           if h.name not in failures]))
         log.info('\n')
+        if failures:
+            log.error('*** Failed to start', len(failures), 'nodes:\n')
+            for name, err in failures.items():
+                log.error('%s: %s\n' % (name, err))
+            # Do not leave the daemons of the other nodes running
+            for n in self.routers + self.hosts:
+                n.stop_daemons()
+            raise NetworkStartError(failures)
         log.info('*** Setting default host routes\n')
         for h in self.hosts:
             if 'defaultRoute' in h.params:
@@ -211,7 +322,99 @@ class IPNet(Mininet):
                 log.info('skipping %s , ' % h.name)
         log.info('\n')
 
+    def update_hosts_tables(self):
+        """Write the /etc/hosts file of each connected component of the
+        network. The files are only rewritten if the addresses of their
+        nodes changed since the last call."""
+        if self.hosts_tables is None:
+            self.hosts_tables = HostsTable.for_nodes(self.values())
+        for table in self.hosts_tables:
+            table.write()
+
+    def _render_configs(self, nodes: List[IPNode]) -> Dict[str, Exception]:
+        """Build the configuration of all the nodes, then render their
+        templates with up to self.render_workers processes and write them.
+        The nodes then only have to start their daemons.
+
+        :param nodes: The nodes to configure
+        :return: The errors that prevented the configuration of some nodes,
+                 indexed by node name"""
+        failures = {}  # type: Dict[str, Exception]
+        configs = []  # type: List[Tuple[IPNode, NodeConfig]]
+        self.config_manifest.begin()
+        for n in nodes:
+            nconfig = getattr(n, 'nconfig', None)
+            if not isinstance(nconfig, NodeConfig):
+                continue
+            nconfig.manifest = self.config_manifest
+            try:
+                nconfig.prepare()
+            except Exception as e:  # Report it with the errors of the others
+                failures[n.name] = e
+                continue
+            configs.append((n, nconfig))
+        log.info('*** Rendering the configuration of', len(configs),
+                 'nodes\n')
+        jobs = [job for _, nconfig in configs for job in nconfig.render_jobs]
+        rendered = iter(render_daemons(jobs, workers=self.render_workers))
+        for n, nconfig in configs:
+            try:
+                nconfig.write([next(rendered) for _ in nconfig.render_jobs])
+            except Exception as e:  # Report it with the errors of the others
+                failures[n.name] = e
+        # The files of the nodes that failed are still valid
+        if not failures:
+            self.config_manifest.prune()
+        log.info('*** Wrote', len(self.config_manifest.written),
+                 'configuration files,', len(self.config_manifest),
+                 'in total\n')
+        try:
+            self.config_manifest.save()
+        except OSError as e:
+            log.warning('Cannot save the configuration manifest: %s\n' % e)
+        return failures
+
+    def _start_nodes(self, nodes: List[IPNode]) -> Dict[str, Exception]:
+        """Start the given nodes, using up to self.start_workers concurrent
+        workers
+
+        :param nodes: The nodes to start
+        :return: The errors that prevented some nodes from starting, indexed
+                 by node name"""
+        def _start(n: IPNode) -> Optional[Exception]:
+            log.info(n.name + ' ')
+            try:
+                n.start()
+            except Exception as e:  # Report it with the errors of the others
+                return e
+            return None
+
+        workers = min(self.start_workers, len(nodes))
+        if workers <= 1:
+            errors = [_start(n) for n in nodes]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                errors = list(pool.map(_start, nodes))
+        return {n.name: e for n, e in zip(nodes, errors) if e is not None}
+
+    def resource_usage(self, since: Optional[float] = None) \
+            -> Dict[str, Dict[str, List[ResourceSample]]]:
+        """Return the resource usage of the daemons over time
+
+        :param since: The time of the first sample, as returned by
+                      time.time(), all the kept samples by default
+        :return: The samples, indexed by node and daemon name"""
+        usage = {}  # type: Dict[str, Dict[str, List[ResourceSample]]]
+        for n in self.values():
+            if isinstance(n, IPNode):
+                usage[n.name] = {d.NAME: n.resource_usage(d.NAME, since)
+                                 for d in n.nconfig.daemons}
+        return usage
+
     def stop(self):
+        if self._address_monitor is not None:
+            self._address_monitor.stop()
+            self._address_monitor = None
         log.info('*** Stopping', len(self.routers), 'routers\n')
         for router in self.routers:
             log.info(router.name + ' ')
@@ -232,9 +435,26 @@ class IPNet(Mininet):
                 itf = PhysicalInterface(itf_name, node=self[n])
                 log.info('\n*** Adding Physical interface',
                          itf_name, 'to', n, '\n')
-                self.broadcast_domains.append(BroadcastDomain(itf))
+                self.domain_index.add(BroadcastDomain(itf))
             except KeyError:
                 log.error('!!! Node', n, 'not found!\n')
+        # Catch up with the addresses set by the kernel, e.g. link-locals
+        refresh_addresses(self.nameToNode.values())
+        for n in self.nameToNode.values():
+            for itf in n.intfList():
+                if isinstance(itf, IPIntf):
+                    self.address_index.attach(itf)
+        registry = RouterIdRegistry(r for r in self.routers
+                                    if isinstance(r.nconfig, RouterConfig))
+        for r in self.routers:
+            if isinstance(r.nconfig, RouterConfig):
+                r.nconfig.routerid_registry = registry
+        if self.monitor_addresses:
+            self._address_monitor = AddressMonitor(
+                address_event, lambda n: refresh_addresses((n,)))
+            for n in self.nameToNode.values():
+                self._address_monitor.watch(n)
+            self._address_monitor.start()
         try:
             self.topo.post_build(self)
         except AttributeError as e:
@@ -259,12 +479,18 @@ class IPNet(Mininet):
     def _allocate_IPs(self):
         """Allocate IP addresses on every interface in every broadcast
         domain"""
+        plan = AddressPlan()
         if self.use_v4:
-            self._allocate_ipv4()
+            self._allocate_ipv4(plan)
         if self.use_v6:
-            self._allocate_ipv6()
+            self._allocate_ipv6(plan)
+        log.info("*** Assigning", len(plan), "addresses\n")
+        plan.apply()
+
+    def _allocate_ipv4(self, plan: AddressPlan):
+        """Plan the allocation of IPv4 addresses
 
-    def _allocate_ipv4(self):
+        :param plan: The address plan to complete"""
         log.info("*** Allocating IPv4 addresses\n")
         self._allocate_subnets(self._unallocated_ipbase,
                                self.broadcast_domains,
@@ -276,17 +502,17 @@ class IPNet(Mininet):
         for domain in self.broadcast_domains:
             if not domain.use_ip_version(4):
                 continue
-            for intf in domain:
+            # Same addresses on every run, whatever the order of the set
+            for intf in sorted(domain, key=_intf_order):
                 if len(list(intf.ips())) == 0 \
                         and intf.node.use_v4:
-                    ips = tuple(domain.next_ipv4()
-                                for _ in range(intf.interface_width[0]))
-                    intf.setIP(ips)
-                for ip in intf.ips():
-                    self._ip_allocs[ip.with_prefixlen] = intf.node
-                    self._ip_allocs[ip.ip.compressed] = intf.node
-
-    def _allocate_ipv6(self):
+                    plan.add(intf, [domain.next_ipv4()
+                                    for _ in range(intf.interface_width[0])])
+
+    def _allocate_ipv6(self, plan: AddressPlan):
+        """Plan the allocation of IPv6 addresses
+
+        :param plan: The address plan to complete"""
         log.info("*** Allocating IPv6 addresses\n")
         self._allocate_subnets(self._unallocated_ip6base,
                                self.broadcast_domains,
@@ -298,15 +524,12 @@ class IPNet(Mininet):
         for domain in self.broadcast_domains:
             if not domain.use_ip_version(6):
                 continue
-            for intf in domain:
+            # Same addresses on every run, whatever the order of the set
+            for intf in sorted(domain, key=_intf_order):
                 if len(list(intf.ip6s(exclude_lls=True))) == 0 \
                         and intf.node.use_v6:
-                    ips = tuple(domain.next_ipv6()
-                                for _ in range(intf.interface_width[1]))
-                    intf.setIP6(ips)
-                for ip in intf.ip6s(exclude_lls=True):
-                    self._ip_allocs[ip.with_prefixlen] = intf.node
-                    self._ip_allocs[ip.ip.compressed] = intf.node
+                    plan.add(intf, [domain.next_ipv6()
+                                    for _ in range(intf.interface_width[1])])
 
     @staticmethod
     def _allocate_subnets(subnets: List[Union[IPv4Network, IPv6Network]],
@@ -317,17 +540,11 @@ class IPNet(Mininet):
                                                             IPv6Network]] = ()):
         """Allocate subnets to broadcast domains.
 
-        We keep the subnets sorted as x < y wrt the available number of
-        addresses in the subnet so that the bigger domains
-        take the smallest subnets before subdividing them.
-        As the domains range from the biggest to the smallest, and the subnets
-        from the smallest to the biggest, the biggest domains will take the
-        first subnet that is able to contain it, and split it in several
-        subnets until it is restricted to its prefix.
-        The next domain then is necessarily of the same size (reuses on of the
-        split subnets) or smaller (uses a previously split subnet or splits a
-        bigger one). This avoids wasting of addresses (wrt. the specified
-        max_prefixlen) at the cost of a quadratic (?) behavior.
+        The domains range from the biggest to the smallest. Each of them
+        takes the smallest available subnet that is able to contain it, and
+        splits it in halves until it is restricted to its prefix. The
+        other halves are kept for the next domains. This avoids wasting of
+        addresses (wrt. the specified max_prefixlen). See PrefixAllocator.
 
         :param subnets: a list of ip_network of available subnets. This list
                         will be modified to account for the new allocations.
@@ -341,78 +558,32 @@ class IPNet(Mininet):
         :param max_prefixlen: The maximal prefixlen that can be allocated,
                                 e.g. to not allocate /126 for IPv6 P2P links
         :param allocated_subnets: The subnets that are already allocated and
-                                  cannot be allocated to another domain
-        :return: iterator of (domain, subnet)"""
+                                  cannot be allocated to another domain"""
         _domainlen = methodcaller(domainlen)
         domains.sort(key=_domainlen, reverse=True)
-        _prefixlen = attrgetter('prefixlen')
-        subnets.sort(key=_prefixlen, reverse=True)
+        allocator = PrefixAllocator(subnets, allocated_subnets)
         ip_version = 4 if net_key == 'net' else 6
-        for d in domains:
-            if not d.use_ip_version(ip_version):
-                continue
-            if not subnets:
-                raise ValueError('No subnet left in the prefix space for all'
-                                 'broadcast domains.')
-            plen = min(max_prefixlen, getattr(d, size_key))
-            if plen < subnets[-1].prefixlen:
-                raise ValueError('Could not find a subnet big enough for a '
-                                 'broadcast domain.')
-            log.debug('Allocating prefix', plen, 'for interfaces',
-                      d.interfaces)
-            # Try to find a suitable subnet in the list
-            for i, net in enumerate(subnets):
-                nets = []
-                # if the subnet is too big for the prefix, perform a left
-                # expansion (only expand one at a time to keep subnets as
-                # aggregated as possible).
-                while plen > net.prefixlen:
-                    # Get list of subnets and append to list of previous
-                    # expanded subnets as it is bigger wrt. prefixlen
-                    net, next_net = tuple(net.subnets(prefixlen_diff=1))
-                    # If not a subnet of an allocated subnet
-                    if len(list(filter(lambda y: is_subnet_of(next_net, y),
-                                       allocated_subnets))) == 0:
-                        nets.append(next_net)
-                # Check if we have an appropriately-sized subnet
-                if plen == net.prefixlen:
-                    # If the network overlaps with an allocated subnet,
-                    # we pass it
-                    if len(list(filter(lambda y: is_subnet_of(net, y)
-                                                 or is_subnet_of(y, net),
-                                       allocated_subnets))) == 0:
-                        # Register the allocation
-                        setattr(d, net_key, net)
-                    # Delete the expanded/used subnet
-                    del subnets[i]
-                    # Insert the created subnets if any
-                    subnets.extend(nets)
-                    # Sort the array again
-                    subnets.sort(key=_prefixlen, reverse=True)
-                    # Proceed to the next broadcast domain
-                    break
-                # Otherwise try the next network for the current domain
+        try:
+            for d in domains:
+                if not d.use_ip_version(ip_version):
+                    continue
+                plen = min(max_prefixlen, getattr(d, size_key))
+                log.debug('Allocating prefix', plen, 'for interfaces',
+                          d.interfaces)
+                net = allocator.allocate(plen)
+                # If the network overlaps with an allocated subnet,
+                # we pass it
+                if net is not None:
+                    # Register the allocation
+                    setattr(d, net_key, net)
+        finally:
+            subnets[:] = allocator.free_blocks()
 
     def _broadcast_domains(self) -> List['BroadcastDomain']:
         """Build the broadcast domains for this topology"""
-        domains = []
-        interfaces = {intf: False
-                      for n in self.values()
-                      if BroadcastDomain.is_domain_boundary(n)
-                      for intf in realIntfList(n)}
-        interfaces.update({r.intf('lo'): False for r in self.routers})
-        for intf in interfaces.keys():
-            # the interface already belongs to a broadcast domain
-            if interfaces[intf]:
-                continue
-            # create a new domain and explore the interface
-            bd = BroadcastDomain(intf)
-            # Mark all explored interfaces belonging to that domain
-            for i in bd:
-                interfaces[i] = True
-                i.broadcast_domain = bd
-            domains.append(bd)
-        return domains
+        self.domain_index = DomainIndex(self.values(),
+                                        [r.intf('lo') for r in self.routers])
+        return self.domain_index.domains
 
     def _ping_set(self, src: Node,
                   dst_dict: Mapping[Node, Union[IPv4Address, IPv6Address, str]],
@@ -434,7 +605,7 @@ class IPNet(Mininet):
 
         log.output("%s --%s--> " % (src.name, "IPv4" if v4 else "IPv6"))
         for dst, dst_ip in dst_dict.items():
-            result = src.cmd('%s -c1 %s %s' % ("ping" if v4 else PING6_CMD,
+            result = src.cmd('%s -c1 %s %s' % (ping_cmd(v4),
                                                opts, dst_ip))
             sent, received = self._parsePing(result)
             lost += sent - received
@@ -550,6 +721,103 @@ class IPNet(Mininet):
         return self.pingPair(use_v4=False)
 
 
+class NetworkStartError(RuntimeError):
+    """Raised when some nodes of the network could not be started"""
+
+    def __init__(self, failures: Mapping[str, Exception]):
+        """:param failures: The error that prevented each node from starting,
+                            indexed by node name"""
+        self.failures = dict(failures)
+        super().__init__('Failed to start %d nodes: %s'
+                         % (len(self.failures),
+                            ', '.join(sorted(self.failures))))
+
+
+class PrefixAllocator:
+    """A binary buddy allocator of IP prefixes.
+
+    The free blocks are kept in one FIFO queue per prefix length. A request
+    takes the first block of the longest prefix length that is able to
+    contain it, and splits it in halves, keeping the unused halves as free
+    blocks. Pre-allocated subnets are indexed as sorted intervals so that
+    the blocks overlapping them are found in logarithmic time."""
+
+    def __init__(self, subnets: Iterable[Union[IPv4Network, IPv6Network]],
+                 allocated: Iterable[Union[IPv4Network, IPv6Network]] = ()):
+        """:param subnets: The blocks that can be allocated
+        :param allocated: The subnets that are already allocated and cannot
+                          be allocated again"""
+        self._free = {}  # type: Dict[int, Deque]
+        # Bit i is set if there is a free block with a prefix length of i
+        self._levels = 0
+        for net in sorted(subnets, key=attrgetter('prefixlen'),
+                          reverse=True):
+            self._push(net)
+        ranges = sorted((int(net.network_address), int(net.broadcast_address))
+                        for net in allocated)
+        self._starts = [first for first, _ in ranges]
+        # As subnets are either nested or disjoint, a block overlaps or is
+        # contained in a subnet that starts before it iff the largest end
+        # of these subnets is large enough
+        self._max_ends = list(accumulate((last for _, last in ranges), max))
+
+    def _push(self, net: Union[IPv4Network, IPv6Network]):
+        self._free.setdefault(net.prefixlen, deque()).append(net)
+        self._levels |= 1 << net.prefixlen
+
+    def _pop(self, prefixlen: int) -> Union[IPv4Network, IPv6Network]:
+        queue = self._free[prefixlen]
+        net = queue.popleft()
+        if not queue:
+            self._levels &= ~(1 << prefixlen)
+        return net
+
+    def _max_end(self, address: int) -> int:
+        """Return the largest end of the allocated subnets starting at or
+        before address, or -1"""
+        i = bisect_right(self._starts, address)
+        return self._max_ends[i - 1] if i else -1
+
+    def _covered(self, net: Union[IPv4Network, IPv6Network]) -> bool:
+        """Return whether net is a subnet of an allocated subnet"""
+        return self._max_end(int(net.network_address)) \
+            >= int(net.broadcast_address)
+
+    def _overlaps(self, net: Union[IPv4Network, IPv6Network]) -> bool:
+        """Return whether net overlaps an allocated subnet"""
+        return self._max_end(int(net.broadcast_address)) \
+            >= int(net.network_address)
+
+    def allocate(self, prefixlen: int) \
+            -> Optional[Union[IPv4Network, IPv6Network]]:
+        """Allocate a block of the given prefix length
+
+        :param prefixlen: The prefix length of the block
+        :return: The block, or None if the selected block overlaps an
+                 allocated subnet and cannot be used
+        :raise ValueError: if no free block is large enough"""
+        if not self._levels:
+            raise ValueError('No subnet left in the prefix space for all'
+                             'broadcast domains.')
+        fitting = self._levels & ((2 << prefixlen) - 1)
+        if not fitting:
+            raise ValueError('Could not find a subnet big enough for a '
+                             'broadcast domain.')
+        net = self._pop(fitting.bit_length() - 1)
+        # Perform left expansions until we reach the requested size, the
+        # right halves become free blocks
+        while prefixlen > net.prefixlen:
+            net, next_net = net.subnets(prefixlen_diff=1)
+            if not self._covered(next_net):
+                self._push(next_net)
+        return None if self._overlaps(net) else net
+
+    def free_blocks(self) -> List[Union[IPv4Network, IPv6Network]]:
+        """Return the free blocks, from the smallest to the largest"""
+        return [net for prefixlen in sorted(self._free, reverse=True)
+                for net in self._free[prefixlen]]
+
+
 class BroadcastDomain:
     """An IP broadcast domain in the network. This class stores the set of
     interfaces belonging to the same broadcast domain, as well as the
@@ -559,12 +827,19 @@ class BroadcastDomain:
     # FIXME Where do we put middleboxes in this model ?
     BOUNDARIES = (Host, IPHost, Router)
 
-    def __init__(self, interfaces: Union[None, List[IPIntf], IPIntf] = None):
+    def __init__(self, interfaces: Union[None, List[IPIntf], IPIntf] = None,
+                 explore=True):
         """Initialize the broadcast domain and optionally explore a set of
         interfaces
 
-        :param interfaces: one Intf or a list of Intf"""
+        :param interfaces: one Intf or a list of Intf
+        :param explore: Whether the neighbors of the interfaces have to be
+                        explored, or if they already form the whole domain"""
         self.interfaces = set()  # type: Set[IPIntf]
+        # The index of the domains of the network, if any
+        self.index = None  # type: Optional[DomainIndex]
+        self._routers = None  # type: Optional[List[IPIntf]]
+        self._by_node = None  # type: Optional[Dict[str, List[IPIntf]]]
         self.net = None  # type: Optional[IPv4Network]
         self._allocated_v4 = 1  # We need to skip subnet address
         self.net6 = None  # type: Optional[IPv6Network]
@@ -574,7 +849,10 @@ class BroadcastDomain:
         if interfaces:
             if not isinstance(interfaces, list):
                 interfaces = [interfaces]
-            self.explore(interfaces)
+            if explore:
+                self.explore(interfaces)
+            else:
+                self.interfaces.update(interfaces)
 
         # Retrieve pre-fixed subnets
         self.fixed_net4s = []  # type: List[IPv4Network]
@@ -616,13 +894,14 @@ class BroadcastDomain:
         to this broadcast domain
 
         :param itfs: a list of Intf"""
-        visited = []  # type: List[IPIntf]
+        self._routers = self._by_node = None
+        visited = set()  # type: Set[IPIntf]
         while itfs:
             # Explore one element
             i = itfs.pop()
             if i in visited:
                 continue
-            visited.append(i)
+            visited.add(i)
             if self.is_domain_boundary(i.node):
                 self.interfaces.add(i)
             # check its corresponding interface
@@ -659,7 +938,20 @@ class BroadcastDomain:
     @property
     def routers(self) -> List[IPIntf]:
         """List all interfaces in this domain belonging to a L3 router"""
-        return [i for i in self.interfaces if L3Router.is_l3router_intf(i)]
+        if self._routers is None:
+            self._routers = [i for i in self.interfaces
+                             if L3Router.is_l3router_intf(i)]
+        return self._routers
+
+    def interfaces_of(self, node_name: str) -> List[IPIntf]:
+        """Return the interfaces of a given node in this domain
+
+        :param node_name: The name of the node"""
+        if self._by_node is None:
+            self._by_node = {}
+            for i in self.interfaces:
+                self._by_node.setdefault(i.node.name, []).append(i)
+        return self._by_node.get(node_name, [])
 
     def next_ipv4(self) -> IPv4Interface:
         """Allocate and return the next available IPv4 address in this
@@ -701,3 +993,112 @@ class BroadcastDomain:
                     or i.node.use_v6 and ip_version == 6:
                 return True
         return False
+
+
+def _intf_order(intf: IPIntf) -> Tuple[str, str]:
+    return intf.node.name, intf.name
+
+
+class DomainIndex:
+    """The broadcast domains of a network, discovered in a single pass over
+    its links with a union-find structure. It also indexes the domains by
+    interface and by node."""
+
+    def __init__(self, nodes: Iterable[Node], extra: Iterable[IPIntf] = ()):
+        """:param nodes: The nodes of the network
+        :param extra: Additional interfaces of boundary nodes that are not
+                      returned by realIntfList, e.g. router loopbacks"""
+        self.domains = []  # type: List[BroadcastDomain]
+        self._by_intf = {}  # type: Dict[IPIntf, BroadcastDomain]
+        self._by_node = {}  # type: Dict[Node, List[BroadcastDomain]]
+        # Values derived from the domains, e.g. paths between nodes. They
+        # are dropped whenever a domain is added.
+        self.cache = {}  # type: Dict[Any, Any]
+
+        ids = {}  # type: Dict[IPIntf, int]
+        intfs = []  # type: List[IPIntf]
+        parent = []  # type: List[int]
+        size = []  # type: List[int]
+
+        def uid(intf: IPIntf) -> int:
+            try:
+                return ids[intf]
+            except KeyError:
+                ids[intf] = len(intfs)
+                intfs.append(intf)
+                parent.append(len(parent))
+                size.append(1)
+                return ids[intf]
+
+        def find(x: int) -> int:
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(a: int, b: int):
+            a, b = find(a), find(b)
+            if a == b:
+                return
+            if size[a] < size[b]:
+                a, b = b, a
+            parent[b] = a
+            size[a] += size[b]
+
+        boundaries = []  # type: List[int]
+        for n in nodes:
+            boundary = BroadcastDomain.is_domain_boundary(n)
+            first = None  # type: Optional[int]
+            for i in realIntfList(n):
+                x = uid(i)
+                if boundary:
+                    boundaries.append(x)
+                elif first is None:
+                    first = x
+                else:
+                    # L2 nodes merge all their ports in the same domain
+                    union(first, x)
+                other = otherIntf(i)
+                if other is not None:
+                    union(x, uid(other))
+        boundaries.extend(uid(i) for i in extra)
+
+        members = {}  # type: Dict[int, List[IPIntf]]
+        roots = []  # type: List[int]
+        for x in boundaries:
+            root = find(x)
+            if root not in members:
+                members[root] = []
+                roots.append(root)
+            members[root].append(intfs[x])
+        for root in roots:
+            self.add(BroadcastDomain(members[root], explore=False))
+
+    def add(self, domain: BroadcastDomain):
+        """Register a new broadcast domain
+
+        :param domain: The domain, whose interfaces cannot belong to another
+                       domain of the index"""
+        domain.index = self
+        self.domains.append(domain)
+        self.cache.clear()
+        for i in domain:
+            i.broadcast_domain = domain
+            self._by_intf[i] = domain
+            domains = self._by_node.setdefault(i.node, [])
+            if domain not in domains:
+                domains.append(domain)
+
+    def __iter__(self) -> Iterator[BroadcastDomain]:
+        return iter(self.domains)
+
+    def __len__(self):
+        return len(self.domains)
+
+    def domain_of(self, intf: IPIntf) -> Optional[BroadcastDomain]:
+        """Return the broadcast domain of an interface"""
+        return self._by_intf.get(intf)
+
+    def domains_of(self, node: Node) -> List[BroadcastDomain]:
+        """Return the broadcast domains to which a node is attached"""
+        return self._by_node.get(node, [])
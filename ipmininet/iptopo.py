@@ -9,7 +9,7 @@ from mininet.log import lg
 from ipmininet.overlay import Overlay, Subnet
 from ipmininet.utils import get_set, is_container
 from ipmininet.router.config import BasicRouterConfig, OSPFArea, AS,\
-    iBGPFullMesh, OpenrDomain
+    iBGPFullMesh, iBGPRouteReflectors, OpenrDomain
 from ipmininet.router.config.base import Daemon, RouterConfig, NodeConfig
 from ipmininet.host.config import HostConfig, DNSZone
 from ipmininet.ipnet import IPNet
@@ -19,8 +19,8 @@ class IPTopo(Topo):
     """A topology that supports L3 routers"""
 
     OVERLAYS = {cls.__name__: cls
-                for cls in (AS, iBGPFullMesh, OpenrDomain, OSPFArea,
-                            Subnet, DNSZone)}
+                for cls in (AS, iBGPFullMesh, iBGPRouteReflectors, OpenrDomain,
+                            OSPFArea, Subnet, DNSZone)}
 
     def __init__(self, *args, **kwargs):
         self.overlays = []
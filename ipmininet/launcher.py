@@ -0,0 +1,446 @@
+"""A resident process launcher, running inside the namespace of a node. It
+forks and executes processes on request over a Unix socket, reports their
+pid and exit status, and runs short commands such as configuration checks.
+This avoids attaching a new process to the namespace for every daemon.
+
+This module only depends on the standard library since the server is
+started with `python -I launcher.py <socket>`."""
+import array
+import errno
+import json
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+# The time to wait for a new launcher to accept connections
+CONNECT_TIMEOUT = 10.
+# The maximal number of file descriptors passed along with a request
+_MAX_FDS = 4
+
+
+class LauncherError(RuntimeError):
+    """Raised when the launcher cannot serve a request"""
+
+
+def _spawn(args: List[str], cwd: Optional[str] = None,
+           output: Optional[str] = None, output_fd: Optional[int] = None,
+           error_fd: Optional[int] = None) -> int:
+    """Fork and execute a process, in its own session
+
+    :param args: The command and its arguments
+    :param cwd: The working directory of the process
+    :param output: The file receiving its stdout and stderr, if any
+    :param output_fd: The file descriptor receiving its stdout and stderr,
+                      instead of output
+    :param error_fd: The file descriptor receiving its stderr, if it must be
+                     kept apart from its stdout
+    :return: The pid of the process
+    :raise OSError: if the process cannot be executed"""
+    # The pipe is closed when exec succeeds, or carries its errno
+    rfd, wfd = os.pipe2(os.O_CLOEXEC)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            os.setsid()
+            if cwd is not None:
+                os.chdir(cwd)
+            null = os.open(os.devnull, os.O_RDWR)
+            if output_fd is not None:
+                out = output_fd
+            elif output is not None:
+                out = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                              0o644)
+            else:
+                out = null
+            os.dup2(null, 0)
+            os.dup2(out, 1)
+            os.dup2(out if error_fd is None else error_fd, 2)
+            os.closerange(3, wfd)
+            os.closerange(wfd + 1, os.sysconf('SC_OPEN_MAX'))
+            os.execvp(args[0], args)
+        except OSError as e:
+            os.write(wfd, str(e.errno).encode())
+        finally:
+            os._exit(127)
+    os.close(wfd)
+    with os.fdopen(rfd, 'rb') as pipe:
+        err = pipe.read()
+    if err:
+        os.waitpid(pid, 0)
+        code = int(err)
+        raise OSError(code, os.strerror(code), args[0])
+    return pid
+
+
+def _exit_code(status: int) -> int:
+    """Convert a wait status to a Popen return code"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+class _Run:
+    """A command whose output is collected by the launcher, until it
+    terminates and its client gets the reply"""
+
+    def __init__(self, conn: socket.socket, pid: int, out: int, err: int):
+        self.conn = conn
+        self.pid = pid
+        self.code = None  # type: Optional[int]
+        # The output collected from each open pipe
+        self.pipes = {out: [], err: []}  # type: Dict[int, List[bytes]]
+        self.output = {}  # type: Dict[int, str]
+        self.out, self.err = out, err
+
+    @property
+    def done(self) -> bool:
+        return self.code is not None and not self.pipes
+
+    def read(self, fd: int) -> bool:
+        """Collect the available output of a pipe
+
+        :return: Whether the pipe is still open"""
+        data = os.read(fd, 65536)
+        if data:
+            self.pipes[fd].append(data)
+            return True
+        os.close(fd)
+        self.output[fd] = b''.join(self.pipes.pop(fd)).decode('utf-8',
+                                                               'replace')
+        return False
+
+    def reply(self) -> Dict[str, Any]:
+        return {'out': self.output[self.out], 'err': self.output[self.err],
+                'code': self.code}
+
+
+class _Server:
+    """The launcher, serving requests made of one JSON object per line.
+    The commands that are run on behalf of a client do not block it, they
+    are reaped by the serving loop which then replies to the client."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.children = set()  # type: set
+        self.exited = {}  # type: Dict[int, int]
+        # The commands being run, indexed by the pipes of their output
+        self.runs = {}  # type: Dict[int, _Run]
+        self.pending = []  # type: List[_Run]
+        self.clients = {}  # type: Dict[socket.socket, bytes]
+        # The file descriptors received from each client
+        self.fds = {}  # type: Dict[socket.socket, List[int]]
+        self.running = True
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(16)
+
+    def reap(self):
+        for run in self.pending:
+            if run.code is None:
+                done, status = os.waitpid(run.pid, os.WNOHANG)
+                if done:
+                    run.code = _exit_code(status)
+        for pid in list(self.children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                self.children.discard(pid)
+                continue
+            if done:
+                self.children.discard(pid)
+                self.exited[pid] = _exit_code(status)
+
+    def handle(self, request: Dict[str, Any], conn: socket.socket) \
+            -> Optional[Dict[str, Any]]:
+        """Serve a request
+
+        :return: The reply, or None if it is sent once the request is
+                 completed"""
+        op = request.get('op')
+        if op == 'spawn':
+            pid = _spawn(request['args'], cwd=request.get('cwd'),
+                         output=request.get('output'),
+                         output_fd=request.get('output_fd'))
+            self.children.add(pid)
+            return {'pid': pid}
+        if op == 'run':
+            self.run(request['args'], request.get('cwd'), conn)
+            return None
+        if op == 'poll':
+            self.reap()
+            return {'code': self.exited.get(request['pid'])}
+        if op == 'kill':
+            pid = request['pid']
+            if pid in self.children:
+                os.kill(pid, request.get('signal', signal.SIGTERM))
+            return {}
+        if op == 'stop':
+            self.running = False
+            return {}
+        raise ValueError('Unknown operation %s' % op)
+
+    def run(self, args: List[str], cwd: Optional[str],
+            conn: socket.socket):
+        """Start a command whose output is collected by the serving loop"""
+        out_r, out_w = os.pipe2(os.O_CLOEXEC)
+        err_r, err_w = os.pipe2(os.O_CLOEXEC)
+        try:
+            pid = _spawn(args, cwd=cwd, output_fd=out_w, error_fd=err_w)
+        except OSError:
+            os.close(out_r)
+            os.close(err_r)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        run = _Run(conn, pid, out_r, err_r)
+        self.runs[out_r] = self.runs[err_r] = run
+        self.pending.append(run)
+
+    def complete(self):
+        """Reply to the clients whose commands are done"""
+        for run in [r for r in self.pending if r.done]:
+            self.pending.remove(run)
+            try:
+                run.conn.sendall(json.dumps(run.reply()).encode() + b'\n')
+            except OSError:
+                pass  # The client is gone
+
+    def serve(self):
+        try:
+            while self.running:
+                # The exit of the commands being run is not signaled
+                timeout = .01 if self.pending else 1.
+                readable, _, _ = select.select(
+                    [self.sock] + list(self.clients) + list(self.runs),
+                    [], [], timeout)
+                for s in readable:
+                    if s is self.sock:
+                        conn, _ = self.sock.accept()
+                        self.clients[conn] = b''
+                        self.fds[conn] = []
+                    elif s in self.runs:
+                        if not self.runs[s].read(s):
+                            del self.runs[s]
+                    else:
+                        self.read(s)
+                self.reap()
+                self.complete()
+        finally:
+            self.sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def read(self, conn: socket.socket):
+        fds = self.fds[conn]
+        try:
+            data, ancdata, _, _ = conn.recvmsg(
+                65536, socket.CMSG_SPACE(_MAX_FDS * array.array('i').itemsize))
+        except OSError:
+            data, ancdata = b'', []
+        for level, kind, cmsg in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                received = array.array('i')
+                received.frombytes(cmsg[:len(cmsg) - len(cmsg)
+                                        % received.itemsize])
+                fds.extend(received)
+        if not data:
+            for fd in fds:
+                os.close(fd)
+            del self.clients[conn]
+            del self.fds[conn]
+            conn.close()
+            return
+        buf = self.clients[conn] + data
+        *lines, self.clients[conn] = buf.split(b'\n')
+        for line in lines:
+            try:
+                request = json.loads(line.decode())
+                # A client waits for each reply, hence the received file
+                # descriptors belong to its current request
+                if request.get('output_fd'):
+                    if not fds:
+                        raise ValueError('Missing the output descriptor')
+                    request['output_fd'] = fds[0]
+                reply = self.handle(request, conn)
+            except OSError as e:
+                reply = {'error': e.strerror or str(e), 'errno': e.errno,
+                         'filename': e.filename}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': str(e)}
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                fds.clear()
+            if reply is not None:
+                conn.sendall(json.dumps(reply).encode() + b'\n')
+
+
+class LauncherClient:
+    """A connection to the launcher of a node"""
+
+    def __init__(self, path: str, timeout=CONNECT_TIMEOUT):
+        """:param path: The socket of the launcher
+        :param timeout: The time to wait for the launcher to be listening
+        :raise LauncherError: if the launcher cannot be reached"""
+        self.path = path
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        deadline = time.monotonic() + timeout
+        delay = .001
+        while True:
+            try:
+                self._sock.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if time.monotonic() >= deadline:
+                    self._sock.close()
+                    raise LauncherError('Cannot reach the launcher at %s: %s'
+                                        % (path, e))
+                time.sleep(delay)
+                delay = min(2 * delay, .1)
+        self._file = self._sock.makefile('rb')
+
+    def request(self, op: str, fds: Sequence[int] = (), **params) \
+            -> Dict[str, Any]:
+        """Send a request and wait for its reply
+
+        :param op: The requested operation
+        :param fds: The file descriptors passed along with the request
+        :param params: The parameters of the request
+        :raise OSError: if the launcher reported a system error
+        :raise LauncherError: if the request failed otherwise"""
+        params['op'] = op
+        data = json.dumps(params).encode() + b'\n'
+        with self._lock:
+            try:
+                if fds:
+                    sent = self._sock.sendmsg(
+                        [data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                  array.array('i', fds))])
+                    data = data[sent:]
+                self._sock.sendall(data)
+                line = self._file.readline()
+            except OSError as e:
+                raise LauncherError('Lost the launcher at %s: %s'
+                                    % (self.path, e))
+        if not line:
+            raise LauncherError('The launcher at %s exited' % self.path)
+        reply = json.loads(line.decode())
+        if 'errno' in reply:
+            raise OSError(reply['errno'], reply['error'], reply['filename'])
+        if 'error' in reply:
+            raise LauncherError(reply['error'])
+        return reply
+
+    def spawn(self, args: List[str], cwd: Optional[str] = None,
+              output: Optional[str] = None, pipe=False) -> 'LaunchedProcess':
+        """Start a process
+
+        :param args: The command and its arguments
+        :param cwd: The working directory of the process
+        :param output: The file receiving its stdout and stderr, if any
+        :param pipe: Whether its stdout and stderr should instead be sent
+                     to a pipe, available as the stdout of the result"""
+        if not pipe:
+            reply = self.request('spawn', args=args, cwd=cwd, output=output)
+            return LaunchedProcess(self, reply['pid'], args)
+        rfd, wfd = os.pipe2(os.O_CLOEXEC)
+        try:
+            reply = self.request('spawn', fds=[wfd], args=args, cwd=cwd,
+                                 output_fd=True)
+        except BaseException:
+            os.close(rfd)
+            raise
+        finally:
+            os.close(wfd)
+        return LaunchedProcess(self, reply['pid'], args,
+                               stdout=os.fdopen(rfd, 'rb'))
+
+    def run(self, args: List[str], cwd: Optional[str] = None) \
+            -> Tuple[str, str, int]:
+        """Run a command and wait for it to terminate
+
+        :return: Its stdout, stderr and return code"""
+        reply = self.request('run', args=args, cwd=cwd)
+        return reply['out'], reply['err'], reply['code']
+
+    def close(self, stop=True):
+        """Close the connection
+
+        :param stop: Whether the launcher should also exit"""
+        if stop:
+            try:
+                self.request('stop')
+            except (LauncherError, OSError):
+                pass
+        self._file.close()
+        self._sock.close()
+
+
+class LaunchedProcess:
+    """A process started by a launcher. It provides the parts of the Popen
+    interface that are used on daemons."""
+
+    def __init__(self, client: LauncherClient, pid: int, args: List[str],
+                 stdout: Optional[BinaryIO] = None):
+        self.client = client
+        self.pid = pid
+        self.args = args
+        self.stdout = stdout
+        self.stderr = None
+        self.returncode = None  # type: Optional[int]
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                self.returncode = self.client.request('poll',
+                                                      pid=self.pid)['code']
+            except LauncherError:
+                pass
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = .001
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(delay)
+            delay = min(2 * delay, .1)
+        return self.returncode
+
+    def communicate(self, timeout: Optional[float] = None) \
+            -> Tuple[None, None]:
+        """The output of the process is not collected here, see
+        ipmininet.logpump"""
+        self.wait(timeout)
+        return None, None
+
+    def send_signal(self, sig: int):
+        if self.poll() is None:
+            try:
+                self.client.request('kill', pid=self.pid, signal=sig)
+            except LauncherError as e:
+                raise OSError(errno.ESRCH, str(e))
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+if __name__ == '__main__':
+    _Server(sys.argv[1]).serve()
@@ -1,13 +1,19 @@
 """Classes for interfaces and links that are IP-agnostic. This basically
 enhance the TCIntf class from Mininet, and then define sane defaults for the link
 classes."""
+from collections import OrderedDict
 from itertools import chain
+import os
 import subprocess
+import tempfile
 from ipaddress import ip_interface, IPv4Interface, IPv6Interface
 import functools
-from typing import Union, Tuple, Optional, Generator, Sequence, List, Type
+from typing import Union, Tuple, Optional, Generator, Sequence, List, Type, \
+    Dict, Iterable
 
 from . import OSPF_DEFAULT_AREA, MIN_IGP_METRIC
+from .lpm import AddressIndex
+from .netlink import netlink_for
 from .utils import otherIntf, is_container
 
 import mininet.link as _m
@@ -24,6 +30,8 @@ class IPIntf(_m.TCIntf):
         # by aliasing interfaces.
         self.broadcast_domain = None
         self.addresses = {4: [], 6: []}
+        # The index to keep informed of address changes, if any
+        self.address_index = None  # type: Optional[AddressIndex]
         self.ra_prefixes = kwargs.pop('ra', [])
         self.rdnss_list = kwargs.pop('rdnss', [])
         super().__init__(*args, **kwargs)
@@ -151,9 +159,7 @@ class IPIntf(_m.TCIntf):
             return None
         setv4 = setv6 = False
         lb_v4_update = lb_v6_update = False
-        # Make sure we have an up-to-date view of our addresses
-        self._refresh_addresses()
-        cmds = []
+        addrs = []  # type: List[Union[IPv4Interface, IPv6Interface]]
         # We want to iterate over the new ip sets
         if not is_container(ip):
             ip = (ip,)
@@ -167,9 +173,8 @@ class IPIntf(_m.TCIntf):
                     # no prefixLen defaults to full /128 or /32
                     addr = ip_interface(str(addr))
 
-            # Prepare assignment commands
-            cmds.append('ip address add dev %s %s'
-                        % (self.name, addr.with_prefixlen))
+            # Prepare assignments
+            addrs.append(addr)
             # Record assignment family
             if addr.version == 4:
                 setv4 = True
@@ -184,26 +189,105 @@ class IPIntf(_m.TCIntf):
         if setv6:
             cleanup.append(self.ip6s(exclude_lls=True,
                                      exclude_lbs=not lb_v6_update))
-        for old_ip in chain.from_iterable(cleanup):
-            self._del_ip(old_ip)
+        old_ips = list(chain.from_iterable(cleanup))
+        errors = [self._del_ip(old_ip) for old_ip in old_ips]
         # Assign IP
-        rval = [self.cmd(cmd) for cmd in cmds]
-        self._refresh_addresses()
+        rval = [self._add_ip(addr) for addr in addrs]
+        if any(errors) or any(rval):
+            # Our view of the addresses cannot be trusted anymore
+            self._refresh_addresses()
+        else:
+            self._record_addresses(added=addrs, removed=old_ips)
         return rval.pop() if rval and len(rval) == 1 else rval
 
-    def _del_ip(self, ip: Union[IPv4Interface, IPv6Interface]):
+    def _add_ip(self, ip: Union[IPv4Interface, IPv6Interface]) -> str:
+        """Assign an IP to this interface.
+        Does not update self.addresses!
+
+        :param ip: ip_interface-like
+        :return: the error message, if any"""
+        nl = netlink_for(self.node)
+        if nl is None:
+            return self.cmd('ip address add dev %s %s'
+                            % (self.name, ip.with_prefixlen))
+        try:
+            nl.add_address(self.name, ip)
+        except OSError as e:
+            return 'RTNETLINK answers: %s\n' % e.strerror
+        return ''
+
+    def _del_ip(self, ip: Union[IPv4Interface, IPv6Interface]) -> str:
         """Remove an assigned IP fom this interface.
         Does not update self.addresses!
 
-        :param ip: ip_interface-like"""
-        self.cmd('ip', 'address', 'del', 'dev', self.name, ip.with_prefixlen)
+        :param ip: ip_interface-like
+        :return: the error message, if any"""
+        nl = netlink_for(self.node)
+        if nl is None:
+            return self.cmd('ip', 'address', 'del', 'dev', self.name,
+                            ip.with_prefixlen)
+        try:
+            nl.del_address(self.name, ip)
+        except OSError as e:
+            log.debug('Cannot remove', ip, 'from', self.name, ':', e, '\n')
+            return 'RTNETLINK answers: %s\n' % e.strerror
+        return ''
 
     setIP = setIP6 = _set_ip
 
     def _refresh_addresses(self):
         """Request and parse the addresses of this interface"""
-        self.mac, self.addresses[4], self.addresses[6] = \
-            _addresses_of(self.name, self.node)
+        if getattr(self.node, 'offline', False):
+            # There is no kernel view to read, ours is authoritative
+            return
+        self._set_addresses(*_addresses_of(self.name, self.node))
+
+    def _set_addresses(self, mac: Optional[str],
+                       v4: Sequence[IPv4Interface],
+                       v6: Sequence[IPv6Interface]):
+        """Replace the address view of this interface. The lists are
+        replaced and never modified in place, so that a concurrent update
+        does not break the iteration over the addresses."""
+        self.mac = mac
+        self._replace_addresses(v4, v6)
+
+    def _record_addresses(self,
+                          added: Sequence[Union[IPv4Interface,
+                                                IPv6Interface]] = (),
+                          removed: Sequence[Union[IPv4Interface,
+                                                  IPv6Interface]] = ()):
+        """Update the address view of this interface with changes that
+        were applied to it, instead of reading it again from the kernel"""
+        addrs = {}
+        for v in (4, 6):
+            addrs[v] = [a for a in self.addresses[v] if a not in removed]
+            addrs[v].extend(a for a in added
+                            if a.version == v and a not in addrs[v])
+        self._replace_addresses(addrs[4], addrs[6])
+
+    def _replace_addresses(self, v4: Sequence[IPv4Interface],
+                           v6: Sequence[IPv6Interface]):
+        old = self.addresses[4] + self.addresses[6]
+        self.addresses[4] = sorted(v4, key=OrderedAddress, reverse=True)
+        self.addresses[6] = sorted(v6, key=OrderedAddress, reverse=True)
+        if self.address_index is not None:
+            new = self.addresses[4] + self.addresses[6]
+            self.address_index.update(
+                self, added=[a for a in new if a not in old],
+                removed=[a for a in old if a not in new])
+
+    def isUp(self, setUp=False) -> bool:
+        nl = netlink_for(self.node)
+        if nl is None:
+            return super().isUp(setUp=setUp)
+        try:
+            if setUp:
+                nl.set_link_up(self.name)
+                return True
+            return nl.link(self.name).is_up
+        except OSError as e:
+            log.error('Error setting %s up: %s ' % (self.name, e.strerror))
+            return False
 
     def updateIP(self) -> Optional[str]:
         self._refresh_addresses()
@@ -222,8 +306,55 @@ class IPIntf(_m.TCIntf):
         return self.ip, self.mac
 
 
+def refresh_addresses(nodes: Iterable[Node]):
+    """Read again the addresses of all the interfaces of the given nodes.
+    This requires a single netlink dump per node, instead of one request
+    per interface.
+
+    :param nodes: The nodes to refresh"""
+    for node in nodes:
+        intfs = [i for i in node.intfList() if isinstance(i, IPIntf)]
+        if not intfs:
+            continue
+        nl = netlink_for(node)
+        views = {}
+        if nl is not None:
+            try:
+                views = nl.all_addresses()
+            except OSError as e:
+                log.debug('Cannot dump the addresses of', node.name,
+                          'through netlink:', e, '\n')
+        for intf in intfs:
+            if intf.name in views:
+                intf._set_addresses(*views[intf.name])
+            else:
+                intf._refresh_addresses()
+
+
+def address_event(node: Node, devname: str,
+                  addr: Union[IPv4Interface, IPv6Interface], added: bool):
+    """Apply an address change reported by an AddressMonitor to the address
+    view of the corresponding interface"""
+    intf = node.nameToIntf.get(devname)
+    if isinstance(intf, IPIntf):
+        if added:
+            intf._record_addresses(added=(addr,))
+        else:
+            intf._record_addresses(removed=(addr,))
+
+
 def _addresses_of(devname: str, node: Optional[Node] = None):
     """Return the addresses of a named interface"""
+    nl = netlink_for(node)
+    if nl is not None:
+        try:
+            mac, v4, v6 = nl.addresses(devname)
+            return (mac,
+                    sorted(v4, key=OrderedAddress, reverse=True),
+                    sorted(v6, key=OrderedAddress, reverse=True))
+        except OSError as e:
+            log.debug('Cannot get the addresses of', devname, 'through '
+                      'netlink:', e, '\n')
     cmdline = ['ip', 'address', 'show', 'dev', devname]
     try:
         if node is not None:
@@ -269,6 +400,68 @@ def _parse_addresses(out: str) -> Tuple[Optional[str], List[IPv4Interface],
     return mac, v4, v6
 
 
+class AddressPlan:
+    """A set of addresses to assign to interfaces. Assignments are applied
+    at once for each node, with a single netlink transaction or a single
+    `ip -batch` command."""
+
+    def __init__(self):
+        self._assignments = \
+            OrderedDict()  # type: Dict[Node, Dict[IPIntf, List]]
+
+    def add(self, intf: IPIntf,
+            ips: Sequence[Union[IPv4Interface, IPv6Interface]]):
+        """Plan the assignment of new addresses to an interface
+
+        :param intf: The interface
+        :param ips: The ip_interface-like addresses to add"""
+        self._assignments.setdefault(intf.node, OrderedDict())\
+            .setdefault(intf, []).extend(ips)
+
+    def __len__(self):
+        return sum(len(ips) for intfs in self._assignments.values()
+                   for ips in intfs.values())
+
+    def apply(self):
+        """Assign all planned addresses, and update the address view of the
+        interfaces accordingly"""
+        for node, intfs in self._assignments.items():
+            assignments = [(intf, ip) for intf, ips in intfs.items()
+                           for ip in ips]
+            nl = netlink_for(node)
+            if nl is not None:
+                errors = nl.add_addresses([(intf.name, ip)
+                                           for intf, ip in assignments])
+                failed = {intf for (intf, _), err in zip(assignments, errors)
+                          if err is not None}
+            else:
+                failed = set(intfs) if self._ip_batch(node, assignments) \
+                    else set()
+            for intf, ips in intfs.items():
+                if intf in failed:
+                    log.error('Cannot assign', ips, 'to', intf.name, '\n')
+                    intf._refresh_addresses()
+                    continue
+                intf._record_addresses(added=ips)
+        self._assignments.clear()
+
+    @staticmethod
+    def _ip_batch(node: Node, assignments: Sequence[Tuple[IPIntf, Union[
+            IPv4Interface, IPv6Interface]]]) -> str:
+        """Assign the addresses with one ip command
+
+        :return: The error messages of the command, if any"""
+        with tempfile.NamedTemporaryFile('w', suffix='.ip', delete=False) \
+                as f:
+            for intf, ip in assignments:
+                f.write('address add dev %s %s\n'
+                        % (intf.name, ip.with_prefixlen))
+        try:
+            return node.cmd('ip', '-force', '-batch', f.name)
+        finally:
+            os.unlink(f.name)
+
+
 class IPLink(_m.Link):
     """A Link class that defaults to IPIntf"""
     def __init__(self, node1: str, node2: str, intf: Type[IPIntf] = IPIntf,
@@ -413,6 +606,17 @@ class GRETunnel:
         log.debug('Creating GRE tunnel named', name, ', for subnet',
                   str(address), 'from', if_local, '[', if_local.ip, '] to',
                   if_remote, '[', if_remote.ip, ']')
+        nl = netlink_for(if_local.node)
+        if nl is not None:
+            try:
+                nl.add_gre_tunnel(name, local=if_local.ip,
+                                  remote=if_remote.ip, ttl=ttl)
+                nl.set_link_up(name)
+                nl.add_address(name, ip_interface(str(address)))
+                return
+            except OSError as e:
+                log.debug('Cannot create the GRE tunnel', name, 'through '
+                          'netlink:', e, '\n')
         cmd = if_local.node.cmd
         cmd('ip', 'tunnel', 'add', name, 'mode', 'gre', 'remote', if_remote.ip,
             'local', if_local.ip, 'ttl', str(ttl))
@@ -426,4 +630,12 @@ class GRETunnel:
 
     @staticmethod
     def _del_tunnel(if_local: IPIntf, name: str):
+        nl = netlink_for(if_local.node)
+        if nl is not None:
+            try:
+                nl.del_link(name)
+                return
+            except OSError as e:
+                log.debug('Cannot delete the GRE tunnel', name, 'through '
+                          'netlink:', e, '\n')
         if_local.node.cmd('ip', 'tunnel', 'delete', name)
@@ -0,0 +1,190 @@
+"""This module drains the output of the daemons in the background, so that a
+daemon never blocks on a full pipe. A single thread reads the pipes of all
+the daemons, keeps their last lines in bounded ring buffers and optionally
+copies them to rotating files."""
+import codecs
+import collections
+import os
+import select
+import threading
+from typing import Deque, Dict, IO, List, Optional, Tuple, Union
+
+from mininet.log import lg as log
+
+# The number of lines of output kept in memory for each process
+MAX_LINES = 1000
+# The size (in bytes) of an output file before it is rotated
+MAX_BYTES = 1 << 20
+# The number of rotated output files that are kept
+BACKUPS = 2
+# The length of an incomplete line above which it is stored anyway
+_MAX_PARTIAL = 1 << 16
+
+
+class OutputLog:
+    """The output of a process, whose last lines are kept in a ring buffer
+    and that can be copied to a rotating file"""
+
+    def __init__(self, name: str, max_lines=MAX_LINES,
+                 path: Optional[str] = None, max_bytes=MAX_BYTES,
+                 backups=BACKUPS):
+        """:param name: The name of the process
+        :param max_lines: The number of lines kept in memory
+        :param path: The file where the output is copied, if any
+        :param max_bytes: The size of the file before it is rotated
+        :param backups: The number of rotated files kept, as path.1,
+                        path.2, ..."""
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lines = collections.deque(maxlen=max_lines)  # type: Deque[str]
+        self._partial = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._file = None  # type: Optional[IO[bytes]]
+        self._size = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def feed(self, data: bytes):
+        """Add some output of the process"""
+        self._write(data)
+        text = self._decoder.decode(data)
+        with self._lock:
+            *lines, self._partial = (self._partial + text).split('\n')
+            self._lines.extend(lines)
+            if len(self._partial) > _MAX_PARTIAL:
+                self._lines.append(self._partial)
+                self._partial = ''
+
+    def _write(self, data: bytes):
+        if self.path is None:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+                self._size = self._file.tell()
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+        except OSError as e:
+            log.warning('Cannot write the output of %s to %s: %s\n'
+                        % (self.name, self.path, e))
+            self._close_file()
+            self.path = None
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self.path, i + 1))
+        if self.backups:
+            os.replace(self.path, '%s.1' % self.path)
+        self._file = open(self.path, 'wb')
+        self._size = 0
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def close(self):
+        """Signal the end of the output"""
+        text = self._decoder.decode(b'', final=True)
+        with self._lock:
+            self._partial += text
+            if self._partial:
+                self._lines.append(self._partial)
+                self._partial = ''
+        self._close_file()
+        self._closed.set()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def tail(self, n: Optional[int] = None, wait: float = 0.) -> List[str]:
+        """Return the last lines of output
+
+        :param n: The number of lines, all the kept lines by default
+        :param wait: The time to wait for the end of the output, e.g. when
+                     the process has just exited"""
+        if wait > 0:
+            self._closed.wait(wait)
+        with self._lock:
+            lines = list(self._lines)
+            if self._partial:
+                lines.append(self._partial)
+                del lines[:len(lines) - self._lines.maxlen]
+        return lines if n is None else lines[max(len(lines) - n, 0):]
+
+
+class OutputPump:
+    """A thread reading the output of many processes"""
+
+    def __init__(self):
+        self._watched = {}  # type: Dict[int, Tuple[Union[IO, int], OutputLog]]
+        self._pending = []  # type: List[Tuple[Union[IO, int], OutputLog]]
+        self._lock = threading.Lock()
+        self._poller = select.poll()
+        self._wake_r, self._wake_w = os.pipe()
+        self._poller.register(self._wake_r, select.POLLIN)
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def watch(self, pipe: Union[IO, int], output: OutputLog):
+        """Start draining a pipe. The pipe is closed at its end.
+
+        :param pipe: The reading end of the pipe, or its file descriptor
+        :param output: The log receiving its content"""
+        fd = pipe if isinstance(pipe, int) else pipe.fileno()
+        os.set_blocking(fd, False)
+        with self._lock:
+            self._pending.append((pipe, output))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='output-pump',
+                                                daemon=True)
+                self._thread.start()
+        os.write(self._wake_w, b'\0')
+
+    def _register(self):
+        os.read(self._wake_r, 4096)
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for pipe, output in pending:
+            fd = pipe if isinstance(pipe, int) else pipe.fileno()
+            self._watched[fd] = (pipe, output)
+            self._poller.register(fd, select.POLLIN)
+
+    def _run(self):
+        while True:
+            for fd, _ in self._poller.poll():
+                if fd == self._wake_r:
+                    self._register()
+                    continue
+                pipe, output = self._watched[fd]
+                try:
+                    data = os.read(fd, 65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''
+                if data:
+                    output.feed(data)
+                    continue
+                self._poller.unregister(fd)
+                del self._watched[fd]
+                if isinstance(pipe, int):
+                    os.close(pipe)
+                else:
+                    pipe.close()
+                output.close()
+
+
+output_pump = OutputPump()
@@ -0,0 +1,135 @@
+"""A longest-prefix-match index of the addresses of the interfaces of a
+network, to find which node, interface or broadcast domain an IP address
+belongs to in a time proportional to its length."""
+import threading
+from ipaddress import ip_interface, IPv4Address, IPv6Address, \
+    IPv4Interface, IPv6Interface
+from typing import Dict, Iterable, List, Optional, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from ipmininet.link import IPIntf
+
+
+class _TrieNode:
+    __slots__ = ('children', 'value')
+
+    def __init__(self):
+        self.children = [None, None]  # type: List[Optional[_TrieNode]]
+        self.value = None  # type: Optional[Dict[IPIntf, int]]
+
+
+class PrefixTrie:
+    """A binary trie of prefixes, where each prefix holds the interfaces
+    having an address in it"""
+
+    def __init__(self, bits: int):
+        """:param bits: The length of the addresses"""
+        self.bits = bits
+        self.root = _TrieNode()
+
+    def _bit(self, key: int, depth: int) -> int:
+        return (key >> (self.bits - 1 - depth)) & 1
+
+    def add(self, key: int, prefixlen: int, intf: 'IPIntf'):
+        """Register an interface on a prefix
+
+        :param key: The prefix, as an integer
+        :param prefixlen: The length of the prefix
+        :param intf: The interface"""
+        node = self.root
+        for depth in range(prefixlen):
+            bit = self._bit(key, depth)
+            if node.children[bit] is None:
+                node.children[bit] = _TrieNode()
+            node = node.children[bit]
+        if node.value is None:
+            node.value = {}
+        node.value[intf] = node.value.get(intf, 0) + 1
+
+    def remove(self, key: int, prefixlen: int, intf: 'IPIntf'):
+        """Unregister an interface from a prefix, and prune the branches
+        that no longer hold any interface"""
+        path = [self.root]
+        for depth in range(prefixlen):
+            child = path[-1].children[self._bit(key, depth)]
+            if child is None:
+                return
+            path.append(child)
+        node = path[-1]
+        if node.value is None or intf not in node.value:
+            return
+        node.value[intf] -= 1
+        if not node.value[intf]:
+            del node.value[intf]
+        if not node.value:
+            node.value = None
+        for depth in range(prefixlen, 0, -1):
+            node = path[depth]
+            if node.value is not None or any(node.children):
+                break
+            path[depth - 1].children[self._bit(key, depth - 1)] = None
+
+    def longest_match(self, key: int) -> List['IPIntf']:
+        """Return the interfaces of the longest prefix containing an
+        address"""
+        node = self.root
+        best = node.value
+        for depth in range(self.bits):
+            node = node.children[self._bit(key, depth)]
+            if node is None:
+                break
+            if node.value is not None:
+                best = node.value
+        return list(best) if best else []
+
+
+class AddressIndex:
+    """Index the addresses of interfaces, as well as the subnets of these
+    addresses. A lookup returns the interfaces owning the address if any,
+    or the interfaces of the most specific subnet containing it."""
+
+    def __init__(self):
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self._lock = threading.Lock()
+
+    def _entries(self, addr: Union[IPv4Interface, IPv6Interface]):
+        # The address itself and its subnet
+        yield int(addr.ip), addr.max_prefixlen
+        yield int(addr.network.network_address), addr.network.prefixlen
+
+    def update(self, intf: 'IPIntf',
+               added: Iterable[Union[IPv4Interface, IPv6Interface]] = (),
+               removed: Iterable[Union[IPv4Interface, IPv6Interface]] = ()):
+        """Record address changes on an interface
+
+        :param intf: The interface
+        :param added: The new addresses of the interface
+        :param removed: The addresses that were removed from the interface"""
+        with self._lock:
+            for addr in removed:
+                trie = self._tries[addr.version]
+                for key, prefixlen in self._entries(addr):
+                    trie.remove(key, prefixlen, intf)
+            for addr in added:
+                trie = self._tries[addr.version]
+                for key, prefixlen in self._entries(addr):
+                    trie.add(key, prefixlen, intf)
+
+    def attach(self, intf: 'IPIntf'):
+        """Index the addresses of an interface, and keep following them
+
+        :param intf: The interface"""
+        intf.address_index = self
+        self.update(intf, added=intf.addresses[4] + intf.addresses[6])
+
+    def lookup(self, ip: Union[str, IPv4Address, IPv6Address,
+                               IPv4Interface, IPv6Interface]) \
+            -> List['IPIntf']:
+        """Return the interfaces matching an address
+
+        :param ip: The address, possibly with a prefix length that is
+                   ignored
+        :raise ValueError: if ip is not a valid address"""
+        addr = ip_interface(str(ip)).ip
+        with self._lock:
+            return self._tries[addr.version].longest_match(int(addr))
@@ -0,0 +1,586 @@
+"""A minimal rtnetlink client to manage the links and addresses of the nodes
+from within our process, i.e. without spawning an `ip` process for each
+operation. The sockets are opened in the network namespace of the nodes by
+temporarily entering it with setns(2)."""
+import ctypes
+import errno
+import os
+import select
+import socket
+import struct
+import threading
+import weakref
+from contextlib import contextmanager
+from ipaddress import ip_address, ip_interface, IPv4Interface, IPv6Interface
+from typing import Callable, Dict, List, Optional, Tuple, Union, \
+    MutableMapping, Sequence
+
+from mininet.log import lg as log
+from mininet.node import Node
+
+from .utils import libc
+
+# Set this to False to manage addresses and links with the ip command
+ENABLED = True
+
+CLONE_NEWNET = 0x40000000
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3fff
+
+IFF_UP = 0x1
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+IFLA_GRE_LOCAL = 6
+IFLA_GRE_REMOTE = 7
+IFLA_GRE_TTL = 8
+IFLA_GRE_PMTUDISC = 10
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+# The number of requests sent at once, to not overflow the receive buffer
+# with the corresponding acknowledgments
+BATCH_SIZE = 64
+
+_NLMSGHDR = struct.Struct('=LHHLL')
+_NLMSGERR = struct.Struct('=i')
+_IFINFOMSG = struct.Struct('=BxHiII')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTATTR = struct.Struct('=HH')
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _attr(kind: int, payload: bytes) -> bytes:
+    """Encode a netlink attribute"""
+    length = _RTATTR.size + len(payload)
+    return _RTATTR.pack(length, kind) + payload \
+        + b'\0' * (_align(length) - length)
+
+
+def _parse_attrs(data: bytes, offset=0) -> Dict[int, bytes]:
+    """Decode a sequence of netlink attributes"""
+    attrs = {}
+    while offset + _RTATTR.size <= len(data):
+        length, kind = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[kind & NLA_TYPE_MASK] = data[offset + _RTATTR.size:
+                                           offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def _format_lladdr(raw: bytes) -> str:
+    """Format a link-layer address as the ip command does"""
+    if len(raw) == 4:
+        return str(ip_address(raw))
+    return ':'.join('%02x' % b for b in raw)
+
+
+class Link:
+    """A network device, as described by the kernel"""
+
+    def __init__(self, index: int, name: str, flags: int,
+                 mac: Optional[str]):
+        self.index = index
+        self.name = name
+        self.flags = flags
+        self.mac = mac
+
+    @property
+    def is_up(self) -> bool:
+        return bool(self.flags & IFF_UP)
+
+
+class NetlinkSocket:
+    """A rtnetlink socket bound to a given network namespace"""
+
+    def __init__(self, sock: socket.socket):
+        """:param sock: The underlying NETLINK_ROUTE socket"""
+        self._sock = sock
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, pid: Optional[int] = None) -> 'NetlinkSocket':
+        """Open a socket in the network namespace of a process
+
+        :param pid: The process id, None for the current namespace
+        :raise OSError: if the namespace cannot be entered"""
+        if pid is None:
+            return cls(_rtnl_socket())
+        with _netns_of(pid):
+            return cls(_rtnl_socket())
+
+    def close(self):
+        self._sock.close()
+
+    def _request(self, msg_type: int, flags: int, payload: bytes) \
+            -> List[Tuple[int, bytes]]:
+        """Send a request and collect the replies
+
+        :return: The list of (message type, message body) received
+        :raise OSError: if the kernel reports an error"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            self._sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(payload),
+                                           msg_type, flags | NLM_F_REQUEST,
+                                           seq, 0) + payload)
+            replies = []
+            while True:
+                data = self._sock.recv(65536)
+                offset = 0
+                while offset + _NLMSGHDR.size <= len(data):
+                    length, kind, mflags, mseq, _ = \
+                        _NLMSGHDR.unpack_from(data, offset)
+                    if length < _NLMSGHDR.size:
+                        break
+                    body = data[offset + _NLMSGHDR.size:offset + length]
+                    offset += _align(length)
+                    if mseq != seq:
+                        continue
+                    if kind == NLMSG_DONE:
+                        return replies
+                    if kind == NLMSG_ERROR:
+                        code = -_NLMSGERR.unpack_from(body)[0]
+                        if code:
+                            raise OSError(code, os.strerror(code))
+                        return replies  # Acknowledgment
+                    replies.append((kind, body))
+                    if not mflags & NLM_F_MULTI and not flags & NLM_F_ACK:
+                        return replies
+
+    def _batch(self, requests: Sequence[Tuple[int, int, bytes]]) \
+            -> List[Optional[OSError]]:
+        """Send several requests in a row and wait for their acknowledgments
+
+        :param requests: A list of (message type, flags, message body)
+        :return: The error reported for each request, if any"""
+        errors = []  # type: List[Optional[OSError]]
+        with self._lock:
+            for start in range(0, len(requests), BATCH_SIZE):
+                chunk = requests[start:start + BATCH_SIZE]
+                seqs = []
+                msgs = []
+                for msg_type, flags, payload in chunk:
+                    self._seq += 1
+                    seqs.append(self._seq)
+                    msgs.append(_NLMSGHDR.pack(
+                        _NLMSGHDR.size + len(payload), msg_type,
+                        flags | NLM_F_REQUEST | NLM_F_ACK, self._seq, 0)
+                        + payload)
+                self._sock.send(b''.join(msgs))
+                results = {}  # type: Dict[int, Optional[OSError]]
+                while len(results) < len(seqs):
+                    data = self._sock.recv(65536)
+                    offset = 0
+                    while offset + _NLMSGHDR.size <= len(data):
+                        length, kind, _, mseq, _ = \
+                            _NLMSGHDR.unpack_from(data, offset)
+                        if length < _NLMSGHDR.size:
+                            break
+                        body = data[offset + _NLMSGHDR.size:offset + length]
+                        offset += _align(length)
+                        if kind != NLMSG_ERROR or mseq not in seqs:
+                            continue
+                        code = -_NLMSGERR.unpack_from(body)[0]
+                        results[mseq] = OSError(code, os.strerror(code)) \
+                            if code else None
+                errors.extend(results[seq] for seq in seqs)
+        return errors
+
+    @staticmethod
+    def _parse_link(body: bytes) -> Link:
+        _, _, index, flags, _ = _IFINFOMSG.unpack_from(body)
+        attrs = _parse_attrs(body, _IFINFOMSG.size)
+        mac = attrs.get(IFLA_ADDRESS)
+        return Link(index=index,
+                    name=attrs.get(IFLA_IFNAME, b'').rstrip(b'\0').decode(),
+                    flags=flags,
+                    mac=_format_lladdr(mac) if mac is not None else None)
+
+    def link(self, name: str) -> Link:
+        """Return the device with the given name
+
+        :raise OSError: if the device does not exist"""
+        replies = self._request(RTM_GETLINK, 0,
+                                _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+                                + _attr(IFLA_IFNAME, name.encode() + b'\0'))
+        for kind, body in replies:
+            if kind == RTM_NEWLINK:
+                return self._parse_link(body)
+        raise OSError(19, os.strerror(19))  # ENODEV
+
+    def links(self) -> List[Link]:
+        """Return all the devices of the namespace"""
+        return [self._parse_link(body) for kind, body
+                in self._request(RTM_GETLINK, NLM_F_DUMP,
+                                 _IFINFOMSG.pack(socket.AF_UNSPEC,
+                                                 0, 0, 0, 0))
+                if kind == RTM_NEWLINK]
+
+    @staticmethod
+    def _parse_address(body: bytes) \
+            -> Tuple[int, Optional[Union[IPv4Interface, IPv6Interface]]]:
+        """Decode an address message
+
+        :return: The index of the device and the address"""
+        _, prefixlen, _, _, index = _IFADDRMSG.unpack_from(body)
+        attrs = _parse_attrs(body, _IFADDRMSG.size)
+        raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        if raw is None:
+            return index, None
+        return index, ip_interface('%s/%d' % (ip_address(raw), prefixlen))
+
+    def _dump_addresses(self) \
+            -> List[Tuple[int, Union[IPv4Interface, IPv6Interface]]]:
+        dump = []
+        for kind, body in self._request(RTM_GETADDR, NLM_F_DUMP,
+                                        _IFADDRMSG.pack(socket.AF_UNSPEC,
+                                                        0, 0, 0, 0)):
+            if kind != RTM_NEWADDR:
+                continue
+            index, addr = self._parse_address(body)
+            if addr is not None:
+                dump.append((index, addr))
+        return dump
+
+    def addresses(self, name: str) \
+            -> Tuple[Optional[str], List[IPv4Interface], List[IPv6Interface]]:
+        """Return the addresses of a device
+
+        :return: mac, [ipv4], [ipv6]"""
+        link = self.link(name)
+        v4 = []
+        v6 = []
+        for index, addr in self._dump_addresses():
+            if index == link.index:
+                (v4 if addr.version == 4 else v6).append(addr)
+        return link.mac, v4, v6
+
+    def all_addresses(self) -> Dict[str, Tuple[
+            Optional[str], List[IPv4Interface], List[IPv6Interface]]]:
+        """Return the addresses of all the devices of the namespace, with
+        a single dump of the links and one of the addresses
+
+        :return: {device name: (mac, [ipv4], [ipv6])}"""
+        links = {link.index: link for link in self.links()}
+        views = {link.name: (link.mac, [], []) for link in links.values()}
+        for index, addr in self._dump_addresses():
+            if index in links:
+                _, v4, v6 = views[links[index].name]
+                (v4 if addr.version == 4 else v6).append(addr)
+        return views
+
+    @staticmethod
+    def _address_msg(index: int, addr: Union[IPv4Interface, IPv6Interface]) \
+            -> bytes:
+        family = socket.AF_INET if addr.version == 4 else socket.AF_INET6
+        packed = addr.ip.packed
+        return _IFADDRMSG.pack(family, addr.network.prefixlen, 0, 0, index) \
+            + _attr(IFA_LOCAL, packed) + _attr(IFA_ADDRESS, packed)
+
+    def _change_address(self, msg_type: int, flags: int, name: str,
+                        addr: Union[IPv4Interface, IPv6Interface]):
+        self._request(msg_type, NLM_F_ACK | flags,
+                      self._address_msg(self.link(name).index, addr))
+
+    def add_addresses(self, assignments: Sequence[Tuple[str, Union[
+            IPv4Interface, IPv6Interface]]]) -> List[Optional[OSError]]:
+        """Assign many addresses at once, as `ip -batch`
+
+        :param assignments: A list of (device name, address)
+        :return: The error that occurred for each assignment, if any"""
+        indexes = {link.name: link.index for link in self.links()}
+        requests = []
+        errors = {}  # type: Dict[int, OSError]
+        for i, (name, addr) in enumerate(assignments):
+            try:
+                requests.append((RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL,
+                                 self._address_msg(indexes[name], addr)))
+            except KeyError:
+                errors[i] = OSError(19, os.strerror(19))  # ENODEV
+        results = iter(self._batch(requests))
+        return [errors[i] if i in errors else next(results)
+                for i in range(len(assignments))]
+
+    def add_address(self, name: str,
+                    addr: Union[IPv4Interface, IPv6Interface]):
+        """Assign an address to a device, as `ip address add`"""
+        self._change_address(RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, name,
+                             addr)
+
+    def del_address(self, name: str,
+                    addr: Union[IPv4Interface, IPv6Interface]):
+        """Remove an address from a device, as `ip address del`"""
+        self._change_address(RTM_DELADDR, 0, name, addr)
+
+    def set_link_up(self, name: str, up=True):
+        """Change the administrative state of a device"""
+        self._request(RTM_NEWLINK, NLM_F_ACK,
+                      _IFINFOMSG.pack(socket.AF_UNSPEC, 0,
+                                      self.link(name).index,
+                                      IFF_UP if up else 0, IFF_UP))
+
+    def add_gre_tunnel(self, name: str, local: str, remote: str, ttl=255):
+        """Create a GRE tunnel device, as `ip tunnel add mode gre`"""
+        data = _attr(IFLA_GRE_LOCAL, ip_address(local).packed) \
+            + _attr(IFLA_GRE_REMOTE, ip_address(remote).packed) \
+            + _attr(IFLA_GRE_TTL, struct.pack('=B', ttl)) \
+            + _attr(IFLA_GRE_PMTUDISC, struct.pack('=B', 1))
+        info = _attr(IFLA_INFO_KIND, b'gre\0') \
+            + _attr(IFLA_INFO_DATA | NLA_F_NESTED, data)
+        self._request(RTM_NEWLINK, NLM_F_ACK | NLM_F_CREATE | NLM_F_EXCL,
+                      _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+                      + _attr(IFLA_IFNAME, name.encode() + b'\0')
+                      + _attr(IFLA_LINKINFO | NLA_F_NESTED, info))
+
+    def del_link(self, name: str):
+        """Delete a device"""
+        self._request(RTM_DELLINK, NLM_F_ACK,
+                      _IFINFOMSG.pack(socket.AF_UNSPEC, 0,
+                                      self.link(name).index, 0, 0))
+
+
+def _rtnl_socket(groups=0) -> socket.socket:
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    sock.bind((0, groups))
+    return sock
+
+
+@contextmanager
+def _netns_of(pid: int):
+    """Move the current thread in the network namespace of a process for the
+    duration of the context"""
+    c = libc()
+    if c is None or not hasattr(c, 'setns'):
+        raise OSError(38, 'setns() is not available')  # ENOSYS
+    # The namespace of the calling thread, not of the main one
+    own = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+    try:
+        target = os.open('/proc/%d/ns/net' % pid, os.O_RDONLY)
+        try:
+            if c.setns(target, CLONE_NEWNET) != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            try:
+                yield
+            finally:
+                if c.setns(own, CLONE_NEWNET) != 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, 'Cannot go back to the original '
+                                       'network namespace: %s'
+                                  % os.strerror(err))
+        finally:
+            os.close(target)
+    finally:
+        os.close(own)
+
+
+# The sockets of each node, False if netlink cannot be used for that node
+_sockets = weakref.WeakKeyDictionary() \
+    # type: MutableMapping[Node, Union[NetlinkSocket, bool]]
+_root_socket = None  # type: Union[None, NetlinkSocket, bool]
+_sockets_lock = threading.Lock()
+
+
+def netlink_for(node: Optional[Node] = None) -> Optional[NetlinkSocket]:
+    """Return the netlink socket to manage the network namespace of a node
+
+    :param node: The node, or None for the root namespace
+    :return: The socket or None if netlink cannot be used"""
+    global _root_socket
+    if not ENABLED:
+        return None
+    if node is not None and getattr(node, 'offline', False):
+        return None  # The node has no network namespace
+    root = node is None or not node.inNamespace
+    with _sockets_lock:
+        sock = _root_socket if root else _sockets.get(node)
+        if sock is None:
+            try:
+                sock = NetlinkSocket.open(None if root else node.pid)
+            except OSError as e:
+                log.debug('Cannot use netlink for %s, falling back to the ip '
+                          'command: %s\n' % (node if node else 'root', e))
+                sock = False
+            if root:
+                _root_socket = sock
+            else:
+                _sockets[node] = sock
+    return sock if sock else None
+
+
+def release_netlink(node: Node):
+    """Close the netlink socket of a node. This has to be done when the node
+    is stopped as the socket keeps its network namespace alive."""
+    with _sockets_lock:
+        sock = _sockets.pop(node, None)
+    if sock:
+        sock.close()
+
+
+class AddressMonitor:
+    """Follow the address changes in the network namespaces of several nodes,
+    from a single thread, and report them to a callback"""
+
+    def __init__(self,
+                 callback: Callable[[Node, str, Union[IPv4Interface,
+                                                      IPv6Interface], bool],
+                                    None],
+                 resync: Optional[Callable[[Node], None]] = None):
+        """:param callback: The function called with the node, the device
+                            name, the address and whether the address was
+                            added (True) or removed (False)
+        :param resync: The function called with a node when some of its
+                       events were lost, e.g. because the receive buffer
+                       overflowed"""
+        self.callback = callback
+        self.resync = resync
+        self._sockets = {}  # type: Dict[int, Tuple[Node, socket.socket]]
+        self._names = {}  # type: Dict[Node, Dict[int, str]]
+        self._poller = select.poll()
+        self._wake_r, self._wake_w = os.pipe()
+        self._poller.register(self._wake_r, select.POLLIN)
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def watch(self, node: Node) -> bool:
+        """Start following the address changes of a node
+
+        :return: Whether the node can be monitored"""
+        groups = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR
+        try:
+            if node.inNamespace:
+                with _netns_of(node.pid):
+                    sock = _rtnl_socket(groups)
+            else:
+                sock = _rtnl_socket(groups)
+        except OSError as e:
+            log.warning('Cannot monitor the addresses of %s: %s\n'
+                        % (node, e))
+            return False
+        self._names[node] = {}
+        self._sockets[sock.fileno()] = (node, sock)
+        self._poller.register(sock.fileno(), select.POLLIN)
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name='address-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the monitoring thread and close the sockets, as they keep the
+        namespaces of the nodes alive"""
+        if self._thread is not None:
+            os.write(self._wake_w, b'\0')
+            self._thread.join()
+            self._thread = None
+        for _, sock in self._sockets.values():
+            sock.close()
+        self._sockets.clear()
+        self._names.clear()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run(self):
+        while True:
+            for fd, _ in self._poller.poll():
+                if fd == self._wake_r:
+                    return
+                node, sock = self._sockets[fd]
+                try:
+                    data = sock.recv(65536)
+                except OSError as e:
+                    if e.errno == errno.ENOBUFS:
+                        log.debug('Lost address events of %s\n' % node)
+                        self._names[node].clear()
+                    else:
+                        # The socket is unusable, the addresses of the node
+                        # are now only refreshed on demand
+                        log.error('Stopped monitoring the addresses of %s: '
+                                  '%s\n' % (node, e))
+                        self._unwatch(fd)
+                    self._resync(node)
+                    continue
+                self._handle(node, data)
+
+    def _unwatch(self, fd: int):
+        node, sock = self._sockets.pop(fd)
+        self._poller.unregister(fd)
+        sock.close()
+        self._names.pop(node, None)
+
+    def _resync(self, node: Node):
+        if self.resync is None:
+            return
+        try:
+            self.resync(node)
+        except Exception as e:
+            log.error('Cannot resynchronize the addresses of %s: %s\n'
+                      % (node, e))
+
+    def _handle(self, node: Node, data: bytes):
+        names = self._names[node]
+        offset = 0
+        while offset + _NLMSGHDR.size <= len(data):
+            length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+            if length < _NLMSGHDR.size:
+                break
+            body = data[offset + _NLMSGHDR.size:offset + length]
+            offset += _align(length)
+            if kind == RTM_NEWLINK:
+                link = NetlinkSocket._parse_link(body)
+                names[link.index] = link.name
+            elif kind == RTM_DELLINK:
+                names.pop(NetlinkSocket._parse_link(body).index, None)
+            elif kind in (RTM_NEWADDR, RTM_DELADDR):
+                index, addr = NetlinkSocket._parse_address(body)
+                if addr is None:
+                    continue
+                name = names.get(index)
+                if name is None:
+                    name = self._resolve(node, index)
+                if name is not None:
+                    self.callback(node, name, addr, kind == RTM_NEWADDR)
+
+    def _resolve(self, node: Node, index: int) -> Optional[str]:
+        """Return the name of a device that we did not hear about yet"""
+        nl = netlink_for(node)
+        if nl is None:
+            return None
+        try:
+            self._names[node].update((link.index, link.name)
+                                     for link in nl.links())
+        except OSError:
+            return None
+        return self._names[node].get(index)
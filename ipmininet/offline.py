@@ -0,0 +1,133 @@
+"""Generate the configuration files of a topology without building the
+network. The nodes are stand-ins that have no network namespace, no shell
+and no interface in the kernel, so that neither root privileges nor the
+daemons themselves are required."""
+import functools
+import os
+from typing import Dict, Tuple, Type
+
+from .ipnet import IPNet
+from .iptopo import IPTopo
+from .router import IPNode
+
+from mininet.log import lg as log
+from mininet.net import Mininet
+from mininet.node import Node
+
+
+class OfflineNode:
+    """A mixin replacing the shell of a node by a stand-in: commands are
+    not executed and have an empty output"""
+
+    offline = True
+
+    @classmethod
+    def checkSetup(cls):
+        """The node does not need any executable"""
+
+    def startShell(self, mnopts=None):
+        """There is no shell to start"""
+
+    def mountPrivateDirs(self):
+        """The private directories are not mounted"""
+
+    def unmountPrivateDirs(self):
+        """The private directories are not mounted"""
+
+    def cmd(self, *args, **kwargs) -> str:
+        return ''
+
+    def pexec(self, *args, **kwargs) -> Tuple[str, str, int]:
+        return '', '', 0
+
+    def popen(self, *args, **kwargs):
+        raise RuntimeError('%s is offline and cannot run %s'
+                           % (self.name, ' '.join(map(str, args))))
+
+    def terminate(self):
+        """Nothing is running, and the generated files are kept"""
+
+
+@functools.lru_cache(maxsize=None)
+def offline_class(cls: Type[Node]) -> Type[Node]:
+    """Return the offline version of a node class"""
+    if getattr(cls, 'offline', False):
+        return cls
+    return type('Offline%s' % cls.__name__, (OfflineNode, cls), {})
+
+
+class OfflineIPNet(IPNet):
+    """An IPNet made of stand-in nodes, which writes the configuration files
+    of its nodes in a directory instead of starting them"""
+
+    def __init__(self, directory: str, *args, **kwargs):
+        """:param directory: The directory where the configuration files
+                             are written, along with their manifest"""
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        kwargs['monitor_addresses'] = False
+        kwargs.setdefault('config_manifest',
+                          os.path.join(self.directory, 'manifest.json'))
+        # Mininet requires root privileges, which we do not need
+        inited = Mininet.inited
+        Mininet.inited = True
+        try:
+            super().__init__(*args, **kwargs)
+        finally:
+            Mininet.inited = inited
+
+    def addRouter(self, name: str, cls=None, **params):
+        params['cwd'] = self.directory
+        cls = offline_class(cls or self.router)
+        return super().addRouter(name, cls=cls, **params)
+
+    def addHost(self, name: str, cls=None, **params):
+        params['cwd'] = self.directory
+        cls = offline_class(cls or self.host)
+        return super().addHost(name, cls=cls, **params)
+
+    def addSwitch(self, name: str, cls=None, **params):
+        cls = offline_class(cls or self.switch)
+        return super().addSwitch(name, cls=cls, **params)
+
+    def buildFromTopo(self, topo):
+        super().buildFromTopo(topo)
+        if self.physical_interface:
+            log.warning('*** Ignoring the physical interfaces of an offline'
+                        ' network\n')
+            self.physical_interface.clear()
+
+    def generate(self) -> Dict[str, Exception]:
+        """Write the configuration files of every node
+
+        :return: The errors that prevented the configuration of some nodes,
+                 indexed by node name"""
+        if not self.built:
+            self.build()
+        self.update_hosts_tables()
+        nodes = [n for n in self.values() if isinstance(n, IPNode)]
+        failures = self._render_configs(nodes)
+        for name, e in failures.items():
+            log.error('*** Cannot configure', name, ':', e, '\n')
+        return failures
+
+    def start(self):
+        raise RuntimeError('An offline network cannot be started, use '
+                           'generate() to write its configuration files')
+
+
+def generate_configs(topo: IPTopo, directory: str, **kwargs) \
+        -> Dict[str, Exception]:
+    """Write the configuration files of all the nodes of a topology in a
+    directory, without building the network
+
+    :param topo: The topology
+    :param directory: The output directory, created if needed
+    :param kwargs: Additional arguments for the network, see IPNet
+    :return: The errors that prevented the configuration of some nodes,
+             indexed by node name"""
+    net = OfflineIPNet(directory, topo=topo, **kwargs)
+    try:
+        return net.generate()
+    finally:
+        net.stop()
@@ -0,0 +1,233 @@
+"""This module provides the tools to wait until a daemon is ready, e.g. until
+it listens on its API socket, without busy-waiting on its state."""
+import abc
+import os
+import select
+import socket
+import subprocess
+import time
+from typing import Callable, Iterable, Optional, Sequence
+
+from mininet.log import lg as log
+
+from .utils import libc
+
+# inotify(7) events signaling that a file appeared or changed in a directory
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+
+class ReadinessError(RuntimeError):
+    """Raised when a process did not become ready in time"""
+
+
+class ReadinessProbe(metaclass=abc.ABCMeta):
+    """A check telling whether some part of a process is ready"""
+
+    @property
+    def paths(self) -> Sequence[str]:
+        """The paths whose creation or modification may change the outcome
+        of this probe"""
+        return ()
+
+    @abc.abstractmethod
+    def ready(self) -> bool:
+        """Return whether the probed element is ready"""
+
+    def diagnose(self) -> str:
+        """Return a description of the current state of the probed element"""
+        return str(self)
+
+
+class PathProbe(ReadinessProbe):
+    """Ready as soon as a file (e.g. a pid file) exists"""
+
+    def __init__(self, path: str):
+        """:param path: The path of the file"""
+        self.path = path
+
+    @property
+    def paths(self):
+        return (self.path,)
+
+    def ready(self):
+        return os.path.exists(self.path)
+
+    def diagnose(self):
+        return '%s %s' % (self.path, 'exists' if self.ready()
+                          else 'does not exist')
+
+    def __str__(self):
+        return '<file %s>' % self.path
+
+
+class UnixSocketProbe(PathProbe):
+    """Ready as soon as a unix socket accepts connections"""
+
+    def ready(self):
+        if not super().ready():
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            return True
+        except socket.error:
+            return False
+        finally:
+            sock.close()
+
+    def diagnose(self):
+        if not os.path.exists(self.path):
+            return '%s does not exist' % self.path
+        return '%s %s' % (self.path, 'accepts connections' if self.ready()
+                          else 'refuses connections')
+
+    def __str__(self):
+        return '<unix socket %s>' % self.path
+
+
+class CallableProbe(ReadinessProbe):
+    """Ready as soon as a function returns True"""
+
+    def __init__(self, func: Callable[[], bool],
+                 description: Optional[str] = None,
+                 paths: Sequence[str] = ()):
+        """:param func: The function to call
+        :param description: A description of the check
+        :param paths: The paths that may change the outcome of the check"""
+        self.func = func
+        self.description = description if description else repr(func)
+        self._paths = tuple(paths)
+
+    @property
+    def paths(self):
+        return self._paths
+
+    def ready(self):
+        return bool(self.func())
+
+    def diagnose(self):
+        return '%s returned False' % self.description
+
+    def __str__(self):
+        return '<check %s>' % self.description
+
+
+class PathWatcher:
+    """Wait for changes in the directories containing a set of paths.
+    This relies on inotify when available and sleeps otherwise."""
+
+    def __init__(self, paths: Iterable[str]):
+        """:param paths: The paths to watch"""
+        self.fd = -1
+        self.poller = None
+        dirs = {os.path.dirname(os.path.abspath(p)) for p in paths}
+        c = libc()
+        if not dirs or c is None or not hasattr(c, 'inotify_init1'):
+            return
+        fd = c.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        watched = 0
+        for d in dirs:
+            if c.inotify_add_watch(fd, os.fsencode(d), _IN_MASK) >= 0:
+                watched += 1
+        if not watched:
+            os.close(fd)
+            return
+        self.fd = fd
+        self.poller = select.poll()
+        self.poller.register(fd, select.POLLIN)
+
+    def wait(self, timeout: float):
+        """Wait until a watched directory changes or the timeout expires
+
+        :param timeout: The maximal time to wait, in seconds"""
+        if self.poller is None:
+            time.sleep(timeout)
+            return
+        if self.poller.poll(max(0, int(timeout * 1000))):
+            try:
+                # Drain the pending events, we only care about the wake-up
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+            self.poller = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _process_state(process: Optional[subprocess.Popen],
+                   output: Optional[Callable[[], Sequence[str]]] = None) \
+        -> str:
+    if process is None:
+        return 'unknown'
+    code = process.poll()
+    if code is None:
+        return 'running (pid %d)' % process.pid
+    label = 'stderr'
+    if output is not None:
+        label, err = 'output', '\n'.join(output())
+    else:
+        try:
+            _, err = process.communicate(timeout=1)
+        except (subprocess.TimeoutExpired, ValueError, OSError):
+            err = None
+    if isinstance(err, bytes):
+        err = err.decode('utf-8', 'replace')
+    return 'exited with code %d%s' % (code, '\n%s: %s' % (label, err.strip())
+                                      if err else '')
+
+
+def wait_ready(probes: Sequence[ReadinessProbe], timeout=60.,
+               process: Optional[subprocess.Popen] = None, name='process',
+               initial_delay=.001, max_delay=.256,
+               output: Optional[Callable[[], Sequence[str]]] = None):
+    """Wait until all probes succeed. Probes are re-evaluated whenever a
+    file changes next to one of their paths, or after an exponentially
+    increasing delay otherwise.
+
+    :param probes: The probes to wait for
+    :param timeout: The maximal time to wait, in seconds
+    :param process: The process that should make the probes succeed. We fail
+                    early if it exits with a non-zero code.
+    :param name: The name of the waited element, used in errors
+    :param initial_delay: The first delay between two evaluations of probes
+    :param max_delay: The maximal delay between two evaluations of probes
+    :param output: A function returning the last lines of output of the
+                   process, if they are not read from its pipes
+    :raise ReadinessError: if the probes did not succeed in time"""
+    pending = [p for p in probes if not p.ready()]
+    if not pending:
+        return
+    start = time.monotonic()
+    delay = initial_delay
+    with PathWatcher(path for p in pending for path in p.paths) as watcher:
+        while pending:
+            elapsed = time.monotonic() - start
+            failed = process is not None and process.poll() not in (None, 0)
+            if failed or elapsed >= timeout:
+                msg = '%s is not ready after %.3fs (%s)\n' \
+                      'process: %s\n' \
+                      % (name, elapsed, 'process failed' if failed
+                         else 'timeout', _process_state(process, output))
+                msg += '\n'.join('probe %s: %s' % (p, p.diagnose())
+                                 for p in pending)
+                log.error(msg + '\n')
+                raise ReadinessError(msg)
+            watcher.wait(min(delay, timeout - elapsed))
+            delay = min(2 * delay, max_delay)
+            pending = [p for p in pending if not p.ready()]
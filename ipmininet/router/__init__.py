@@ -1,6 +1,8 @@
 """This module defines a modular router that is able to support
    multiple daemons
 """
-from .__router import Router, ProcessHelper, IPNode
+from .__router import Router, ProcessHelper, ForkServerHelper, IPNode, \
+    NodeStartError
 
-__all__ = ['IPNode', 'Router', 'ProcessHelper']
+__all__ = ['IPNode', 'Router', 'ProcessHelper', 'ForkServerHelper',
+           'NodeStartError']
@@ -1,33 +1,71 @@
 """This modules defines a L3 router class,
    with a modular config system."""
+import functools
+import os
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 from ipaddress import IPv4Interface, IPv6Interface
 from typing import Type, Optional, Tuple, Union, Dict, List, Sequence, Set
 
-from ipmininet import DEBUG_FLAG
+from ipmininet import DEBUG_FLAG, launcher
 from ipmininet.utils import L3Router, realIntfList, otherIntf
 from ipmininet.link import IPIntf
+from ipmininet.logpump import OutputLog, output_pump
+from ipmininet.supervisor import ProcessExit, ProcessHistory, \
+    ResourceSample, RestartPolicy, SAMPLE_INTERVAL, sample_process, supervisor
+from ipmininet.netlink import release_netlink
+from ipmininet.readiness import ReadinessError, wait_ready
 from .config import BasicRouterConfig, NodeConfig, RouterConfig
 
-import mininet.clean
 from mininet.node import Node, Host
 from mininet.log import lg
 import shlex
 
 
+class NodeStartError(RuntimeError):
+    """Raised when a node cannot be started, e.g. because the configuration
+    check of some of its daemons failed"""
+
+    def __init__(self, node: str, errors: Sequence[str]):
+        """:param node: The name of the node that failed to start
+        :param errors: A description of every error that occurred"""
+        self.node = node
+        self.errors = list(errors)
+        super().__init__('%s: %s' % (node, '; '.join(self.errors)))
+
+
 class ProcessHelper:
     """This class holds processes that are part of a given family, e.g. routing
     daemons. This also provides the abstraction to execute a new process,
     currently in a mininet namespace, but could be extended to execute in
     a different environment."""
 
-    def __init__(self, node: 'IPNode'):
-        """:param node: The object to use to create subprocesses."""
+    def __init__(self, node: 'IPNode',
+                 restart_policy: Optional[RestartPolicy] = None,
+                 sample_interval: Optional[float] = SAMPLE_INTERVAL):
+        """:param node: The object to use to create subprocesses.
+        :param restart_policy: When to restart the named processes that
+                               exit, None to leave them stopped
+        :param sample_interval: The interval (in seconds) between two
+                                checks of the named processes, when their
+                                exit is noticed and their resource usage
+                                is sampled. None disables the supervision."""
         self.node = node
+        self.restart_policy = restart_policy
+        self.sample_interval = sample_interval
         self._pid_gen = 0
         self._processes = {}  # type: Dict[int, subprocess.Popen]
+        self._outputs = {}  # type: Dict[int, OutputLog]
+        self._names = {}  # type: Dict[str, int]
+        self._commands = {}  # type: Dict[str, Tuple]
+        self._history = {}  # type: Dict[str, ProcessHistory]
+        self._next_check = 0.
+        self._terminating = False
+        # The supervisor restarts processes from its own thread
+        self._lock = threading.RLock()
 
     def call(self, *args, **kwargs) -> Optional[str]:
         """Call a command, wait for it to end and return its output.
@@ -36,15 +74,49 @@ class ProcessHelper:
         :param kwargs: key-val arguments, as used in subprocess.Popen"""
         return self.node.cmd(*args, **kwargs)
 
-    def popen(self, *args, **kwargs) -> int:
-        """Call a command and return a Popen handle to it.
+    def popen(self, *args, name: Optional[str] = None,
+              output_file: Optional[str] = None, supervised=True,
+              **kwargs) -> int:
+        """Call a command and return a Popen handle to it. Unless stdout or
+        stderr are given, the output of the process is drained in the
+        background and its last lines are available through tail().
 
         :param args: the command + arguments
+        :param name: the name of the process in this family, e.g. its daemon
+        :param output_file: a file where the output is also written, with
+                            rotation
+        :param supervised: whether a named process is restarted when it
+                           exits and its resource usage is sampled
         :param kwargs: key-val arguments, as used in subprocess.Popen
         :return: a process index in this family"""
-        self._pid_gen += 1
-        self._processes[self._pid_gen] = self.node.popen(*args, **kwargs)
-        return self._pid_gen
+        command = (args, dict(kwargs), output_file)
+        output = None
+        if 'stdout' not in kwargs and 'stderr' not in kwargs:
+            kwargs.update(stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = OutputLog('%s on %s' % (name or _command(args)[0],
+                                             self.node.name),
+                               path=output_file)
+        with self._lock:
+            process = self._popen(args, kwargs)
+            self._pid_gen += 1
+            self._processes[self._pid_gen] = process
+            if output is not None and process.stdout is not None:
+                output_pump.watch(process.stdout, output)
+                self._outputs[self._pid_gen] = output
+            if name is not None:
+                self._names[name] = self._pid_gen
+            if name is not None and supervised:
+                self._commands[name] = command
+                history = self._history.setdefault(name, ProcessHistory())
+                history.started_at = time.monotonic()
+                history.running = True
+                if self.sample_interval is not None:
+                    supervisor.register(self)
+            return self._pid_gen
+
+    def _popen(self, args: Sequence, kwargs: Dict):
+        """Create a process in the node"""
+        return self.node.popen(*args, **kwargs)
 
     def pexec(self, *args, **kw) -> Tuple[str, str, int]:
         """Call a command, wait for it to terminate and save stdout, stderr and
@@ -57,8 +129,126 @@ class ProcessHelper:
         :param pid: a process index, as return by popen"""
         return self._processes[pid]
 
+    def get_output(self, pid) -> Optional[OutputLog]:
+        """Return the output of a given process in this family, if it is
+        drained in the background
+
+        :param pid: a process index, as return by popen"""
+        return self._outputs.get(pid)
+
+    def tail(self, name: str, n: Optional[int] = None) -> List[str]:
+        """Return the last lines of output of a process in this family
+
+        :param name: the name given to the process when it was started
+        :param n: the number of lines, all the kept lines by default"""
+        output = self._outputs.get(self._names.get(name))
+        return [] if output is None else output.tail(n)
+
+    def samples(self, name: str, since: Optional[float] = None) \
+            -> List[ResourceSample]:
+        """Return the resource usage of a process in this family over time,
+        across its restarts
+
+        :param name: the name given to the process when it was started
+        :param since: the time of the first sample, as returned by
+                      time.time(), all the kept samples by default"""
+        with self._lock:
+            history = self._history.get(name)
+            return [] if history is None else history.since(since)
+
+    def exits(self, name: str) -> List[ProcessExit]:
+        """Return the unexpected exits, with a non-zero code, of a process
+        in this family
+
+        :param name: the name given to the process when it was started"""
+        with self._lock:
+            history = self._history.get(name)
+            return [] if history is None else list(history.exits)
+
+    @property
+    def names(self) -> List[str]:
+        """The names of the processes in this family"""
+        with self._lock:
+            return list(self._history)
+
+    def supervise(self, now: float) -> float:
+        """Check the named processes: record their exit, restart them if
+        needed, and sample their resource usage. This is called by the
+        supervisor thread.
+
+        :param now: the current time.monotonic()
+        :return: the time at which this should be called again"""
+        with self._lock:
+            if self._terminating or self.sample_interval is None:
+                return now + SAMPLE_INTERVAL
+            check = now >= self._next_check
+            if check:
+                self._next_check = now + self.sample_interval
+            next_time = self._next_check
+            for name, history in self._history.items():
+                if history.restart_at is not None:
+                    if now >= history.restart_at:
+                        self._restart(name, history, now)
+                    if history.restart_at is not None:
+                        next_time = min(next_time, history.restart_at)
+                    continue
+                if not check or not history.running:
+                    continue
+                process = self._processes[self._names[name]]
+                code = process.poll()
+                if code is None:
+                    sample = sample_process(process.pid)
+                    if sample is not None:
+                        history.samples.append(sample)
+                    continue
+                self._exited(name, history, process, code, now)
+                if history.restart_at is not None:
+                    next_time = min(next_time, history.restart_at)
+            return next_time
+
+    def _exited(self, name: str, history: ProcessHistory, process, code: int,
+                now: float):
+        history.running = False
+        if code == 0:
+            lg.info('%s on %s ended\n' % (name, self.node.name))
+            return
+        history.exits.append(ProcessExit(time.time(), process.pid, code))
+        output = self._outputs.get(self._names[name])
+        lines = [] if output is None else output.tail(20, wait=.1)
+        lg.error('%s on %s exited with code %d%s\n'
+                 % (name, self.node.name, code,
+                    ''.join('\n  ' + line for line in lines)))
+        policy = self.restart_policy
+        if policy is None:
+            return
+        if now - history.started_at >= policy.reset_after:
+            history.restarts = 0
+        delay = policy.delay(history.restarts)
+        if delay is None:
+            lg.error('Not restarting %s on %s after %d restarts\n'
+                     % (name, self.node.name, history.restarts))
+            return
+        history.restart_at = now + delay
+
+    def _restart(self, name: str, history: ProcessHistory, now: float):
+        history.restart_at = None
+        history.restarts += 1
+        args, kwargs, output_file = self._commands[name]
+        lg.info('Restarting %s on %s\n' % (name, self.node.name))
+        try:
+            self.popen(*args, name=name, output_file=output_file, **kwargs)
+        except (OSError, RuntimeError) as e:
+            lg.error('Cannot restart %s on %s: %s\n'
+                     % (name, self.node.name, e))
+            delay = self.restart_policy.delay(history.restarts)
+            if delay is not None:
+                history.restart_at = now + delay
+
     def terminate(self):
         """Terminate all processes in this family"""
+        with self._lock:
+            self._terminating = True
+            supervisor.unregister(self)
         for p in self._processes.values():
             try:
                 p.terminate()
@@ -66,6 +256,81 @@ class ProcessHelper:
                 pass  # Process is already dead
 
 
+class ForkServerHelper(ProcessHelper):
+    """A ProcessHelper that starts a resident launcher in the namespace of
+    the node, the first time that a process is needed. The processes are
+    then forked by the launcher instead of attaching a new process to the
+    namespace every time. It falls back on the node to create processes
+    with options that the launcher does not support."""
+
+    def __init__(self, node: 'IPNode', **kwargs):
+        super().__init__(node, **kwargs)
+        self._launcher = None  # type: Optional[subprocess.Popen]
+        self._client = None  # type: Optional[launcher.LauncherClient]
+        self._failed = False
+
+    @property
+    def socket_path(self) -> str:
+        return os.path.join(self.node.cwd, 'launcher_%s.sock' % self.node.name)
+
+    def _get_client(self) -> Optional[launcher.LauncherClient]:
+        if self._client is None and not self._failed:
+            try:
+                self._launcher = self.node.popen(
+                    [sys.executable, '-I', launcher.__file__,
+                     self.socket_path], stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+                self._client = launcher.LauncherClient(self.socket_path)
+            except (OSError, RuntimeError) as e:
+                lg.warning('Cannot start the launcher of %s, falling back '
+                           'on its shell: %s\n' % (self.node.name, e))
+                self._failed = True
+                self._stop_launcher()
+        return self._client
+
+    def _popen(self, args: Sequence, kwargs: Dict):
+        options = dict(kwargs)
+        cwd = options.pop('cwd', None)
+        stdout = options.pop('stdout', None)
+        stderr = options.pop('stderr', None)
+        pipe = stdout == subprocess.PIPE and stderr == subprocess.STDOUT
+        client = None
+        if not options and (pipe or stdout == stderr == subprocess.DEVNULL):
+            client = self._get_client()
+        if client is None:
+            return super()._popen(args, kwargs)
+        return client.spawn(_command(args), cwd=cwd, pipe=pipe)
+
+    def pexec(self, *args, **kw) -> Tuple[str, str, int]:
+        client = None if kw else self._get_client()
+        if client is None:
+            return super().pexec(*args, **kw)
+        return client.run(_command(args))
+
+    def terminate(self):
+        super().terminate()
+        self._stop_launcher()
+
+    def _stop_launcher(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._launcher is not None:
+            try:
+                self._launcher.wait(timeout=launcher.CONNECT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._launcher.kill()
+            self._launcher = None
+
+
+def _command(args: Sequence) -> List[str]:
+    """Normalize the arguments of a command as Node.popen does"""
+    cmd = args[0] if len(args) == 1 else args
+    if isinstance(cmd, str):
+        return cmd.split()
+    return [str(c) for c in cmd]
+
+
 class IPNode(Node):
     """A Node which manages a set of daemons"""
 
@@ -76,6 +341,9 @@ class IPNode(Node):
                  process_manager: Type[ProcessHelper] = ProcessHelper,
                  use_v4=True,
                  use_v6=True,
+                 output_files=False,
+                 restart_policy: Optional[RestartPolicy] = None,
+                 sample_interval: Optional[float] = SAMPLE_INTERVAL,
                  *args, **kwargs):
         """Most of the heavy lifting for this node should happen in the
         associated config object.
@@ -86,11 +354,20 @@ class IPNode(Node):
         :param process_manager: The class that will manage all the associated
                                 processes for this node
         :param use_v4: Whether this node has IPv4
-        :param use_v6: Whether this node has IPv6"""
+        :param use_v6: Whether this node has IPv6
+        :param output_files: Whether the output of the daemons is also
+                             written to rotating files in cwd
+        :param restart_policy: When to restart the daemons that exit, None
+                               to leave them stopped
+        :param sample_interval: The interval (in seconds) between two
+                                checks of the daemons, when their exit is
+                                noticed and their resource usage is sampled.
+                                None disables their supervision."""
         super().__init__(name, *args, **kwargs)
         self.use_v4 = use_v4
         self.use_v6 = use_v6
         self.cwd = cwd
+        self.output_files = output_files
         self._old_sysctl = {}  # type: Dict[str, Union[str, int]]
         if isinstance(config, tuple):
             try:
@@ -100,59 +377,125 @@ class IPNode(Node):
                          "parameter but got instead %s" % str(config))
         else:
             self.nconfig = config(self)
-        self._processes = process_manager(self)
+        self._processes = process_manager(self, restart_policy=restart_policy,
+                                          sample_interval=sample_interval)
 
     def start(self):
         """Start the node: Configure the daemons, set the relevant sysctls,
-        and fire up all needed processes"""
-        # Build the config
-        self.nconfig.build()
+        and fire up all needed processes
+
+        :raise NodeStartError: if the configuration of a daemon is invalid
+                               or if a daemon did not start in time"""
+        # Build the config, unless it was already done for the whole network
+        if not self.nconfig.rendered:
+            self.nconfig.build()
         # Check them
-        err_code = False
+        errors = []
         for d in self.nconfig.daemons:
             out, err, code = self._processes.pexec(shlex.split(d.dry_run))
-            err_code = err_code or code
             if code:
                 lg.error(d.NAME, 'configuration check failed ['
                          'rcode:', code, ']\n'
                          'stdout:', out, '\n'
                          'stderr:', err)
-        if err_code:
-            lg.error('Config checks failed, aborting!')
-            mininet.clean.cleanup()
-            sys.exit(1)
+                errors.append('%s configuration check failed [rcode: %s]'
+                              % (d.NAME, code))
+        if errors:
+            raise NodeStartError(self.name, errors)
         # Set relevant sysctls
-        for opt, val in self.nconfig.sysctl:
-            self._old_sysctl[opt] = self._set_sysctl(opt, val)
+        self._old_sysctl.update(self._set_sysctls(dict(self.nconfig.sysctl)))
         # Fire up all daemons
         for d in self.nconfig.daemons:
-            self._processes.popen(shlex.split(d.startup_line))
-            # Busy-wait if the daemon needs some time before being started
-            while not d.has_started():
-                time.sleep(.001)
+            output_file = d._file('out') if self.output_files else None
+            pid = self._processes.popen(
+                shlex.split(d.startup_line), name=d.NAME,
+                supervised=d.SUPERVISED, output_file=output_file)
+            output = self._processes.get_output(pid)
+            # Wait if the daemon needs some time before being started
+            try:
+                wait_ready(d.readiness_probes(), timeout=d.STARTUP_TIMEOUT,
+                           process=self._processes.get_process(pid),
+                           name='%s on %s' % (d.NAME, self.name),
+                           output=None if output is None else
+                           functools.partial(output.tail, 20, wait=1.))
+            except ReadinessError as e:
+                raise NodeStartError(self.name, [str(e)])
+
+    def tail(self, daemon: str, n: Optional[int] = None) -> List[str]:
+        """Return the last lines printed by a daemon on its stdout and stderr
+
+        :param daemon: The name of the daemon, e.g., 'bgpd'
+        :param n: The number of lines, all the kept lines by default"""
+        return self._processes.tail(daemon, n)
+
+    def resource_usage(self, daemon: str, since: Optional[float] = None) \
+            -> List[ResourceSample]:
+        """Return the CPU time, memory and file descriptors used by a daemon
+        over time
+
+        :param daemon: The name of the daemon, e.g., 'bgpd'
+        :param since: The time of the first sample, as returned by
+                      time.time(), all the kept samples by default"""
+        return self._processes.samples(daemon, since)
+
+    def daemon_exits(self, daemon: str) -> List[ProcessExit]:
+        """Return the unexpected exits of a daemon, e.g., its crashes
+
+        :param daemon: The name of the daemon, e.g., 'bgpd'"""
+        return self._processes.exits(daemon)
+
+    def stop_daemons(self):
+        """Stops the daemons of this node and sets back all sysctls to their
+        old values"""
+        self._processes.terminate()
+        self._set_sysctls({opt: val for opt, val in self._old_sysctl.items()
+                           if val is not None})
+        self._old_sysctl.clear()
 
     def terminate(self):
         """Stops this node and sets back all sysctls to their old values"""
-        self._processes.terminate()
+        self.stop_daemons()
         if not DEBUG_FLAG:
             self.nconfig.cleanup()
-        for opt, val in self._old_sysctl.items():
-            self._set_sysctl(opt, val)
+        # Our netlink socket would keep the network namespace alive
+        release_netlink(self)
         super().terminate()
 
-    def _set_sysctl(self, key: str, val: Union[str, int]):
+    def _set_sysctl(self, key: str, val: Union[str, int]) -> Optional[str]:
         """Change a sysctl value, and return the previous set value"""
+        return self._set_sysctls({key: val}).get(key)
+
+    def _set_sysctls(self, values: Dict[str, Union[str, int]]) \
+            -> Dict[str, Optional[str]]:
+        """Change several sysctl values through /proc/sys, with a single
+        command in the node
+
+        :param values: The new value of each sysctl
+        :return: The previous value of each sysctl, None if it could not be
+                 read"""
+        if not values:
+            return {}
+        with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) \
+                as f:
+            for key, val in values.items():
+                path = shlex.quote(_sysctl_path(key))
+                val = shlex.quote(str(val))
+                f.write('v=$(cat %s) && printf \'%%s=%%s\\n\' %s "$v"\n'
+                        % (path, shlex.quote(key)))
+                f.write('[ "$v" = %s ] || printf \'%%s\\n\' %s > %s\n'
+                        % (val, val, path))
         try:
-            v = None
-            out = self._processes.call('sysctl', key)
-            if out is not None:
-                v = out.split('=')[1]\
-                    .strip(' \n\t\r')
-        except IndexError:
-            v = None
-        if v != val:
-            self._processes.call('sysctl', '-w', '%s=%s' % (key, val))
-        return v
+            out = self._processes.call('sh', f.name, '2>&1')
+        finally:
+            os.unlink(f.name)
+        old = dict.fromkeys(values)  # type: Dict[str, Optional[str]]
+        for line in (out or '').splitlines():
+            key, sep, val = line.partition('=')
+            if sep and key in old:
+                old[key] = val.strip(' \n\t\r')
+            elif line.strip():
+                lg.warning('sysctl on %s: %s\n' % (self.name, line))
+        return old
 
     def get(self, key, val=None):
         """Check for a given key in the node parameters"""
@@ -182,6 +525,13 @@ class IPNode(Node):
         return ips
 
 
+def _sysctl_path(key: str) -> str:
+    """Return the file of a sysctl in /proc/sys"""
+    if '/' not in key:
+        key = key.replace('.', '/')
+    return os.path.join('/proc/sys', key.lstrip('/'))
+
+
 class Router(IPNode, L3Router):
     """The actual router, which manages a set of daemons"""
 
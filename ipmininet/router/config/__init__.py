@@ -1,11 +1,14 @@
 """This module holds the configuration generators for daemons
 that can be used in a router."""
-from .base import BorderRouterConfig, BasicRouterConfig, RouterConfig, NodeConfig
+from .base import BorderRouterConfig, BasicRouterConfig, RouterConfig, \
+    NodeConfig, RouterIdRegistry, HostsTable
+from .manifest import ConfigManifest
 from .zebra import Zebra
 from .staticd import STATIC, StaticRoute
 from .ospf import OSPF, OSPFArea
 from .ospf6 import OSPF6
-from .bgp import BGP, AS, iBGPFullMesh, bgp_peering, bgp_fullmesh, \
+from .bgp import BGP, AS, iBGPFullMesh, iBGPRouteReflectors, bgp_peering, \
+    bgp_fullmesh, \
     ebgp_session, set_rr, AccessList, CommunityList, AF_INET, AF_INET6, \
     SHARE, CLIENT_PROVIDER
 from .radvd import RADVD, AdvPrefix, AdvRDNSS, AdvConnectedPrefix
@@ -20,11 +23,13 @@ from .openr import Openr, OpenrDomain
 
 __all__ = ['BasicRouterConfig', 'NodeConfig', 'Zebra', 'OSPF', 'OSPF6',
            'OSPFArea', 'BGP', 'AS', 'SHARE', 'CLIENT_PROVIDER',
-           'iBGPFullMesh', 'bgp_peering', 'RouterConfig', 'bgp_fullmesh',
-           'ebgp_session', 'CommunityList', 'set_rr', 'AccessList', 'IPTables',
+           'iBGPFullMesh', 'iBGPRouteReflectors', 'bgp_peering',
+           'RouterConfig', 'bgp_fullmesh', 'ebgp_session', 'CommunityList',
+           'set_rr', 'AccessList', 'IPTables',
            'IP6Tables', 'SSHd', 'RADVD', 'AdvPrefix', 'AdvConnectedPrefix',
            'AdvRDNSS', 'PIMD', 'RIPng', 'STATIC', 'StaticRoute',
            'OpenrDaemon', 'Openr', 'OpenrDomain', 'AF_INET', 'AF_INET6',
            'BorderRouterConfig', 'Rule', 'Chain', 'ChainRule', 'NOT',
            'PortClause', 'InterfaceClause', 'AddressClause', 'Filter',
-           'InputFilter', 'OutputFilter', 'TransitFilter', 'Allow', 'Deny']
+           'InputFilter', 'OutputFilter', 'TransitFilter', 'Allow', 'Deny',
+           'RouterIdRegistry', 'HostsTable', 'ConfigManifest']
@@ -4,7 +4,13 @@ It also defines the base class for a daemon, as well as a minimalistic
 configuration for a router."""
 import os
 import abc
-from contextlib import closing
+import hashlib
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from operator import attrgetter
 from ipaddress import ip_address
 from mako.lookup import TemplateLookup
@@ -12,23 +18,177 @@ from typing import TYPE_CHECKING, Iterable, Optional, Dict, Union, Type, \
     Tuple, Sequence, List, Set
 
 from .utils import ConfigDict, ip_statement
-from ipmininet.utils import require_cmd, realIntfList
+from ipmininet.utils import require_cmd, find_cmd, broadcast_domains_of, \
+    realIntfList, otherIntf
 from ipmininet.link import OrderedAddress, IPIntf
+from ipmininet.readiness import ReadinessProbe, CallableProbe
+from ipmininet.templating import CachedTemplateLookup, render_stats
+from .manifest import ConfigManifest, SpooledContent, discard_contents, \
+    write_file
 
 import mako.exceptions
+from mako.runtime import Context
 
 from mininet.log import lg as log
+from mininet.node import Host, Node
 
 if TYPE_CHECKING:
     from ipmininet.router import IPNode, Router
+    from ipmininet.ipnet import BroadcastDomain
     from ipmininet.iptopo import IPTopo, NodeDescription
 DaemonOption = Union['Daemon', Type['Daemon'],
                      Tuple[Union['Daemon', Type['Daemon']], Dict]]
+# The content of each configuration file of a daemon
+RenderedFiles = Dict[str, Union[str, SpooledContent]]
 
 last_routerid = ip_address('0.0.0.1')
+# Routers may be started concurrently, see IPNet.start
+_routerid_lock = threading.RLock()
 
 __TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
-router_template_lookup = TemplateLookup(directories=[__TEMPLATES_DIR])
+router_template_lookup = CachedTemplateLookup(__TEMPLATES_DIR)
+router_template_lookup.warm_up()
+
+
+class HostsTable:
+    """The /etc/hosts file of the nodes of a connected component of the
+    network. It is generated once for the whole component and mounted on
+    all its nodes."""
+
+    def __init__(self, nodes: Sequence[Node], path: str):
+        """:param nodes: The nodes of the component
+        :param path: The location of the file"""
+        self.nodes = sorted(nodes, key=attrgetter('name'))
+        self.path = path
+        self._digest = None  # type: Optional[bytes]
+
+    @classmethod
+    def for_nodes(cls, nodes: Iterable[Node]) -> List['HostsTable']:
+        """Split nodes in connected components and create a table for each
+        of them. The table is registered on the configuration of each
+        node.
+
+        :param nodes: All the nodes of the network"""
+        tables = []
+        seen = set()  # type: Set[str]
+        for start in nodes:
+            if start.name in seen:
+                continue
+            component = []
+            seen.add(start.name)
+            to_visit = [start]
+            while to_visit:
+                node = to_visit.pop()
+                component.append(node)
+                for i in realIntfList(node):
+                    adj_i = otherIntf(i)
+                    if adj_i is not None and adj_i.node.name not in seen:
+                        seen.add(adj_i.node.name)
+                        to_visit.append(adj_i.node)
+            first = min(component, key=attrgetter('name'))
+            table = cls(component,
+                        os.path.join(getattr(first, 'cwd', '/tmp'),
+                                     'hosts_component_%s' % first.name))
+            for n in component:
+                nconfig = getattr(n, 'nconfig', None)
+                if isinstance(nconfig, NodeConfig):
+                    nconfig.hosts_table = table
+            tables.append(table)
+        return tables
+
+    def content(self) -> bytes:
+        """Return the content of the file"""
+        lines = []
+        for n in self.nodes:
+            # Only list hosts and IPNodes, not switches
+            if not isinstance(n, Host) \
+                    and not isinstance(getattr(n, 'nconfig', None),
+                                       NodeConfig):
+                continue
+            for i in n.intfList():
+                if not isinstance(i, IPIntf):
+                    continue
+                for ip in chain(i.ips(), i.ip6s(exclude_lls=True)):
+                    lines.append("{ip}\t{name}\n"
+                                 .format(ip=ip.ip.compressed, name=n.name))
+        lines.append("\n")
+        with open("/etc/hosts", "r") as fileobj:
+            lines.append(fileobj.read())
+        return "".join(lines).encode()
+
+    def write(self) -> bool:
+        """Write the file if its content changed since the last write. The
+        file is modified in place to remain visible through the mounts.
+
+        :return: Whether the file was written"""
+        content = self.content()
+        digest = hashlib.sha1(content).digest()
+        if digest == self._digest and os.path.exists(self.path):
+            return False
+        with open(self.path, "wb") as fileobj:
+            fileobj.write(content)
+        self._digest = digest
+        return True
+
+
+# The daemons being rendered by render_daemons(), inherited by its workers
+_render_jobs = []  # type: List[Tuple[Daemon, ConfigDict]]
+
+
+def _render_job(index: int) -> Tuple[Union[RenderedFiles, Exception],
+                                     float, float]:
+    """Render a job in a worker
+
+    :return: The result and the compile and render times in the worker"""
+    daemon, cfg = _render_jobs[index]
+    compile_time, render_time = render_stats.snapshot()
+    try:
+        result = daemon.render(cfg)
+    except Exception as e:  # Reported with the errors of its node
+        result = e
+    new_compile_time, new_render_time = render_stats.snapshot()
+    return result, new_compile_time - compile_time, \
+        new_render_time - render_time
+
+
+def render_daemons(jobs: Sequence[Tuple['Daemon', ConfigDict]], workers=1) \
+        -> List[Union[RenderedFiles, Exception]]:
+    """Render the configuration files of several daemons. With more than
+    one worker, the templates are rendered in a pool of forked processes.
+    The workers inherit the daemons and their configuration trees, so only
+    the rendered files are sent back. Forking a process running other
+    threads is only safe if no lock is held by them, so this is opt-in.
+
+    :param jobs: The daemons to render with the global ConfigDict of their
+                 node
+    :param workers: The number of processes rendering the templates
+    :return: The configuration files of each daemon, or the error that
+             prevented their rendering"""
+    global _render_jobs
+    if workers <= 1 or len(jobs) <= 1:
+        results = []  # type: List[Union[RenderedFiles, Exception]]
+        for d, cfg in jobs:
+            try:
+                results.append(d.render(cfg))
+            except Exception as e:  # Reported with the errors of its node
+                results.append(e)
+        return results
+    _render_jobs = list(jobs)
+    # Before Python 3.7, the pool always forks its workers on Linux
+    options = {} if sys.version_info < (3, 7) \
+        else {'mp_context': multiprocessing.get_context('fork')}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, **options) as pool:
+            results = []
+            for rendered, compile_time, render_time in pool.map(
+                    _render_job, range(len(jobs)),
+                    chunksize=max(1, len(jobs) // (4 * workers))):
+                render_stats.add_compile(compile_time)
+                render_stats.add_render(render_time)
+                results.append(rendered)
+            return results
+    finally:
+        _render_jobs = []
 
 
 class NodeConfig:
@@ -52,16 +212,34 @@ class NodeConfig:
             self.register_daemon(d)
         self._cfg = ConfigDict()  # Our root config object
         self._sysctl = sysctl if sysctl is not None else {}
+        # The /etc/hosts file shared with the other nodes of the network
+        self.hosts_table = None  # type: Optional[HostsTable]
+        # The manifest of the configuration files of the network, if any
+        self.manifest = None  # type: Optional[ConfigManifest]
+        # Whether the configuration files are up-to-date
+        self.rendered = False
 
     def build(self):
         """Build the configuration for each daemon, then write the
         configuration files"""
+        self.prepare()
+        # Write their config, using the global ConfigDict to handle
+        # dependencies
+        self.write(render_daemons(self.render_jobs))
 
+    def prepare(self):
+        """Build the configuration tree of each daemon, without rendering
+        the configuration files"""
         # Mount a separate /etc/resolv.conf and /etc/hosts for the node
         resolv_file_mount = os.path.join(self._node.cwd, 'resolv_%(name)s.conf')
         open(resolv_file_mount % self._node.__dict__, "w").close()
-        host_file_mount = os.path.join(self._node.cwd, 'hosts_%(name)s')
-        self.build_host_file(host_file_mount % self._node.__dict__)
+        if self.hosts_table is not None:
+            host_file_mount = self.hosts_table.path
+        else:
+            host_file_mount = os.path.join(self._node.cwd,
+                                           'hosts_%(name)s') \
+                % self._node.__dict__
+            self.build_host_file(host_file_mount)
         self.add_private_fs_path([('/etc/resolv.conf', resolv_file_mount),
                                   ('/etc/hosts', host_file_mount)])
 
@@ -77,11 +255,30 @@ class NodeConfig:
         # Build their config
         for name, d in self._daemons.items():
             self._cfg[name] = d.build()
-        # Write their config, using the global ConfigDict to handle
-        # dependencies
-        for d in self._daemons.values():
-            cfg = d.render(self._cfg)
-            d.write(cfg)
+
+    @property
+    def render_jobs(self) -> List[Tuple['Daemon', ConfigDict]]:
+        """The daemons to render, with the global ConfigDict of the node"""
+        return [(d, self._cfg) for d in self.daemons]
+
+    def write(self, rendered: Sequence[Union[RenderedFiles, Exception]]):
+        """Write the configuration files of the daemons
+
+        :param rendered: The configuration files of each daemon, in the
+                         order of render_jobs, or the error that prevented
+                         their rendering
+        :raise Exception: the error that prevented the rendering of a
+                          configuration"""
+        rendered = list(rendered)
+        for i, (d, cfg) in enumerate(zip(self.daemons, rendered)):
+            if isinstance(cfg, Exception):
+                # Do not leave the spooled files of the other daemons behind
+                for other in rendered[i + 1:]:
+                    if not isinstance(other, Exception):
+                        discard_contents(other.values())
+                raise cfg
+            d.write(cfg, manifest=self.manifest)
+        self.rendered = True
 
     def post_register_daemons(self):
         """Method called after all daemon classes were instantiated"""
@@ -89,7 +286,10 @@ class NodeConfig:
     def cleanup(self):
         """Cleanup all temporary files for the daemons"""
         for d in self._daemons.values():
+            if self.manifest is not None:
+                self.manifest.forget(d.files)
             d.cleanup()
+        self.rendered = False
 
     def register_daemon(self, cls: DaemonOption, **daemon_opts):
         """Add a new daemon to this configuration
@@ -114,7 +314,9 @@ class NodeConfig:
         else:
             cls.options.update(daemon_opts)
         self._daemons[cls.NAME] = cls
-        require_cmd(cls.NAME, 'Could not find an executable for a daemon!')
+        if not getattr(self._node, 'offline', False):
+            require_cmd(cls.NAME,
+                        'Could not find an executable for a daemon!')
 
     @property
     def sysctl(self):
@@ -177,6 +379,61 @@ class NodeConfig:
             fileobj.write(b"".join(lines))
 
 
+def most_visible_ipv4(node: 'IPNode') -> Optional[str]:
+    """Return the most visible IPv4 address of a node, if any"""
+    ip = max((ip for itf in node.intfList() for ip in itf.ips()),
+             key=OrderedAddress, default=None)
+    return ip.ip.compressed if ip is not None else None
+
+
+class RouterIdRegistry:
+    """The router ids of the routers of a network.
+
+    The ids that are already used, i.e. the ones explicitly set on daemons
+    and the most visible IPv4 address of each router, are reserved once.
+    The routers that need a generated id then receive the next unused one,
+    in the order of their names so that the ids do not change across
+    runs."""
+
+    def __init__(self, routers: Iterable['Router'] = ()):
+        """:param routers: The routers of the network"""
+        self._ids = {}  # type: Dict[str, str]
+        self._used = set()  # type: Set[int]
+        self._last = int(ip_address('0.0.0.1'))
+        self._lock = threading.Lock()
+        unset = []
+        for r in sorted(routers, key=attrgetter('name')):
+            used = [d.options.routerid for d in r.nconfig.daemons
+                    if d.options.routerid]
+            ip = most_visible_ipv4(r)
+            if ip is not None:
+                used.append(ip)
+            elif not used:
+                unset.append(r)
+            for rid in used:
+                try:
+                    self._used.add(int(ip_address(str(rid))))
+                except ValueError:
+                    log.warning('Invalid router id %s for %s\n' % (rid, r))
+        for r in unset:
+            self.routerid(r)
+
+    def routerid(self, router: 'Router') -> str:
+        """Return the router id generated for a router, generating one if
+        needed"""
+        with self._lock:
+            try:
+                return self._ids[router.name]
+            except KeyError:
+                pass
+            self._last += 1
+            while self._last in self._used:
+                self._last += 1
+            self._used.add(self._last)
+            rid = self._ids[router.name] = ip_address(self._last).compressed
+            return rid
+
+
 class RouterConfig(NodeConfig):
 
     def __init__(self, node: 'Router', sysctl=None, *args, **kwargs):
@@ -186,6 +443,8 @@ class RouterConfig(NodeConfig):
             self._sysctl.update(sysctl)
         super().__init__(node, sysctl=self._sysctl, *args, **kwargs)
         self.routerid = None
+        # The registry of the router ids of the network, if any
+        self.routerid_registry = None  # type: Optional[RouterIdRegistry]
 
     def post_register_daemons(self):
         self._cfg.password = self._node.password
@@ -201,7 +460,7 @@ class RouterConfig(NodeConfig):
 
         # Router id of 'n' already set
         if n.nconfig.routerid:
-            return str(n.nconfig.routerid) != str(last_routerid)
+            return str(n.nconfig.routerid) == str(last_routerid)
 
         # Check that a router id explicitly set
         # in any other daemon is not in conflict
@@ -214,11 +473,8 @@ class RouterConfig(NodeConfig):
 
         # Check that the most-visible IPv4 address is not in conflict
         # with the current router id
-        ip_list = sorted((ip for itf in n.intfList()
-                          for ip in itf.ips()),
-                         key=OrderedAddress)
-        if len(ip_list) != 0 \
-                and str(ip_list.pop().ip) == str(last_routerid):
+        ip = most_visible_ipv4(n)
+        if ip is not None and ip == str(last_routerid):
             return True
 
         return False
@@ -236,28 +492,43 @@ class RouterConfig(NodeConfig):
             if d.options.routerid:
                 return d.options.routerid
 
-        ip_list = sorted((ip for itf in self._node.intfList()
-                          for ip in itf.ips()),
-                         key=OrderedAddress)
-        if len(ip_list) == 0:
-
-            to_visit = realIntfList(self._node)
-            # Explore all routers to check that none has the same router id
-            while to_visit:
-                self.incr_last_routerid()
-                visited = set()  # type: Set[IPIntf]
-                while to_visit:
-                    i = to_visit.pop()
-                    if i in visited:
-                        continue
-                    visited.add(i)
-                    for n in i.broadcast_domain.routers:
-                        if self._equal_routerid(n.node):
-                            break  # We need to change the router id
-                        to_visit.extend(realIntfList(n.node))
-                to_visit = realIntfList(self._node) if to_visit else []
-            return last_routerid.compressed
-        return ip_list.pop().ip.compressed
+        ip = most_visible_ipv4(self._node)
+        if ip is not None:
+            return ip
+        if self.routerid_registry is not None:
+            return self.routerid_registry.routerid(self._node)
+        with _routerid_lock:
+            return self._generate_routerid()
+
+    def _generate_routerid(self) -> str:
+        """Generate a router id that is not used by any other router
+        reachable from this one"""
+        routers = self._reachable_routers()
+        # Check that none of the routers has the same router id
+        while True:
+            self.incr_last_routerid()
+            if not any(self._equal_routerid(r) for r in routers):
+                return last_routerid.compressed
+
+    def _reachable_routers(self) -> List['Router']:
+        """Return the routers reachable from this one, through the broadcast
+        domains of the network"""
+        routers = []
+        seen = {self._node}
+        visited = set()  # type: Set[BroadcastDomain]
+        to_visit = list(broadcast_domains_of(self._node))
+        while to_visit:
+            d = to_visit.pop()
+            if d in visited:
+                continue
+            visited.add(d)
+            for i in d.routers:
+                if i.node in seen:
+                    continue
+                seen.add(i.node)
+                routers.append(i.node)
+                to_visit.extend(broadcast_domains_of(i.node))
+        return routers
 
 
 class Daemon(metaclass=abc.ABCMeta):
@@ -271,6 +542,11 @@ class Daemon(metaclass=abc.ABCMeta):
     DEPENDS = ()  # type: Sequence[Type[Daemon]]
     # The kill patterns to cleanup any processes started by this daemon
     KILL_PATTERNS = ()  # type: Sequence[str]
+    # The maximal time (in seconds) to wait for this daemon to be ready
+    STARTUP_TIMEOUT = 60.
+    # Whether the started process is watched and restarted when it exits,
+    # False for one-shot commands and for daemons forking in the background
+    SUPERVISED = True
 
     def __init__(self, node: 'IPNode',
                  template_lookup: TemplateLookup = router_template_lookup,
@@ -307,24 +583,33 @@ class Daemon(metaclass=abc.ABCMeta):
                 pass
         self.files = []
 
-    def render(self, cfg, **kwargs) -> Dict[str, str]:
-        """Render the configuration content for each config file of this daemon
+    def render(self, cfg, **kwargs) -> RenderedFiles:
+        """Render the configuration content for each config file of this
+        daemon. The templates are rendered in a buffer that is spooled to
+        a temporary file when the configuration is too large to be kept in
+        memory.
 
         :param cfg: The global config for the node
         :param kwargs: Additional keywords args. will be passed directly
-                       to the template"""
-        self.files.extend(self.cfg_filenames)
-        cfg_content = {}
+                       to the template
+        :return: The content of each file, as a string or spooled"""
+        cfg_content = {}  # type: Dict[str, Union[str, SpooledContent]]
         for i, filename in enumerate(self.cfg_filenames):
             log.debug('Generating %s\n' % filename)
+            buf = SpooledContent(filename)
             try:
                 cfg.current_filename = filename
                 kwargs["node"] = cfg
                 kwargs["ip_statement"] = ip_statement
                 template = self.template_lookup.get_template(
                     self.template_filenames[i])
-                cfg_content[filename] = template.render(**kwargs)
+                start = time.perf_counter()
+                template.render_context(Context(buf, **kwargs))
+                cfg_content[filename] = buf.close()
+                render_stats.add_render(time.perf_counter() - start)
             except Exception:
+                buf.discard()
+                discard_contents(cfg_content.values())
                 # Display template errors in a less cryptic way
                 log.error('Couldn''t render a config file(',
                           self.template_filenames[i], ')')
@@ -333,13 +618,16 @@ class Daemon(metaclass=abc.ABCMeta):
                     self._node.name, self.NAME))
         return cfg_content
 
-    def write(self, cfg: Dict[str, str]):
-        """Write down the configuration files for this daemon
+    def write(self, cfg: RenderedFiles,
+              manifest: Optional[ConfigManifest] = None):
+        """Write down the configuration files for this daemon. The files
+        whose content did not change are left untouched.
 
-        :param cfg: The configuration string for each filename"""
+        :param cfg: The configuration string for each filename
+        :param manifest: The manifest recording the configuration files"""
+        self.files.extend(f for f in self.cfg_filenames if f not in self.files)
         for filename in self.cfg_filenames:
-            with closing(open(filename, 'w')) as f:
-                f.write(cfg[filename])
+            write_file(filename, cfg[filename], manifest=manifest)
 
     @property
     @abc.abstractmethod
@@ -352,6 +640,16 @@ class Daemon(metaclass=abc.ABCMeta):
         """The startup line to use to check that the daemon is
         well-configured"""
 
+    def _executable(self, name: Optional[str] = None) -> str:
+        """Return the absolute path of an executable, so that the shells of
+        the nodes do not search it in $PATH
+
+        :param name: The executable, the daemon itself by default
+        :return: Its path, or its name if it cannot be found"""
+        if name is None:
+            name = self.NAME
+        return find_cmd(name) or name
+
     def _filename(self, suffix: str) -> str:
         """Return a filename for this daemon and node,
         with the specified suffix"""
@@ -401,6 +699,12 @@ class Daemon(metaclass=abc.ABCMeta):
         """Return whether this daemon has started or not"""
         return True
 
+    def readiness_probes(self) -> List[ReadinessProbe]:
+        """Return the probes that have to succeed before this daemon is
+        considered as started. The default probe calls has_started()."""
+        return [CallableProbe(self.has_started,
+                              '%s.has_started()' % self.NAME)]
+
     @classmethod
     def get_config(cls, topo: 'IPTopo', node: 'NodeDescription', **kwargs):
         """Returns a config object for the daemon if any"""
@@ -1,11 +1,18 @@
 """Base classes to configure a BGP daemon"""
 import heapq
-from typing import Sequence, TYPE_CHECKING, Optional, Union, Tuple, List, Set
+import math
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Sequence, TYPE_CHECKING, Optional, Union, Tuple, List, \
+    Set, Dict, Any, Mapping
 
 import itertools
 
 from ipaddress import ip_network, ip_address, IPv4Network, IPv6Network
 
+from mininet.log import lg
+
+from ipmininet import MIN_IGP_METRIC
 from ipmininet.link import IPIntf
 from ipmininet.overlay import Overlay
 from ipmininet.utils import realIntfList
@@ -59,6 +66,138 @@ class iBGPFullMesh(AS):
         return '<iBGPMesh %s>' % self.asn
 
 
+class iBGPRouteReflectors(AS):
+    """An overlay class to establish iBGP sessions through route reflectors
+    instead of a full mesh. The routers with the highest degree, or the
+    lowest IGP distance to the others, become route reflectors. Each of
+    them serves the closest routers as clients, up to a fan-out. The route
+    reflectors are in full mesh."""
+
+    DEGREE = 'degree'
+    CENTRALITY = 'centrality'
+
+    def __init__(self, asn: int, routers=(), fanout=10, redundancy=1,
+                 placement=DEGREE, **props):
+        """:param asn: The number for this AS
+        :param routers: an initial set of routers to add to this AS
+        :param fanout: the maximal number of clients of a route reflector
+        :param redundancy: the number of route reflectors of each cluster,
+                           2 for redundant pairs
+        :param placement: how route reflectors are chosen, by DEGREE or by
+                          IGP CENTRALITY
+        :param props: key-values to set on all routers of this AS"""
+        super().__init__(asn, routers=routers, **props)
+        if fanout < 1 or redundancy < 1:
+            raise ValueError('The fan-out and the redundancy of route '
+                             'reflectors must be positive')
+        if placement not in (self.DEGREE, self.CENTRALITY):
+            raise ValueError('Unknown route reflector placement %s'
+                             % placement)
+        self.fanout = fanout
+        self.redundancy = redundancy
+        self.placement = placement
+        # The route reflectors and their clients, computed by apply()
+        self.clusters = []  # type: List[Tuple[List[str], List[str]]]
+
+    def apply(self, topo):
+        routers = [str(r) for r in self.nodes]
+        distances = _igp_distances(topo, routers)
+        if self.placement == self.DEGREE:
+            def rank(r):
+                return -len(distances[r][1]), r
+        else:
+            def rank(r):
+                return _closeness(distances[r][0], len(routers)), r
+        ranked = sorted(routers, key=rank)
+        count = max(1, math.ceil(len(routers) /
+                                 (self.fanout + self.redundancy)))
+        primaries = ranked[:count]
+        members = {r: [r] for r in primaries}  # type: Dict[str, List[str]]
+        size = self.fanout + self.redundancy
+        # The closest routers to a route reflector are assigned first
+        pending = sorted((d, rank(r), r, p) for r in ranked[count:]
+                         for p in primaries
+                         for d in [distances[p][0].get(r, math.inf)])
+        assigned = set()  # type: Set[str]
+        for _, _, r, p in pending:
+            if r not in assigned and len(members[p]) < size:
+                members[p].append(r)
+                assigned.add(r)
+        self.clusters = []
+        for i, p in enumerate(primaries):
+            group = sorted(members[p], key=rank)
+            rrs, clients = group[:self.redundancy], group[self.redundancy:]
+            self.clusters.append((rrs, clients))
+            for rr in rrs:
+                set_rr(topo, rr, peers=clients, cluster_id=i + 1)
+        bgp_fullmesh(topo, [rr for rrs, _ in self.clusters for rr in rrs])
+        lg.info('*** %s: %d iBGP sessions instead of %d in full mesh\n'
+                % (self, self.sessions, self.full_mesh_sessions))
+        super().apply(topo)
+
+    @property
+    def sessions(self) -> int:
+        """The number of iBGP sessions of the route reflector hierarchy"""
+        rrs = sum(len(rrs) for rrs, _ in self.clusters)
+        return rrs * (rrs - 1) // 2 + sum(len(rrs) * len(clients)
+                                          for rrs, clients in self.clusters)
+
+    @property
+    def full_mesh_sessions(self) -> int:
+        """The number of iBGP sessions of a full mesh"""
+        return len(self.nodes) * (len(self.nodes) - 1) // 2
+
+    def __str__(self):
+        return '<iBGPRouteReflectors %s>' % self.asn
+
+
+def _igp_distances(topo: 'IPTopo', routers: Sequence[str]) \
+        -> Dict[str, Tuple[Dict[str, float], Set[str]]]:
+    """Return the IGP distances between routers, only going through these
+    routers and switches, as well as their neighbors
+
+    :return: The distances to the other routers and the set of neighbors,
+             indexed by router"""
+    members = set(routers)
+    adjacency = {}  # type: Dict[str, List[Tuple[str, float]]]
+    for a, b, info in topo.links(withInfo=True):
+        # The interface parameters override the ones of the link, as when
+        # the interfaces are created
+        node1 = info.get('node1', a)
+        for x, y in ((a, b), (b, a)):
+            if x in members or topo.isSwitch(x):
+                params = info.get('params1' if x == node1 else 'params2', {})
+                metric = params.get('igp_metric', info.get('igp_metric')) \
+                    or MIN_IGP_METRIC
+                adjacency.setdefault(x, []).append((y, metric))
+    result = {}
+    for r in routers:
+        dist = {r: 0.}  # type: Dict[str, float]
+        prio_queue = [(0., r)]
+        while prio_queue:
+            d, x = heapq.heappop(prio_queue)
+            if d > dist[x] or (x != r and x not in members
+                               and not topo.isSwitch(x)):
+                continue
+            for y, metric in adjacency.get(x, ()):
+                if d + metric < dist.get(y, math.inf):
+                    dist[y] = d + metric
+                    heapq.heappush(prio_queue, (d + metric, y))
+        neighbors = {y for y, _ in adjacency.get(r, ()) if y in members}
+        result[r] = ({x: d for x, d in dist.items()
+                      if x in members and x != r}, neighbors)
+    return result
+
+
+def _closeness(distances: Dict[str, float], count: int) -> float:
+    """Return the sum of the distances towards the other routers, where
+    unreachable routers count more than any reachable one"""
+    unreachable = count - 1 - len(distances)
+    total = sum(distances.values())
+    return total + unreachable * (max(distances.values(), default=0.) + 1) \
+        * count
+
+
 def bgp_fullmesh(topo, routers: Sequence[str]):
     """Establish a full-mesh set of BGP peerings between routers
 
@@ -91,365 +230,311 @@ def bgp_anycast(topo: 'IPTopo', RR:'RouterDescription',router:'RouterDescription
         })
 
 
-def rm_setup(topo: 'IPTopo',router:'RouterDescription',region:str):
-    access_lists = topo.getNodeInfo(router, 'bgp_access_lists',list)
-    community_list = topo.getNodeInfo(router,'bgp_community_lists', list)
-
-    all_al = AccessList('all',('any',))
-    access_lists.append(all_al)
-
-    from_peer_cl = CommunityList(name='from-peers',community=1,action=PERMIT)
-    from_up_cl = CommunityList(name='from-up',community=2,action=PERMIT)
-    set_no_exportG_cl = CommunityList(name='set_no_exportG',community=95,action=PERMIT)
-    AS_prepend_cl = CommunityList(name='AS_prepend',community=9,action=PERMIT)
-    EU_only_cl = CommunityList(name='EU-Only',community=11,action=PERMIT)
-    NA_only_cl = CommunityList(name='NA-Only',community=31,action=PERMIT)
-    APAC_only_cl = CommunityList(name='APAC-Only',community=51,action=PERMIT)
-    blackhole_cl = CommunityList(name='blackhole',community='blackhole',action=PERMIT)
-    localPrefH_cl = CommunityList(name='localPrefH', community=10, action=PERMIT)
-    localPrefL_cl = CommunityList(name='localPrefL', community=20, action=PERMIT)
-
-    community_list.append(from_peer_cl)
-    community_list.append(from_up_cl)
-    community_list.append(set_no_exportG_cl)
-    community_list.append(AS_prepend_cl)
-    community_list.append(EU_only_cl)
-    community_list.append(APAC_only_cl)
-    community_list.append(NA_only_cl)
-    community_list.append(blackhole_cl)
-    community_list.append(localPrefH_cl)
-    community_list.append(localPrefL_cl)
-
-    route_maps = topo.getNodeInfo(router, 'bgp_route_maps', list)
-
-    # misc routeMaprs
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-set_no_export',
-        'set_actions':  [RouteMapSetAction('community','no-export')],
-        'order': 8
+# The community lists of the regional policies, in their order of rendering
+_POLICY_COMMUNITIES = (('from-peers', 1), ('from-up', 2),
+                       ('set_no_exportG', 95), ('AS_prepend', 9),
+                       ('EU-Only', 11), ('APAC-Only', 51), ('NA-Only', 31),
+                       ('blackhole', 'blackhole'), ('localPrefH', 10),
+                       ('localPrefL', 20))
+# The community marking the routes learned in each region
+_REGION_COMMUNITIES = {'NA': 10, 'EU': 30, 'APAC': 50}
+
+
+class PolicyLibrary:
+    """The BGP policies of a region, compiled once into community lists,
+    access lists and route maps that are shared by reference by all the
+    routers they are attached to"""
+
+    # The roles of the eBGP sessions
+    CUSTOMER = 'cust'
+    PEER = 'peer'
+    # The community marking the routes learned from each role
+    ROLE_COMMUNITIES = {CUSTOMER: 3, PEER: 1}
+
+    def __init__(self, region: str):
+        """:param region: The region of the routers, NA, EU or APAC
+        :raise ValueError: if a route map refers to an unknown route map,
+                           community list or access list"""
+        self.region = region
+        self.access_lists = (AccessList('all', ('any',)),)
+        self.community_lists = tuple(
+            CommunityList(name=name, community=community, action=PERMIT)
+            for name, community in _POLICY_COMMUNITIES)
+        # The route maps are only used as placeholders for their family
+        local = Peer(None, None)
+        self.route_maps = tuple(_frozen(rm) for rm in self._route_maps(local))
+        # The names of the route maps that can be called, as rendered
+        self.targets = frozenset('%s-%s' % (rm['name'], rm['neighbor'].family)
+                                 for rm in self.route_maps)
+        self.check(self.route_maps)
+        self._sessions = {role: tuple(_frozen(rm)
+                                      for rm in self._session_route_maps(role))
+                          for role in self.ROLE_COMMUNITIES}
+        for route_maps in self._sessions.values():
+            self.check(route_maps)
+
+    def check(self, route_maps: Sequence[Mapping]):
+        """Check that route maps only refer to the definitions of this library
+
+        :raise ValueError: if a route map calls an unknown route map, or
+                           matches an unknown community or access list"""
+        community_lists = {cl.name for cl in self.community_lists}
+        access_lists = {al.name for al in self.access_lists}
+        for rm in route_maps:
+            call = rm.get('call_action')
+            if call and call not in self.targets:
+                raise ValueError('Route map %s of %s calls the unknown route '
+                                 'map %s' % (rm['name'], self, call))
+            for cond in rm.get('match_cond', ()):
+                if cond.cond_type == 'community' \
+                        and cond.condition not in community_lists \
+                        or cond.cond_type == 'access-list' \
+                        and cond.condition not in access_lists:
+                    raise ValueError('Route map %s of %s matches the unknown '
+                                     '%s %s' % (rm['name'], self,
+                                                cond.cond_type,
+                                                cond.condition))
+
+    def attach(self, topo: 'IPTopo', router: 'RouterDescription'):
+        """Add the policies to a router"""
+        topo.getNodeInfo(router, 'bgp_access_lists', list)\
+            .extend(self.access_lists)
+        topo.getNodeInfo(router, 'bgp_community_lists', list)\
+            .extend(self.community_lists)
+        topo.getNodeInfo(router, 'bgp_route_maps', list)\
+            .extend(self.route_maps)
+        topo.nodeInfo(router)['bgp_policy_library'] = self
+
+    def session_route_maps(self, role: str, peer: 'RouterDescription') \
+            -> List[Dict]:
+        """Return the route maps of an eBGP session, calling the policies of
+        a role
+
+        :param role: CUSTOMER or PEER
+        :param peer: The remote router of the session"""
+        return [dict(rm, peer=peer,
+                     name='%s-%s-%s' % (role, peer, rm['direction']))
+                for rm in self._sessions[role]]
+
+    def _route_maps(self, local: 'Peer') -> List[Dict]:
+        route_maps = []  # type: List[Dict]
+        # misc routeMaprs
+        route_maps.append({
+            'match_policy': 'permit',
+            'neighbor': local,
+            'name': 'rm-set_no_export',
+            'set_actions': [RouteMapSetAction('community', 'no-export')],
+            'order': 8
         })
-
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-blackhole',
-        'set_actions': [RouteMapSetAction('community','no-export'), RouteMapSetAction('community','no-advertise')],
-        'order': 8
-    })
-
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-AS_prepend',
-        'set_actions':  [RouteMapSetAction('as-path','16276')],
-        'order': 8
+        route_maps.append({
+            'match_policy': 'permit',
+            'neighbor': local,
+            'name': 'rm-blackhole',
+            'set_actions': [RouteMapSetAction('community', 'no-export'),
+                            RouteMapSetAction('community', 'no-advertise')],
+            'order': 8
         })
-
-    # Region filters
-    if region == 'NA' or region == 'APAC':
         route_maps.append({
-            'match_policy': 'deny',
-            'neighbor': Peer(router,router),
-            'name': 'rm-continent_filters',
-            'match_cond': [RouteMapMatchCond('community', EU_only_cl.name)],
+            'match_policy': 'permit',
+            'neighbor': local,
+            'name': 'rm-AS_prepend',
+            'set_actions': [RouteMapSetAction('as-path', '16276')],
             'order': 8
-            })
+        })
 
-    if region == 'NA' or region == 'EU':
+        # Region filters
+        for order, other in ((8, 'EU'), (12, 'APAC'), (14, 'NA')):
+            if self.region in _REGION_COMMUNITIES and self.region != other:
+                route_maps.append({
+                    'match_policy': 'deny',
+                    'neighbor': local,
+                    'name': 'rm-continent_filters',
+                    'match_cond': [RouteMapMatchCond('community',
+                                                     '%s-Only' % other)],
+                    'order': order
+                })
         route_maps.append({
-            'match_policy': 'deny',
-            'neighbor': Peer(router,router),
+            'match_policy': 'permit',
+            'neighbor': local,
             'name': 'rm-continent_filters',
-            'match_cond': [RouteMapMatchCond('community', APAC_only_cl.name)],
-            'order': 12
+            'order': 15
+        })
+
+        # Customer and peer import policies
+        for role, local_prefs in ((self.CUSTOMER, (175, 225, 200)),
+                                  (self.PEER, (75, 125, 100))):
+            name = 'rm-%s-in' % role
+            route_maps.append({
+                'match_policy': 'permit',
+                'neighbor': local,
+                'name': name,
+                'match_cond': [RouteMapMatchCond('community', 'blackhole')],
+                'call_action': 'rm-blackhole-ipv4',
+                'order': 8
             })
+            for order, community, local_pref in ((12, 'localPrefL',
+                                                   local_prefs[0]),
+                                                  (16, 'localPrefH',
+                                                   local_prefs[1])):
+                route_maps.append({
+                    'match_policy': 'permit',
+                    'neighbor': local,
+                    'name': name,
+                    'match_cond': [RouteMapMatchCond('community', community)],
+                    'set_actions': [RouteMapSetAction('local-preference',
+                                                      local_pref)],
+                    'order': order
+                })
+            route_maps.append({
+                'match_policy': 'permit',
+                'neighbor': local,
+                'name': name,
+                'set_actions': [RouteMapSetAction('local-preference',
+                                                  local_prefs[2])],
+                'order': 20
+            })
+            if role == self.CUSTOMER:
+                route_maps.extend(self._export_policy(local, 'rm-cust-out',
+                                                      (8, 9, 12)))
 
-    if region == 'APAC' or region == 'EU':
+        # Peer export policy
         route_maps.append({
             'match_policy': 'deny',
-            'neighbor': Peer(router,router),
-            'name': 'rm-continent_filters',
-            'match_cond': [RouteMapMatchCond('community', NA_only_cl.name)],
-            'order': 14
-            })
-
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-continent_filters',
-        'order': 15
-        })
-
-    # Customer import policy
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-in',
-        'match_cond': [RouteMapMatchCond('community', blackhole_cl.name)],
-        'call_action':'rm-blackhole-ipv4',
-        'order': 8
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-in',
-        'match_cond': [RouteMapMatchCond('community', localPrefL_cl.name)],
-        'set_actions': [RouteMapSetAction('local-preference', 175)],
-        'order': 12
-    })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-in',
-        'match_cond': [RouteMapMatchCond('community', localPrefH_cl.name)],
-        'set_actions': [RouteMapSetAction('local-preference', 225)],
-        'order': 16
-    })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-in',
-        'set_actions': [RouteMapSetAction('local-preference', 200)],
-        'order': 20
-        })
-
-    # Customer export policy
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-out',
-        'match_cond': [RouteMapMatchCond('community', set_no_exportG_cl.name)],
-        'call_action':'rm-set_no_export-ipv4',
-        'exit_policy':'next',
-        'order': 8
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-out',
-        'match_cond': [RouteMapMatchCond('community', AS_prepend_cl.name)],
-        'call_action':'rm-AS_prepend-ipv4',
-        'exit_policy':'next',
-        'order': 9
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-cust-out',
-        'order': 12
-        })
-
-    # Peer import policy
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-in',
-        'match_cond': [RouteMapMatchCond('community', blackhole_cl.name)],
-        'call_action':'rm-blackhole-ipv4',
-        'order': 8
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-in',
-        'match_cond': [RouteMapMatchCond('community', localPrefL_cl.name)],
-        'set_actions': [RouteMapSetAction('local-preference', 75)],   
-        'order': 12
-    })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-in',
-        'match_cond': [RouteMapMatchCond('community', localPrefH_cl.name)],
-        'set_actions': [RouteMapSetAction('local-preference', 125)],
-        'order': 16
-    })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-in',
-        'set_actions': [RouteMapSetAction('local-preference', 100)],
-        'order': 20
-        })
-
-    # Peer export policy
-    route_maps.append({
-        'match_policy': 'deny',
-        'neighbor': Peer(router,router),
-        'match_cond': [RouteMapMatchCond('community', from_peer_cl.name)],
-        'name': 'rm-peer-out',
-        'order': 8
-        })
-    route_maps.append({
-        'match_policy': 'deny',
-        'neighbor': Peer(router,router),
-        'match_cond': [RouteMapMatchCond('community', from_up_cl.name)],
-        'name': 'rm-peer-out',
-        'order': 12
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-out',
-        'match_cond': [RouteMapMatchCond('community', set_no_exportG_cl.name)],
-        'call_action':'rm-set_no_export-ipv4',
-        'exit_policy':'next',
-        'order': 14
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-out',
-        'match_cond': [RouteMapMatchCond('community', AS_prepend_cl.name)],
-        'call_action':'rm-AS_prepend-ipv4',
-        'exit_policy':'next',
-        'order': 16
+            'neighbor': local,
+            'match_cond': [RouteMapMatchCond('community', 'from-peers')],
+            'name': 'rm-peer-out',
+            'order': 8
         })
-    route_maps.append({
-        'match_policy': 'permit',
-        'neighbor': Peer(router,router),
-        'name': 'rm-peer-out',
-        'order': 20
+        route_maps.append({
+            'match_policy': 'deny',
+            'neighbor': local,
+            'match_cond': [RouteMapMatchCond('community', 'from-up')],
+            'name': 'rm-peer-out',
+            'order': 12
         })
+        route_maps.extend(self._export_policy(local, 'rm-peer-out',
+                                              (14, 16, 20)))
+        return route_maps
 
-def ebgp_Client(topo: 'IPTopo',ovhR: 'RouterDescription', clientR: 'RouterDescription', region:str):
-    all_al = AccessList('all',('any',))
-    route_maps = topo.getNodeInfo(ovhR, 'bgp_route_maps', list)
-
-    # route map in
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': clientR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'in',
-        'name': 'cust-' + clientR + '-in',
-        'call_action':'rm-cust-in-ipv4',
-        'exit_policy':'next',
-        'order': 10
-        })
-    if region == 'NA':
-        route_maps.append({
+    @staticmethod
+    def _export_policy(local: 'Peer', name: str,
+                       orders: Tuple[int, int, int]) -> List[Dict]:
+        """Return the route maps exporting routes to customers or peers"""
+        return [{
             'match_policy': 'permit',
-            'peer': clientR,
-            'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-            'direction': 'in',
-            'name': 'cust-' + clientR + '-in',
-            'set_actions':  [RouteMapSetAction('community',10),RouteMapSetAction('community',3)],
-            'order': 20
-            })
-    if region == 'EU':
-        route_maps.append({
+            'neighbor': local,
+            'name': name,
+            'match_cond': [RouteMapMatchCond('community', 'set_no_exportG')],
+            'call_action': 'rm-set_no_export-ipv4',
+            'exit_policy': 'next',
+            'order': orders[0]
+        }, {
             'match_policy': 'permit',
-            'peer': clientR,
-            'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-            'direction': 'in',
-            'name': 'cust-' + clientR + '-in',
-            'set_actions':  [RouteMapSetAction('community',30),RouteMapSetAction('community',3)],
-            'order': 20
-            })
-    if region == 'APAC':
-        route_maps.append({
+            'neighbor': local,
+            'name': name,
+            'match_cond': [RouteMapMatchCond('community', 'AS_prepend')],
+            'call_action': 'rm-AS_prepend-ipv4',
+            'exit_policy': 'next',
+            'order': orders[1]
+        }, {
             'match_policy': 'permit',
-            'peer': clientR,
-            'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-            'direction': 'in',
-            'name': 'cust-' + clientR + '-in',
-            'set_actions':  [RouteMapSetAction('community',50),RouteMapSetAction('community',3)],
-            'order': 20
-            })
-
-    #route map out
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': clientR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'out',
-        'name': 'cust-' + clientR + '-out',
-        'call_action':'rm-cust-out-ipv4',
-        'exit_policy':'next',
-        'order': 10
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': clientR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'out',
-        'name': 'cust-' + clientR + '-out',
-        'order': 20
-        })
-    bgp_peering(topo, ovhR, clientR)
-    topo.linkInfo(ovhR, clientR)['igp_passive'] = True
-
-def ebgp_Peer(topo: 'IPTopo',ovhR: 'RouterDescription', peerR: 'RouterDescription', region:str):
-    all_al = AccessList('all',('any',))
-    route_maps = topo.getNodeInfo(ovhR, 'bgp_route_maps', list)
-
-    # route map in
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': peerR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'in',
-        'name': 'peer-' + peerR + '-in',
-        'call_action':'rm-peer-in-ipv4',
-        'exit_policy':'next',
-        'order': 10
-        })
-    if region == 'NA':
-        route_maps.append({
+            'neighbor': local,
+            'name': name,
+            'order': orders[2]
+        }]
+
+    def _session_route_maps(self, role: str) -> List[Dict]:
+        all_al = self.access_lists[0]
+        route_maps = [{
             'match_policy': 'permit',
-            'peer': peerR,
             'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
             'direction': 'in',
-            'name': 'peer-' + peerR + '-in',
-            'set_actions':  [RouteMapSetAction('community',10),RouteMapSetAction('community',1)],
-            'order': 20
+            'call_action': 'rm-%s-in-ipv4' % role,
+            'exit_policy': 'next',
+            'order': 10
+        }]
+        if self.region in _REGION_COMMUNITIES:
+            route_maps.append({
+                'match_policy': 'permit',
+                'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
+                'direction': 'in',
+                'set_actions': [
+                    RouteMapSetAction('community',
+                                      _REGION_COMMUNITIES[self.region]),
+                    RouteMapSetAction('community',
+                                      self.ROLE_COMMUNITIES[role])],
+                'order': 20
             })
-    if region == 'EU':
         route_maps.append({
             'match_policy': 'permit',
-            'peer': peerR,
             'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-            'direction': 'in',
-            'name': 'peer-' + peerR + '-in',
-            'set_actions':  [RouteMapSetAction('community',30),RouteMapSetAction('community',1)],
-            'order': 20
-            })
-    if region == 'APAC':
+            'direction': 'out',
+            'call_action': 'rm-%s-out-ipv4' % role,
+            'exit_policy': 'next',
+            'order': 10
+        })
         route_maps.append({
             'match_policy': 'permit',
-            'peer': peerR,
             'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-            'direction': 'in',
-            'name': 'peer-' + peerR + '-in',
-            'set_actions':  [RouteMapSetAction('community',50),RouteMapSetAction('community',1)],
+            'direction': 'out',
             'order': 20
-            })
-
-    #route map out
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': peerR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'out',
-        'name': 'peer-' + peerR + '-out',
-        'call_action':'rm-peer-out-ipv4',
-        'exit_policy':'next',
-        'order': 10
-        })
-    route_maps.append({
-        'match_policy': 'permit',
-        'peer': peerR,
-        'match_cond': [RouteMapMatchCond('access-list', all_al.name)],
-        'direction': 'out',
-        'name': 'peer-' + peerR + '-out',
-        'order': 20
         })
+        return route_maps
+
+    def __str__(self):
+        return '<PolicyLibrary %s>' % self.region
+
+
+def _frozen(route_map: Dict) -> Mapping:
+    """Return a read-only view of a route map description"""
+    return MappingProxyType({k: tuple(v) if isinstance(v, list) else v
+                             for k, v in route_map.items()})
+
+
+_policy_libraries = {}  # type: Dict[str, PolicyLibrary]
+
+
+def policy_library(region: str) -> PolicyLibrary:
+    """Return the policies of a region, compiled on first use"""
+    try:
+        return _policy_libraries[region]
+    except KeyError:
+        library = _policy_libraries[region] = PolicyLibrary(region)
+        return library
+
+
+def rm_setup(topo: 'IPTopo', router: 'RouterDescription', region: str):
+    """Add the policies of its region to a router"""
+    policy_library(region).attach(topo, router)
+
+
+def _ebgp_policy(topo: 'IPTopo', router: 'RouterDescription',
+                 remote: 'RouterDescription', region: str, role: str):
+    """Register an eBGP session whose route maps call the policies of a role
+
+    :raise ValueError: if rm_setup was not called on router"""
+    library = topo.nodeInfo(router).get('bgp_policy_library')
+    if library is None:
+        raise ValueError('The policies of %s are not set up, call rm_setup '
+                         'before adding its eBGP sessions' % router)
+    session = policy_library(region).session_route_maps(role, remote)
+    library.check(session)
+    topo.getNodeInfo(router, 'bgp_route_maps', list).extend(session)
+    bgp_peering(topo, router, remote)
+    topo.linkInfo(router, remote)['igp_passive'] = True
+
+
+def ebgp_Client(topo: 'IPTopo', ovhR: 'RouterDescription',
+                clientR: 'RouterDescription', region: str):
+    """Register an eBGP session towards a customer"""
+    _ebgp_policy(topo, ovhR, clientR, region, PolicyLibrary.CUSTOMER)
+
+
+def ebgp_Peer(topo: 'IPTopo', ovhR: 'RouterDescription',
+              peerR: 'RouterDescription', region: str):
+    """Register an eBGP session towards a peer"""
+    _ebgp_policy(topo, ovhR, peerR, region, PolicyLibrary.PEER)
 
-    bgp_peering(topo, ovhR, peerR)
-    topo.linkInfo(ovhR, peerR)['igp_passive'] = True
 
 def ibgp_Inter_Region(topo: 'IPTopo',r1 : 'RouterDescription', r2: 'RouterDescription'):
     all_al = AccessList('all',('any',))
@@ -771,18 +856,30 @@ class BGPConfig:
         return self
 
 
-def set_rr(topo: 'IPTopo', rr: str, peers: Sequence[str] = ()):
+def set_rr(topo: 'IPTopo', rr: str, peers: Sequence[str] = (),
+           cluster_id: Optional[int] = None):
     """
     Set rr as route reflector for all router r
 
     :param topo: The current topology
     :param rr: The route reflector
-    :param peers: Clients of the route reflector
+    :param peers: Clients of the route reflector. If none are given, all the
+                  iBGP peers of the route reflector are its clients.
+    :param cluster_id: The cluster id of the route reflector, to be shared
+                       by redundant route reflectors. Their router id by
+                       default.
     """
     for r in peers:
         bgp_peering(topo, rr, r)
     router_is_rr = topo.getNodeInfo(rr, 'bgp_rr_info', list)
     router_is_rr.append(True)
+    if peers:
+        topo.getNodeInfo(rr, 'bgp_rr_clients', list)\
+            .extend(str(r) for r in peers)
+    else:
+        topo.nodeInfo(rr)['bgp_rr_all_clients'] = True
+    if cluster_id is not None:
+        topo.nodeInfo(rr)['bgp_rr_cluster'] = cluster_id
 
 
 class BGP(QuaggaDaemon):
@@ -813,6 +910,14 @@ class BGP(QuaggaDaemon):
         cfg.community_lists = self.build_community_list()
         cfg.route_maps = self.build_route_map(cfg.neighbors)
         cfg.rr = self._node.get('bgp_rr_info')
+        cfg.cluster_id = self._node.get('bgp_rr_cluster') or cfg.routerid
+        clients = set(self._node.get('bgp_rr_clients', ()))
+        all_clients = self._node.get('bgp_rr_all_clients', False)
+        for n in cfg.neighbors:
+            n.rr_client = bool(cfg.rr) and n.asn == cfg.asn \
+                and (all_clients or n.node in clients)
+        cfg.peer_groups = self.build_peer_groups(cfg.neighbors,
+                                                 cfg.address_families)
         cfg.bgppassword = self.bgppassword
         cfg.bgpMaxPrefixNumber = self.bgpMaxPrefixNumber
 
@@ -854,37 +959,75 @@ class BGP(QuaggaDaemon):
         Build and return a list of route map for the current node
         """
         node_route_maps = self._node.get('bgp_route_maps')
-        route_maps = []  # type: List[RouteMap]
-        if node_route_maps is not None:
-            for kwargs in node_route_maps:
-                if('peer' not in kwargs):
-                    rm = RouteMap(**kwargs)
-                    route_maps.append(rm)
-                    continue
-                remote_peer = kwargs.pop('peer')
-                peers = []
-                for neighbor in neighbors:
-                    if neighbor.node == remote_peer:
-                        peers.append(neighbor)
-                for peer in peers:
-                    kwargs['neighbor'] = peer
-                    rm = RouteMap(**kwargs)
-                    # If route map already exist, add conditions and actions
-                    # to it
-                    try:
-                        index = route_maps.index(rm)
-                        tmp_rm = route_maps.pop(index)
-                        rm.append_match_cond(tmp_rm.match_cond)
-                        rm.append_set_action(tmp_rm.set_actions)
-                    except ValueError:
-                        pass
-                    route_maps.append(rm)
-        return route_maps
+        if node_route_maps is None:
+            return []
+        # Route maps with the same neighbor, direction, exit policy and
+        # order are merged, see RouteMap.__eq__
+        route_maps = OrderedDict()  # type: Dict[Any, RouteMap]
+        peers = {}  # type: Dict[str, List[Peer]]
+        for neighbor in neighbors:
+            peers.setdefault(neighbor.node, []).append(neighbor)
+        for kwargs in node_route_maps:
+            if 'peer' not in kwargs:
+                rm = RouteMap(**kwargs)
+                route_maps[id(rm)] = rm
+                continue
+            # The description is shared by the builds of all routers
+            kwargs = dict(kwargs)
+            remote_peer = kwargs.pop('peer')
+            for peer in peers.get(remote_peer, ()):
+                kwargs['neighbor'] = peer
+                rm = RouteMap(**kwargs)
+                key = (peer, rm.direction, rm.exit_policy, rm.order)
+                # If route map already exist, add conditions and actions
+                # to it
+                tmp_rm = route_maps.pop(key, None)
+                if tmp_rm is not None:
+                    rm.append_match_cond(tmp_rm.match_cond)
+                    rm.append_set_action(tmp_rm.set_actions)
+                route_maps[key] = rm
+        return list(route_maps.values())
+
+    def build_peer_groups(self, neighbors: Sequence['Peer'],
+                          address_families: Sequence['AddressFamily']) \
+            -> List['PeerGroup']:
+        """
+        Group the neighbors sharing the same session and address family
+        settings, in the order of their first member
+        """
+        activated = {af.name: {id(n) for n in af.neighbors}
+                     for af in address_families}
+        groups = {}  # type: Dict[Tuple, List[Peer]]
+        for n in neighbors:
+            afs = tuple(name for name, peers in activated.items()
+                        if id(n) in peers)
+            key = (n.asn, n.port, n.ebgp_multihop, n.family, n.nh_self,
+                   n.rr_client, afs)
+            groups.setdefault(key, []).append(n)
+        names = set()  # type: Set[str]
+        peer_groups = []
+        for (asn, _, _, family, _, rr_client, afs), peers in groups.items():
+            if self.options.peer_groups <= 0 \
+                    or len(peers) < self.options.peer_groups:
+                peer_groups.extend(PeerGroup(None, [p], afs) for p in peers)
+                continue
+            name = 'as%s-%s%s' % (asn, family, '-clients' if rr_client else '')
+            base, i = name, 1
+            while name in names:
+                i += 1
+                name = '%s-%d' % (base, i)
+            names.add(name)
+            peer_groups.append(PeerGroup(name, peers, afs))
+        return peer_groups
 
     def set_defaults(self, defaults):
         """:param debug: the set of debug events that should be logged
-        :param address_families: The set of AddressFamily to use"""
+        :param address_families: The set of AddressFamily to use
+        :param peer_groups: The number of neighbors with the same settings
+                            from which they are configured as a peer group,
+                            0 to never use peer groups"""
         defaults.address_families = [AF_INET(), AF_INET6()]
+        defaults.peer_groups = 2
         super().set_defaults(defaults)
 
     def _build_neighbors(self) -> List['Peer']:
@@ -912,6 +1055,30 @@ class BGP(QuaggaDaemon):
         return BGPConfig(topo=topo, router=node)
 
 
+class PeerGroup:
+    """A set of BGP peers sharing the same session and address family
+    settings, configured once as a peer group"""
+
+    def __init__(self, name: Optional[str], peers: List['Peer'],
+                 address_families: Sequence[str]):
+        """:param name: The name of the peer group, None for a single peer
+                     configured on its own
+        :param peers: The peers of the group
+        :param address_families: The names of the address families where
+                                 the peers are activated"""
+        self.is_group = name is not None
+        self.name = name if self.is_group else peers[0].peer
+        self.peers = peers
+        self.address_families = address_families
+        peer = peers[0]
+        self.asn = peer.asn
+        self.port = peer.port
+        self.ebgp_multihop = peer.ebgp_multihop
+        self.family = peer.family
+        self.nh_self = peer.nh_self
+        self.rr_client = peer.rr_client
+
+
 class AddressFamily:
     """An address family that is exchanged through BGP"""
 
@@ -963,29 +1130,47 @@ class Peer:
             -> Tuple[Optional[str], Optional['Router']]:
         """Return the IP address that base should try to contact to establish
         a peering"""
-        visited = set()  # type: Set[IPIntf]
-        to_visit = {i.name: i for i in realIntfList(base)}
-        prio_queue = [(0, i) for i in to_visit.keys()]
-        #heapq.heapify(prio_queue)
-        # Explore all interfaces in base ASN recursively, until we find one
-        # connected to the peer
-        iterations = 0
-        while to_visit:
-            path_cost, i = prio_queue.pop(0)
-            if i in visited:
-                continue
-            i = to_visit.pop(i)
-            visited.add(i)
-            for n in i.broadcast_domain.routers:
-                if n.node.name == peer:
-                    if not v6:
-                        return n.ip, n.node
-                    if n.ip6 and not ip_address(n.ip6).is_link_local:
-                        return n.ip6, n.node
-                    return None, None
-                if n.node.asn == base.asn or not n.node.asn:
-                    for i in realIntfList(n.node):
-                        to_visit[i.name] = i
-                        prio_queue += [(path_cost + i.igp_metric,i.name),]
-            iterations += 1
+        n = _peer_interfaces(base).get(peer)
+        if n is None:
+            return None, None
+        if not v6:
+            return n.ip, n.node
+        if n.ip6 and not ip_address(n.ip6).is_link_local:
+            return n.ip6, n.node
         return None, None
+
+
+def _peer_interfaces(base: 'Router') -> Dict[str, IPIntf]:
+    """Return, for every router that base can reach through routers of its
+    own AS, the interface of that router that is the closest to base
+    according to the IGP metrics. The result is cached until the broadcast
+    domains of the network change.
+
+    :return: The interfaces, indexed by router name"""
+    intfs = realIntfList(base)
+    index = next((i.broadcast_domain.index for i in intfs
+                  if i.broadcast_domain is not None), None)
+    key = ('bgp_peer_interfaces', base.name)
+    if index is not None and key in index.cache:
+        return index.cache[key]
+    found = {}  # type: Dict[str, IPIntf]
+    visited = set()  # type: Set[IPIntf]
+    # Ties are broken by insertion order, never by comparing interfaces
+    counter = itertools.count()
+    prio_queue = [(0, next(counter), i) for i in intfs]
+    # Explore all interfaces in base ASN by increasing IGP cost
+    while prio_queue:
+        path_cost, _, i = heapq.heappop(prio_queue)
+        if i in visited or i.broadcast_domain is None:
+            continue
+        visited.add(i)
+        for n in i.broadcast_domain.routers:
+            found.setdefault(n.node.name, n)
+            if n.node.asn == base.asn or not n.node.asn:
+                for j in realIntfList(n.node):
+                    if j not in visited:
+                        heapq.heappush(prio_queue, (path_cost + j.igp_metric,
+                                                    next(counter), j))
+    if index is not None:
+        index.cache[key] = found
+    return found
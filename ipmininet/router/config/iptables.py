@@ -17,16 +17,20 @@ class IPTables(Daemon):
     various table names, commands, pre-existing chains, ..."""
 
     NAME = 'iptables'
+    # iptables-restore exits once the rules are loaded
+    SUPERVISED = False
 
     @property
     def startup_line(self):
-        return '{name}-restore {fname}'.format(name=self.NAME,
-                                               fname=self.cfg_filename)
+        return '{restore} {fname}'.format(
+            restore=self._executable('%s-restore' % self.NAME),
+            fname=self.cfg_filename)
 
     @property
     def dry_run(self):
-        return '{name}-restore -vt {fname}'.format(name=self.NAME,
-                                                   fname=self.cfg_filename)
+        return '{restore} -vt {fname}'.format(
+            restore=self._executable('%s-restore' % self.NAME),
+            fname=self.cfg_filename)
 
     def set_defaults(self, defaults):
         """
@@ -0,0 +1,297 @@
+"""This module writes the configuration files of the daemons and keeps track
+of them in a manifest, so that unchanged files are not rewritten across
+builds of a network."""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set, Tuple, \
+    Union
+
+from mininet.log import lg as log
+
+
+def _umask() -> int:
+    """Return the umask of the process without changing it, as os.umask
+    would, even briefly, for the other threads"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0o022  # The usual default, for kernels older than 4.7
+
+
+# The permissions of the files that open() would create
+FILE_MODE = 0o666 & ~_umask()
+
+
+# The size (in bytes) above which a rendered file is no longer kept in
+# memory, but spooled to a temporary file next to its destination
+SPOOL_THRESHOLD = 1 << 20
+# The amount of text buffered before being encoded
+_CHUNK_SIZE = 1 << 16
+
+
+class SpooledContent:
+    """The content of a file being rendered, used as the output buffer of a
+    template. It remains in memory while it is small, and is written to a
+    temporary file once it exceeds a threshold, so that rendering a large
+    configuration uses a bounded amount of memory."""
+
+    def __init__(self, path: str, threshold: Optional[int] = None):
+        """:param path: The destination of the content
+        :param threshold: The size of the content above which it is spooled
+                          to a temporary file, SPOOL_THRESHOLD by default"""
+        self.path = path
+        self.threshold = SPOOL_THRESHOLD if threshold is None else threshold
+        self.size = 0
+        self.tmp = None  # type: Optional[str]
+        self._text = []  # type: List[str]
+        self._text_len = 0
+        self._data = []  # type: List[bytes]
+        self._file = None  # type: Optional[BinaryIO]
+        self._hash = hashlib.sha1()
+        self._digest = None  # type: Optional[str]
+
+    def write(self, text: str):
+        self._text.append(text)
+        self._text_len += len(text)
+        if self._text_len >= _CHUNK_SIZE:
+            self._flush_text()
+
+    def _flush_text(self):
+        data = ''.join(self._text).encode('utf-8')
+        self._text = []
+        self._text_len = 0
+        self._hash.update(data)
+        self.size += len(data)
+        if self._file is None:
+            self._data.append(data)
+            if self.size > self.threshold:
+                self._spool()
+        else:
+            self._file.write(data)
+
+    def _spool(self):
+        directory, name = os.path.split(self.path)
+        fd, self.tmp = tempfile.mkstemp(prefix='.%s.' % name,
+                                        dir=directory or '.')
+        self._file = os.fdopen(fd, 'wb')
+        for data in self._data:
+            self._file.write(data)
+        self._data = []
+
+    def close(self) -> Union[str, 'SpooledContent']:
+        """Terminate the content
+
+        :return: The content as a string if it was not spooled, or this
+                 object"""
+        self._flush_text()
+        self._digest = self._hash.hexdigest()
+        if self._file is None:
+            return b''.join(self._data).decode('utf-8')
+        self._file.close()
+        self._file = None
+        return self
+
+    @property
+    def digest(self) -> str:
+        return self._digest
+
+    def discard(self):
+        """Remove the temporary file, if any"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.tmp is not None:
+            try:
+                os.unlink(self.tmp)
+            except OSError:
+                pass
+            self.tmp = None
+
+    def __getstate__(self):
+        # Only closed contents are sent across processes
+        state = self.__dict__.copy()
+        state['_hash'] = None
+        return state
+
+
+class ConfigManifest:
+    """The configuration files generated for a network, with the digest,
+    size and modification time of their content. A file whose entry still
+    matches the disk and the new content does not have to be written
+    again."""
+
+    VERSION = 1
+
+    def __init__(self, path: Optional[str] = None):
+        """:param path: The file storing the manifest across runs, None to
+                        keep it in memory only"""
+        self.path = path
+        self._files = {}  # type: Dict[str, Tuple[str, int, int]]
+        self._generated = set()  # type: Set[str]
+        self.written = []  # type: List[str]
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        """Read the manifest of a previous run, if any"""
+        try:
+            with open(self.path) as fileobj:
+                data = json.load(fileobj)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning('Ignoring the configuration manifest %s: %s\n'
+                        % (self.path, e))
+            return
+        if data.get('version') != self.VERSION:
+            return
+        self._files = {path: tuple(entry)
+                       for path, entry in data.get('files', {}).items()}
+
+    def save(self):
+        """Store the manifest, if it has a path"""
+        if self.path is None:
+            return
+        with self._lock:
+            data = {'version': self.VERSION, 'files': self._files}
+            content = json.dumps(data, indent=1, sort_keys=True)
+        write_file(self.path, content)
+
+    def begin(self):
+        """Start a new build of the configuration files"""
+        with self._lock:
+            self._generated = set()
+            self.written = []
+
+    def unchanged(self, path: str, digest: str) -> bool:
+        """Return whether a file is known to hold a given content"""
+        with self._lock:
+            entry = self._files.get(path)
+        if entry is None or entry[0] != digest:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return entry[1:] == (st.st_size, st.st_mtime_ns)
+
+    def record(self, path: str, digest: str, written: bool):
+        """Record that a file was generated during the current build
+
+        :param path: The path of the file
+        :param digest: The digest of its content
+        :param written: Whether the file had to be written"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._files[path] = (digest, st.st_size, st.st_mtime_ns)
+            self._generated.add(path)
+            if written:
+                self.written.append(path)
+
+    def forget(self, paths: Iterable[str]):
+        """Remove files from the manifest, e.g. because they were deleted"""
+        with self._lock:
+            for path in paths:
+                self._files.pop(path, None)
+                self._generated.discard(path)
+
+    def stale(self) -> List[str]:
+        """Return the files of the previous builds that were not generated
+        by the current one"""
+        with self._lock:
+            return sorted(p for p in self._files if p not in self._generated)
+
+    def prune(self) -> List[str]:
+        """Delete the stale files
+
+        :return: The deleted files"""
+        stale = self.stale()
+        for path in stale:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning('Cannot remove %s: %s\n' % (path, e))
+        self.forget(stale)
+        return stale
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return path in self._files
+
+    def __len__(self):
+        with self._lock:
+            return len(self._files)
+
+
+def discard_contents(contents: Iterable[Union[str, SpooledContent]]):
+    """Remove the temporary files of contents that will not be written"""
+    for content in contents:
+        if isinstance(content, SpooledContent):
+            content.discard()
+
+
+def _same_content(path: str, size: int, digest: str) -> bool:
+    try:
+        if os.stat(path).st_size != size:
+            return False
+        existing = hashlib.sha1()
+        with open(path, 'rb') as fileobj:
+            for data in iter(lambda: fileobj.read(_CHUNK_SIZE), b''):
+                existing.update(data)
+        return existing.hexdigest() == digest
+    except OSError:
+        return False
+
+
+def write_file(path: str, content: Union[str, SpooledContent],
+               manifest: Optional[ConfigManifest] = None) -> bool:
+    """Write a file, unless it already has the given content. The file is
+    written in a temporary file that then replaces it, so that it is never
+    seen half-written.
+
+    :param path: The path of the file
+    :param content: Its content, possibly spooled to a temporary file
+    :param manifest: The manifest recording the file, if any
+    :return: Whether the file was written"""
+    if isinstance(content, SpooledContent):
+        data = None
+        digest, size, tmp = content.digest, content.size, content.tmp
+    else:
+        data = content.encode('utf-8')
+        digest, size, tmp = hashlib.sha1(data).hexdigest(), len(data), None
+    written = False
+    try:
+        if not (manifest is not None and manifest.unchanged(path, digest)) \
+                and not _same_content(path, size, digest):
+            if tmp is None:
+                directory, name = os.path.split(path)
+                fd, tmp = tempfile.mkstemp(prefix='.%s.' % name,
+                                           dir=directory or '.')
+                with os.fdopen(fd, 'wb') as fileobj:
+                    fileobj.write(data)
+            os.chmod(tmp, FILE_MODE)
+            os.replace(tmp, path)
+            tmp = None
+            written = True
+    finally:
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+    if manifest is not None:
+        manifest.record(path, digest, written)
+    return written
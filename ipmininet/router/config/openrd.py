@@ -15,7 +15,7 @@ class OpenrDaemon(RouterDaemon):
     @property
     def startup_line(self):
         return '{name} {cfg} {extra}'\
-                .format(name=self.NAME,
+                .format(name=self._executable(),
                         cfg=self._cfg_options(),
                         extra=self.STARTUP_LINE_EXTRA)
 
@@ -246,4 +246,4 @@ class OpenrDaemon(RouterDaemon):
         # TODO: Replace with a config parser or shutdown the daemon after few
         # seconds
         return '{name} --version'\
-               .format(name=self.NAME)
+               .format(name=self._executable())
@@ -68,6 +68,8 @@ class RADVD(RouterDaemon):
 
     NAME = 'radvd'
     KILL_PATTERNS = (NAME,)
+    # radvd forks in the background
+    SUPERVISED = False
 
     def build(self):
         cfg = super().build()
@@ -113,14 +115,16 @@ class RADVD(RouterDaemon):
 
     @property
     def startup_line(self):
-        return ('radvd -d {debuglevel} -C {cfg} -p {pid} -m logfile -l {log}'
-                ' -u root'.format(debuglevel=self.options.debuglevel,
+        return ('{name} -d {debuglevel} -C {cfg} -p {pid} -m logfile -l {log}'
+                ' -u root'.format(name=self._executable(),
+                                  debuglevel=self.options.debuglevel,
                                   cfg=self.cfg_filename, log=self._file('log'),
                                   pid=self._file('pid')))
 
     @property
     def dry_run(self):
-        return 'radvd -c -C {cfg} -u root'.format(cfg=self.cfg_filename)
+        return '{name} -c -C {cfg} -u root'.format(name=self._executable(),
+                                                   cfg=self.cfg_filename)
 
     def cleanup(self):
         try:
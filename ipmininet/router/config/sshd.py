@@ -1,9 +1,9 @@
 """This module defines an sshd configuration."""
-from distutils.spawn import find_executable
 import subprocess
 import os
 import tempfile
 
+from ipmininet.utils import find_cmd
 from .base import Daemon
 
 
@@ -21,7 +21,7 @@ subprocess.call(['ssh-keygen', '-b', '2048', '-t', 'rsa', '-f', KEYFILE, '-q',
 class SSHd(Daemon):
 
     NAME = 'sshd'
-    STARTUP_LINE_BASE = '{name} -D -u0'.format(name=find_executable(NAME))
+    STARTUP_LINE_BASE = '{name} -D -u0'.format(name=find_cmd(NAME) or NAME)
     KILL_PATTERNS = (STARTUP_LINE_BASE,)
 
     @property
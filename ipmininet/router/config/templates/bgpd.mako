@@ -21,19 +21,27 @@ router bgp ${node.bgpd.asn}
         %endif
     %endfor
 
-    % for n in node.bgpd.neighbors:
+    % for g in node.bgpd.peer_groups:
         no auto-summary
-        neighbor ${n.peer} remote-as ${n.asn}
+        % if g.is_group:
+        neighbor ${g.name} peer-group
+        % endif
+        neighbor ${g.name} remote-as ${g.asn}
+        neighbor ${g.name} password ${node.bgpd.bgppassword}  
+        neighbor ${g.name} maximum-prefix ${node.bgpd.bgpMaxPrefixNumber}
+        neighbor ${g.name} ttl-security hops 5
+        neighbor ${g.name} send-community
+        % if g.ebgp_multihop:
+        neighbor ${g.name} ebgp-multihop
+        %endif
+        % for n in g.peers:
+            % if g.is_group:
+        neighbor ${n.peer} peer-group ${g.name}
+            % endif
         neighbor ${n.peer} port ${n.port}
         neighbor ${n.peer} description ${n.description}
-        neighbor ${n.peer} password ${node.bgpd.bgppassword}  
-        neighbor ${n.peer} maximum-prefix ${node.bgpd.bgpMaxPrefixNumber}
-        neighbor ${n.peer} ttl-security hops 5
-        neighbor ${n.peer} send-community
-        % if n.ebgp_multihop:
-        neighbor ${n.peer} ebgp-multihop
-        %endif
     <%block name="neighbor"/>
+        % endfor
     % endfor
 
     % for af in node.bgpd.address_families:
@@ -49,19 +57,19 @@ router bgp ${node.bgpd.asn}
         % for r in af.redistribute:
         redistribute ${r}
         % endfor
-        % for n in af.neighbors:
-            % if n.family == af.name:
-        neighbor ${n.peer} activate
-                % if n.nh_self:
-        neighbor ${n.peer} ${n.nh_self}
+        % for g in node.bgpd.peer_groups:
+            % if g.family == af.name and af.name in g.address_families:
+        neighbor ${g.name} activate
+                % if g.nh_self:
+        neighbor ${g.name} ${g.nh_self}
                 % endif
-                % if node.bgpd.rr and n.asn == node.bgpd.asn:
-        neighbor ${n.peer} route-reflector-client
+                % if g.rr_client:
+        neighbor ${g.name} route-reflector-client
                 % endif
             % endif
         % endfor
         % if node.bgpd.rr:
-        bgp cluster-id ${node.bgpd.routerid}
+        bgp cluster-id ${node.bgpd.cluster_id}
         % endif
     % endfor
 
@@ -1,8 +1,8 @@
 import os
-import socket
 from ipaddress import IPv4Network, IPv6Network
 from typing import Optional, Union, Sequence, Tuple
 
+from ipmininet.readiness import UnixSocketProbe
 from .base import RouterDaemon
 from .utils import ConfigDict
 
@@ -20,7 +20,7 @@ class QuaggaDaemon(RouterDaemon):
     @property
     def startup_line(self):
         return '{name} -f {cfg} -i {pid} -z {api} -u root {extra}'\
-                .format(name=self.NAME,
+                .format(name=self._executable(),
                         cfg=self.cfg_filename,
                         pid=self._file('pid'),
                         api=self.zebra_socket,
@@ -45,7 +45,7 @@ class QuaggaDaemon(RouterDaemon):
     @property
     def dry_run(self):
         return '{name} -Cf {cfg} -u root'\
-               .format(name=self.NAME,
+               .format(name=self._executable(),
                        cfg=self.cfg_filename)
 
 
@@ -83,16 +83,13 @@ class Zebra(QuaggaDaemon):
     def has_started(self):
         # We override this such that we wait until we have the API socket
         # and until wa can connect to it
-        return os.path.exists(self.zebra_socket) and self.listening()
+        return all(p.ready() for p in self.readiness_probes())
+
+    def readiness_probes(self):
+        return [UnixSocketProbe(self.zebra_socket)]
 
     def listening(self) -> bool:
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        try:
-            sock.connect(self.zebra_socket)
-            sock.close()
-            return True
-        except socket.error:
-            return False
+        return UnixSocketProbe(self.zebra_socket).ready()
 
 
 class CommunityList:
@@ -0,0 +1,179 @@
+"""This module supervises the daemons of the nodes: a single thread notices
+the daemons that exited, restarts them according to a policy, and samples
+their resource usage from /proc."""
+import collections
+import os
+import threading
+import time
+import weakref
+from typing import Deque, List, Optional
+
+from mininet.log import lg as log
+
+# The number of resource samples kept for each daemon
+MAX_SAMPLES = 720
+# The default interval (in seconds) between two checks of a daemon
+SAMPLE_INTERVAL = 5.
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK')
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class ResourceSample:
+    """The resources used by a process at a given time"""
+    __slots__ = ('time', 'pid', 'cpu_time', 'rss', 'fds')
+
+    def __init__(self, time: float, pid: int, cpu_time: float, rss: int,
+                 fds: int):
+        """:param time: The time of the sample, as returned by time.time()
+        :param pid: The pid of the process
+        :param cpu_time: Its user and system CPU time, in seconds
+        :param rss: Its resident set size, in bytes
+        :param fds: Its number of open file descriptors"""
+        self.time = time
+        self.pid = pid
+        self.cpu_time = cpu_time
+        self.rss = rss
+        self.fds = fds
+
+    def __repr__(self):
+        return 'ResourceSample(time=%.3f, pid=%d, cpu_time=%.2f, rss=%d, ' \
+               'fds=%d)' % (self.time, self.pid, self.cpu_time, self.rss,
+                            self.fds)
+
+
+class ProcessExit:
+    """The unexpected exit of a process"""
+
+    def __init__(self, time: float, pid: int, code: int):
+        """:param time: The time at which the exit was noticed
+        :param pid: The pid of the process
+        :param code: Its return code, negative if it was killed by a
+                     signal"""
+        self.time = time
+        self.pid = pid
+        self.code = code
+
+    def __repr__(self):
+        return 'ProcessExit(time=%.3f, pid=%d, code=%d)' % (self.time,
+                                                            self.pid,
+                                                            self.code)
+
+
+def sample_process(pid: int) -> Optional[ResourceSample]:
+    """Read the resources used by a process in /proc
+
+    :return: The sample, None if the process does not exist anymore"""
+    try:
+        with open('/proc/%d/stat' % pid) as fileobj:
+            stat = fileobj.read()
+        with open('/proc/%d/statm' % pid) as fileobj:
+            statm = fileobj.read()
+        fds = len(os.listdir('/proc/%d/fd' % pid))
+    except (OSError, ValueError):
+        return None
+    # The command name may contain spaces and is enclosed in parentheses
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu_time = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    rss = int(statm.split()[1]) * _PAGE_SIZE
+    return ResourceSample(time.time(), pid, cpu_time, rss, fds)
+
+
+class RestartPolicy:
+    """When to restart a daemon that exited: after a delay doubling at each
+    consecutive restart, up to a number of restarts. A daemon that ran long
+    enough before exiting starts again with the initial delay."""
+
+    def __init__(self, max_restarts: Optional[int] = 5, initial_delay=1.,
+                 max_delay=60., reset_after=60.):
+        """:param max_restarts: The number of consecutive restarts, None for
+                                no limit
+        :param initial_delay: The delay before the first restart, in seconds
+        :param max_delay: The maximal delay before a restart
+        :param reset_after: The time after which a running daemon is
+                            considered healthy again"""
+        self.max_restarts = max_restarts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.reset_after = reset_after
+
+    def delay(self, restarts: int) -> Optional[float]:
+        """Return the delay before a restart
+
+        :param restarts: The number of consecutive restarts so far
+        :return: The delay in seconds, None if the daemon should remain
+                 stopped"""
+        if self.max_restarts is not None and restarts >= self.max_restarts:
+            return None
+        return min(self.initial_delay * 2 ** restarts, self.max_delay)
+
+
+class ProcessHistory:
+    """The resource samples and the exits of a supervised process"""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.samples = collections.deque(
+            maxlen=max_samples)  # type: Deque[ResourceSample]
+        self.exits = []  # type: List[ProcessExit]
+        self.restarts = 0
+        self.restart_at = None  # type: Optional[float]
+        self.started_at = time.monotonic()
+        self.running = False
+
+    def since(self, start: Optional[float] = None) -> List[ResourceSample]:
+        """Return the samples taken since a given time
+
+        :param start: The time, as returned by time.time(), all the kept
+                      samples by default"""
+        samples = list(self.samples)
+        if start is None:
+            return samples
+        return [s for s in samples if s.time >= start]
+
+
+class Supervisor:
+    """A thread calling the supervise() method of the registered process
+    helpers, whenever they ask for it"""
+
+    def __init__(self):
+        self._helpers = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+
+    def register(self, helper):
+        """Start supervising the processes of a helper
+
+        :param helper: An object whose supervise(now) method returns the
+                       next time.monotonic() at which it should be called"""
+        with self._lock:
+            self._helpers.add(helper)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='supervisor',
+                                                daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unregister(self, helper):
+        with self._lock:
+            self._helpers.discard(helper)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                helpers = list(self._helpers)
+            now = time.monotonic()
+            deadline = now + SAMPLE_INTERVAL
+            for helper in helpers:
+                try:
+                    deadline = min(deadline, helper.supervise(now))
+                except Exception as e:  # Keep supervising the others
+                    log.error('Cannot supervise the processes of %s: %s\n'
+                              % (helper, e))
+            del helpers
+            self._wake.wait(max(deadline - time.monotonic(), 0.))
+            self._wake.clear()
+
+
+supervisor = Supervisor()
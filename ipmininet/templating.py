@@ -0,0 +1,122 @@
+"""Template lookups whose compiled Mako templates are stored on disk and
+shared across processes, and the accounting of the time spent compiling
+and rendering configuration templates."""
+import hashlib
+import os
+import stat
+import threading
+import time
+from typing import Optional, Tuple
+
+import mako
+from mako.lookup import TemplateLookup
+from mininet.log import lg as log
+
+# Set this to None to disable the on-disk cache of compiled templates. The
+# cache is private to the user since the compiled templates are imported.
+CACHE_DIR = os.environ.get('IPMININET_TEMPLATE_CACHE',
+                           os.path.join(os.environ.get('XDG_CACHE_HOME')
+                                        or os.path.expanduser('~/.cache'),
+                                        'ipmininet', 'templates'))
+
+
+class RenderStats:
+    """The time spent compiling and rendering templates"""
+
+    def __init__(self):
+        self.compile_time = 0.
+        self.render_time = 0.
+        self._lock = threading.Lock()
+
+    def add_compile(self, duration: float):
+        with self._lock:
+            self.compile_time += duration
+
+    def add_render(self, duration: float):
+        with self._lock:
+            self.render_time += duration
+
+    def snapshot(self) -> Tuple[float, float]:
+        """:return: The compile and render times, in seconds"""
+        with self._lock:
+            return self.compile_time, self.render_time
+
+
+render_stats = RenderStats()
+
+
+def _content_hash(directory: str) -> str:
+    """Return a digest of the templates of a directory and of the Mako
+    version compiling them"""
+    digest = hashlib.sha1(mako.__version__.encode())
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            continue
+        digest.update(name.encode() + b'\0')
+        with open(path, 'rb') as fileobj:
+            digest.update(fileobj.read())
+    return digest.hexdigest()
+
+
+def _private_dir(path: str):
+    """Create a directory only accessible to the current user, or check that
+    an existing one is
+
+    :raise OSError: if the directory cannot be created or could be modified
+                    by another user"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise OSError('%s is not a directory' % path)
+    if st.st_uid != os.geteuid():
+        raise OSError('%s is owned by uid %d' % (path, st.st_uid))
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError('%s is writable by other users' % path)
+
+
+class CachedTemplateLookup(TemplateLookup):
+    """A TemplateLookup over one directory of templates, that stores the
+    compiled templates in a cache directory keyed by the content of the
+    templates. The cached modules are thus reused by the next processes
+    and discarded as soon as a template changes."""
+
+    def __init__(self, directory: str, cache_dir: Optional[str] = CACHE_DIR,
+                 **kwargs):
+        """:param directory: The directory of the templates
+        :param cache_dir: The base directory of the cache, None to disable it.
+                          It is not used if other users can write in it.
+        :param kwargs: Additional arguments for TemplateLookup"""
+        self.directory = directory
+        module_directory = None
+        if cache_dir is not None:
+            module_directory = os.path.join(cache_dir,
+                                            _content_hash(directory))
+            try:
+                _private_dir(cache_dir)
+                _private_dir(module_directory)
+            except OSError as e:
+                log.warning('Cannot cache compiled templates in %s: %s\n'
+                          % (module_directory, e))
+                module_directory = None
+        # The templates cannot change without changing the cache directory
+        kwargs.setdefault('filesystem_checks', module_directory is None)
+        super().__init__(directories=[directory],
+                         module_directory=module_directory, **kwargs)
+
+    def _load(self, filename, uri):
+        start = time.perf_counter()
+        try:
+            return super()._load(filename, uri)
+        finally:
+            render_stats.add_compile(time.perf_counter() - start)
+
+    def warm_up(self):
+        """Load all the templates of the directory"""
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.mako'):
+                continue
+            try:
+                self.get_template(name)
+            except Exception as e:  # The error is reported when rendering
+                log.debug('Cannot compile template %s: %s\n' % (name, e))
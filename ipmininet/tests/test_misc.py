@@ -1,15 +1,39 @@
+import errno
 import os
+import select
 import subprocess
+import threading
+import time
 
 import ipaddress
 import pytest
+from mininet.net import Mininet
 
+import ipmininet.ipnet as ipnet
 import ipmininet.utils as utils
 from ipmininet.clean import cleanup
+from ipmininet.examples.bgp_rr import BGPTopoRR
+from ipmininet.examples.simple_bgp_network import SimpleBGPTopo
 from ipmininet.examples.static_address_network import StaticAddressNet
-from ipmininet.ipnet import IPNet
+from ipmininet.ipnet import IPNet, NetworkStartError, PrefixAllocator
+from ipmininet.iptopo import IPTopo
 from ipmininet.link import _parse_addresses
+from ipmininet.logpump import OutputLog, output_pump
+from ipmininet.launcher import LauncherClient
+from ipmininet.lpm import AddressIndex
+from ipmininet.netlink import AddressMonitor, NetlinkSocket
+from ipmininet.offline import OfflineIPNet, generate_configs
+from ipmininet.router import ForkServerHelper, ProcessHelper
+from ipmininet.router.__router import _sysctl_path
+from ipmininet.router.config import BGP, AF_INET6, ebgp_session, set_rr
+from ipmininet.router.config.bgp import Peer, iBGPRouteReflectors, \
+    _igp_distances, ebgp_Client, policy_library, rm_setup
+from ipmininet.supervisor import RestartPolicy, sample_process
+from ipmininet.router.config.base import render_daemons
+from ipmininet.router.config.manifest import FILE_MODE, ConfigManifest, \
+    SpooledContent, _umask, write_file
 from ipmininet.router.config.utils import ip_statement
+from ipmininet.templating import CachedTemplateLookup
 from . import require_root
 
 
@@ -77,6 +101,505 @@ def test_ip_address_format():
     assert len(out.strip('\n').split('\n')) == (2 + 2 * len(v4) + 2 * len(v6))
 
 
+def test_netlink_addresses():
+    """
+    Check that netlink reports the same addresses as the ip command
+    """
+    subprocess.call(['ip', 'link', 'set', 'dev', 'lo', 'up'])
+    out = subprocess.check_output(['ip', 'address', 'show', 'dev', 'lo'])\
+        .decode("utf-8")
+    ip_mac, ip_v4, ip_v6 = _parse_addresses(out)
+    nl = NetlinkSocket.open()
+    try:
+        mac, v4, v6 = nl.addresses('lo')
+        assert nl.all_addresses()['lo'] == (mac, v4, v6)
+        assert nl.link('lo').is_up
+        with pytest.raises(OSError):
+            nl.link('unknown-itf')
+    finally:
+        nl.close()
+    assert mac == ip_mac
+    assert sorted(v4) == sorted(ip_v4)
+    assert sorted(v6) == sorted(ip_v6)
+
+
+class _BrokenSocket:
+    """A netlink socket that is always readable but fails to receive"""
+
+    def __init__(self):
+        self.r, self.w = os.pipe()
+        os.write(self.w, b'\0')
+
+    def fileno(self):
+        return self.r
+
+    def recv(self, size):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
+
+
+def test_address_monitor_errors():
+    """
+    Check that the address monitor resynchronizes a node whose socket
+    fails, and stops watching it instead of exiting
+    """
+    resynced = threading.Event()
+    monitor = AddressMonitor(lambda *args: None,
+                             lambda n: resynced.set())
+    sock = _BrokenSocket()
+    monitor._sockets[sock.fileno()] = ('n1', sock)
+    monitor._names['n1'] = {}
+    monitor._poller.register(sock.fileno(), select.POLLIN)
+    monitor.start()
+    try:
+        assert resynced.wait(5)
+        monitor._thread.join(.1)
+        assert monitor._thread.is_alive()
+        assert not monitor._sockets and 'n1' not in monitor._names
+    finally:
+        monitor.stop()
+
+
+def test_prefix_allocator():
+    """
+    Check that subnets are split in halves and that the blocks overlapping
+    pre-allocated subnets are not handed out
+    """
+    _N = ipaddress.ip_network
+    allocator = PrefixAllocator([_N('10.0.0.0/24')], [_N('10.0.0.0/26')])
+    # The first block of the requested size overlaps the allocated subnet
+    assert allocator.allocate(26) is None
+    assert allocator.free_blocks() == [_N('10.0.0.64/26'),
+                                       _N('10.0.0.128/25')]
+    assert allocator.allocate(27) == _N('10.0.0.64/27')
+    assert allocator.allocate(25) == _N('10.0.0.128/25')
+    with pytest.raises(ValueError):
+        allocator.allocate(26)
+    assert allocator.free_blocks() == [_N('10.0.0.96/27')]
+
+
+def test_address_index():
+    """
+    Check that addresses are resolved to the interfaces owning them, or to
+    those of the most specific subnet containing them
+    """
+    _I = ipaddress.ip_interface
+    index = AddressIndex()
+    index.update('r1-eth0', added=[_I('10.0.0.1/24'), _I('2001:db8::1/64')])
+    index.update('r2-eth0', added=[_I('10.0.0.2/24')])
+    index.update('r2-lo', added=[_I('10.0.0.128/25')])
+    assert index.lookup('10.0.0.1') == ['r1-eth0']
+    assert index.lookup('10.0.0.2/24') == ['r2-eth0']
+    assert sorted(index.lookup('10.0.0.3')) == ['r1-eth0', 'r2-eth0']
+    assert index.lookup('10.0.0.200') == ['r2-lo']
+    assert index.lookup('2001:db8::42') == ['r1-eth0']
+    assert index.lookup('10.1.0.1') == []
+    index.update('r2-lo', removed=[_I('10.0.0.128/25')])
+    assert sorted(index.lookup('10.0.0.200')) == ['r1-eth0', 'r2-eth0']
+    with pytest.raises(ValueError):
+        index.lookup('r1')
+
+
+def test_template_cache(tmp_path):
+    """
+    Check that compiled templates are cached by template content
+    """
+    templates = tmp_path / 'templates'
+    templates.mkdir()
+    (templates / 'test.mako').write_text('hello ${name}')
+    cache = tmp_path / 'cache'
+    lookup = CachedTemplateLookup(str(templates), cache_dir=str(cache))
+    lookup.warm_up()
+    assert lookup.get_template('test.mako').render(name='r1') == 'hello r1'
+    modules = list(cache.glob('*/test.mako.py'))
+    assert len(modules) == 1
+
+    (templates / 'test.mako').write_text('bye ${name}')
+    lookup = CachedTemplateLookup(str(templates), cache_dir=str(cache))
+    assert lookup.get_template('test.mako').render(name='r1') == 'bye r1'
+    assert len(list(cache.glob('*/test.mako.py'))) == 2
+
+    # The compiled templates are imported, hence only trusted if no other
+    # user can write them
+    cache.chmod(0o777)
+    lookup = CachedTemplateLookup(str(templates), cache_dir=str(cache))
+    assert lookup.module_directory is None
+    assert lookup.get_template('test.mako').render(name='r1') == 'bye r1'
+
+
+class _FakeDaemon:
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, cfg):
+        if self.name == 'broken':
+            raise ValueError('Cannot render %s' % self.name)
+        return {'%s.conf' % self.name: '%s %s' % (cfg, self.name)}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_render_daemons(workers):
+    """
+    Check that the configurations are rendered in order, in the current
+    process or in a pool of processes
+    """
+    jobs = [(_FakeDaemon(name), 'r%d' % i)
+            for i, name in enumerate(['zebra', 'broken', 'ospfd', 'bgpd'])]
+    rendered = render_daemons(jobs, workers=workers)
+    assert rendered[0] == {'zebra.conf': 'r0 zebra'}
+    assert isinstance(rendered[1], ValueError)
+    assert rendered[2:] == [{'ospfd.conf': 'r2 ospfd'},
+                            {'bgpd.conf': 'r3 bgpd'}]
+
+
+def test_config_manifest(tmp_path):
+    """
+    Check that unchanged files are not rewritten, and that the manifest
+    finds the files that are no longer generated
+    """
+    a, b = str(tmp_path / 'a.cfg'), str(tmp_path / 'b.cfg')
+    manifest = ConfigManifest(str(tmp_path / 'manifest.json'))
+    manifest.begin()
+    assert write_file(a, 'a', manifest)
+    assert write_file(b, 'b', manifest)
+    manifest.save()
+
+    manifest = ConfigManifest(str(tmp_path / 'manifest.json'))
+    assert len(manifest) == 2
+    manifest.begin()
+    assert not write_file(a, 'a', manifest)
+    assert manifest.written == []
+    assert manifest.prune() == [b]
+    assert sorted(os.listdir(str(tmp_path))) == ['a.cfg', 'manifest.json']
+    assert write_file(a, 'c', manifest)
+    with open(a) as f:
+        assert f.read() == 'c'
+    # Without manifest, the content on disk is compared
+    assert not write_file(a, 'c')
+    # The files are created with the permissions that open() would give
+    assert os.stat(a).st_mode & 0o777 == FILE_MODE
+    previous = os.umask(0o027)
+    try:
+        assert _umask() == 0o027
+    finally:
+        os.umask(previous)
+
+
+def test_spooled_content(tmp_path):
+    """
+    Check that large contents are spooled to a temporary file, which then
+    replaces the destination
+    """
+    path = str(tmp_path / 'big.cfg')
+    small = SpooledContent(path, threshold=10)
+    small.write('abc')
+    assert small.close() == 'abc'
+
+    big = SpooledContent(path, threshold=10)
+    for i in range(100):
+        big.write('line %d\n' % i)
+    assert big.close() is big
+    assert os.path.exists(big.tmp)
+    assert write_file(path, big)
+    assert os.listdir(str(tmp_path)) == ['big.cfg']
+    with open(path) as f:
+        assert f.read() == ''.join('line %d\n' % i for i in range(100))
+
+    # An unchanged spooled content is discarded
+    again = SpooledContent(path, threshold=10)
+    again.write('line 0\n' * 100)
+    again.close()
+    assert write_file(path, again)
+    same = SpooledContent(path, threshold=10)
+    same.write('line 0\n' * 100)
+    same.close()
+    assert not write_file(path, same)
+    assert os.listdir(str(tmp_path)) == ['big.cfg']
+
+
+def test_generate_configs(tmp_path):
+    """
+    Check that the configuration files of a topology are generated without
+    building the network
+    """
+    assert generate_configs(SimpleBGPTopo(), str(tmp_path)) == {}
+    files = os.listdir(str(tmp_path))
+    for router in ['as1r1', 'as2r1', 'as2r2', 'as3r1']:
+        for daemon in ['zebra', 'ospfd', 'ospf6d', 'bgpd']:
+            assert '%s_%s.cfg' % (daemon, router) in files
+    with open(str(tmp_path / 'bgpd_as2r1.cfg')) as f:
+        assert 'remote-as 1' in f.read()
+
+
+@pytest.mark.parametrize("method,error", [
+    ('build', KeyError),
+    ('render', TypeError),
+])
+def test_generate_configs_errors(tmp_path, monkeypatch, method, error):
+    """
+    Check that any error of a daemon configuration is reported with the
+    node it belongs to
+    """
+    def broken(*args, **kwargs):
+        raise error('broken')
+
+    monkeypatch.setattr(BGP, method, broken)
+    failures = generate_configs(SimpleBGPTopo(), str(tmp_path))
+    assert sorted(failures) == ['as1r1', 'as2r1', 'as2r2', 'as3r1']
+    assert all(isinstance(e, error) for e in failures.values())
+
+
+def test_peer_address(tmp_path):
+    """
+    Check that iBGP peers are contacted on their closest interface
+    according to the IGP metrics
+    """
+    net = OfflineIPNet(str(tmp_path), topo=BGPTopoRR())
+    try:
+        net.build()
+        # as1r4 reaches as1r1 through as1r5 and as1r6 at a lower cost than
+        # through as1r2 and as1r3
+        peer = Peer(net['as1r4'], 'as1r1', v6=True)
+        assert peer.peer == net['as1r1'].connectionsTo(net['as1r6'])[0][0].ip6
+        assert Peer(net['as1r4'], 'as1r1').peer \
+            == net['as1r1'].connectionsTo(net['as1r6'])[0][0].ip
+    finally:
+        net.stop()
+
+
+def test_rr_all_clients(tmp_path):
+    """
+    Check that all the iBGP peers of a route reflector are its clients
+    when set_rr is not given any
+    """
+    topo = IPTopo()
+    r1, r2, r3 = (topo.addRouter(name) for name in ('r1', 'r2', 'r3'))
+    for r in (r1, r2, r3):
+        r.addDaemon(BGP)
+    topo.addLinks((r1, r2), (r1, r3))
+    set_rr(topo, r1)
+    topo.addiBGPFullMesh(1, routers=[r1, r2, r3])
+    topo.build()  # Apply the overlays
+    net = OfflineIPNet(str(tmp_path), topo=topo)
+    try:
+        net.build()
+        cfg = net['r1'].nconfig.daemon(BGP).build()
+        assert sorted({n.node for n in cfg.neighbors if n.rr_client}) \
+            == ['r2', 'r3']
+        cfg = net['r2'].nconfig.daemon(BGP).build()
+        assert cfg.neighbors and not any(n.rr_client for n in cfg.neighbors)
+    finally:
+        net.stop()
+
+
+def test_peer_groups(tmp_path):
+    """
+    Check that the route reflector clients share a peer group while the
+    eBGP peer is configured on its own
+    """
+    net = OfflineIPNet(str(tmp_path), topo=BGPTopoRR())
+    try:
+        net.build()
+        cfg = net['as1r1'].nconfig.daemon(BGP).build()
+        groups = {g.name: g for g in cfg.peer_groups}
+        clients = groups['as1-ipv6-clients']
+        assert clients.is_group and clients.rr_client
+        assert sorted({p.node for p in clients.peers}) \
+            == ['as1r2', 'as1r3', 'as1r4', 'as1r5', 'as1r6']
+        ebgp = [g for g in cfg.peer_groups
+                if g.asn == 3 and g.family == 'ipv6']
+        assert len(ebgp) == 1 and not ebgp[0].is_group
+        assert ebgp[0].name == ebgp[0].peers[0].peer
+    finally:
+        net.stop()
+
+    assert not generate_configs(BGPTopoRR(), str(tmp_path / 'configs'))
+    lines = [line.split() for line in
+             (tmp_path / 'configs' / 'bgpd_as1r1.cfg').read_text().split('\n')]
+    assert ['neighbor', 'as1-ipv6-clients', 'peer-group'] in lines
+    assert ['neighbor', 'as1-ipv6-clients', 'route-reflector-client'] in lines
+    members = {line[1] for line in lines if line[:1] == ['neighbor']
+               and line[2:] == ['peer-group', 'as1-ipv6-clients']}
+    assert len(members) == 5
+    # FRR only accepts some commands on the addresses of the neighbors
+    for line in lines:
+        if line[:1] == ['neighbor'] and line[2:3] in (['port'],
+                                                      ['description']):
+            ipaddress.ip_address(line[1])
+
+
+class _RouteMapTopo(IPTopo):
+
+    def build(self, *args, **kwargs):
+        r1 = self.addRouter('r1')
+        r2 = self.addRouter('r2')
+        self.addLink(r1, r2)
+        for r, asn in ((r1, 1), (r2, 2)):
+            r.addDaemon(BGP, address_families=(AF_INET6(),))
+            self.addAS(asn, (r,))
+        ebgp_session(self, r1, r2)
+        r1.get_config(BGP).set_local_pref(150, from_peer=r2)\
+            .set_community('1:10', from_peer=r2).set_med(5, to_peer=r2)
+        super().build(*args, **kwargs)
+
+
+def test_start_failures(tmp_path, monkeypatch):
+    """
+    Check that all the errors of the nodes are reported and that the daemons
+    of the nodes that did start are stopped
+    """
+    topo = IPTopo()
+    r1, r2 = topo.addRouter('r1'), topo.addRouter('r2')
+    h1 = topo.addHost('h1')
+    topo.addLinks((r1, r2), (r1, h1))
+    net = OfflineIPNet(str(tmp_path), topo=topo)
+    try:
+        net.build()
+
+        def broken_start():
+            raise KeyError('broken')
+
+        monkeypatch.setattr(net['r2'], 'start', broken_start)
+        # Only the nodes are started, not the links nor the switches
+        monkeypatch.setattr(Mininet, 'start', lambda self: None)
+        with pytest.raises(NetworkStartError) as e:
+            IPNet.start(net)
+        assert sorted(e.value.failures) == ['r1', 'r2']
+        assert isinstance(e.value.failures['r2'], KeyError)
+        assert net['h1']._processes._terminating
+    finally:
+        net.stop()
+
+
+def test_lookup_refresh(tmp_path, monkeypatch):
+    """
+    Check that the addresses are read again when an address set outside of
+    IPNet is looked up
+    """
+    topo = IPTopo()
+    topo.addLink(topo.addRouter('r1'), topo.addRouter('r2'))
+    net = OfflineIPNet(str(tmp_path), topo=topo)
+    try:
+        net.build()
+        itf = net['r2'].intf('r2-eth0')
+        subnet = itf.addresses[6][0].network
+        slaac = ipaddress.ip_interface('%s/%d' % (subnet[0xab],
+                                                  subnet.prefixlen))
+        refreshed = []
+
+        def refresh_addresses(nodes):
+            refreshed.append(nodes)
+            itf._record_addresses(added=[slaac])
+
+        monkeypatch.setattr(ipnet, 'refresh_addresses', refresh_addresses)
+        assert net.node_for_ip(itf.addresses[6][0].ip) == net['r2']
+        assert not refreshed
+        assert net.intf_for_ip(slaac.ip) == itf
+        assert len(refreshed) == 1
+        assert net.node_for_ip(slaac.ip) == net['r2']
+        assert len(refreshed) == 1
+        # The address monitor keeps the index up-to-date
+        net.monitor_addresses = True
+        with pytest.raises(KeyError):
+            net.node_for_ip(subnet[0xcd])
+        with pytest.raises(KeyError):
+            net.intf_for_ip(subnet[0xcd])
+        assert len(refreshed) == 1
+    finally:
+        net.stop()
+
+
+def test_route_map_merge(tmp_path):
+    """
+    Check that the route maps of a neighbor in the same direction are merged,
+    and that building them does not alter the topology
+    """
+    net = OfflineIPNet(str(tmp_path), topo=_RouteMapTopo())
+    try:
+        net.build()
+        daemon = net['r1'].nconfig.daemon(BGP)
+        for _ in range(2):
+            route_maps = daemon.build().route_maps
+            v6 = [rm for rm in route_maps if rm.neighbor.family == 'ipv6']
+            assert sorted(rm.direction for rm in v6) == ['in', 'out']
+            rm_in = next(rm for rm in v6 if rm.direction == 'in')
+            assert sorted(a.action_type for a in rm_in.set_actions) \
+                == ['community', 'local-preference']
+    finally:
+        net.stop()
+
+
+def test_policy_library():
+    """
+    Check that the regional policies are shared between routers and that
+    the route maps calling them are validated
+    """
+    topo = IPTopo()
+    r1, r2, c = (topo.addRouter(name) for name in ('r1', 'r2', 'c'))
+    topo.addLink(r1, c)
+    with pytest.raises(ValueError):
+        ebgp_Client(topo, r1, c, 'EU')
+    rm_setup(topo, r1, 'EU')
+    rm_setup(topo, r2, 'EU')
+    for key in ('bgp_route_maps', 'bgp_community_lists', 'bgp_access_lists'):
+        defs1, defs2 = topo.nodeInfo(r1)[key], topo.nodeInfo(r2)[key]
+        assert defs1 and all(a is b for a, b in zip(defs1, defs2))
+    count = len(topo.nodeInfo(r1)['bgp_route_maps'])
+    ebgp_Client(topo, r1, c, 'EU')
+    assert [rm['name'] for rm in topo.nodeInfo(r1)['bgp_route_maps'][count:]] \
+        == ['cust-c-in'] * 2 + ['cust-c-out'] * 2
+    with pytest.raises(ValueError):
+        policy_library('EU').check([{'name': 'rm-x',
+                                     'call_action': 'rm-unknown-ipv4'}])
+
+
+@pytest.mark.parametrize("redundancy,rrs,sessions", [
+    (1, 2, 1 + 8),
+    (2, 4, 6 + 2 * 6),
+])
+def test_route_reflectors(redundancy, rrs, sessions):
+    """
+    Check that the route reflectors cover all the routers of a ring with
+    fewer iBGP sessions than a full mesh
+    """
+    topo = IPTopo()
+    routers = [topo.addRouter('r%d' % i) for i in range(10)]
+    for i, r in enumerate(routers):
+        topo.addLink(r, routers[(i + 1) % len(routers)])
+    overlay = iBGPRouteReflectors(1, routers=routers, fanout=4,
+                                  redundancy=redundancy)
+    overlay.apply(topo)
+    clusters = overlay.clusters
+    assert sum(len(r) for r, _ in clusters) == rrs
+    assert sorted(r for rr, c in clusters for r in rr + c) \
+        == sorted(routers)
+    assert all(len(c) <= 4 for _, c in clusters)
+    assert overlay.sessions == sessions < overlay.full_mesh_sessions
+    for rr, clients in clusters:
+        for r in rr:
+            assert sorted(topo.nodeInfo(r)['bgp_rr_clients']) \
+                == sorted(clients)
+
+
+def test_igp_distances():
+    """
+    Check that the IGP distances use the metric of the outgoing interface
+    over the one of the link
+    """
+    topo = IPTopo()
+    r1, r2, r3 = (topo.addRouter(name) for name in ('r1', 'r2', 'r3'))
+    topo.addLink(r1, r2, igp_metric=5)
+    topo.addLink(r2, r3, params1={'igp_metric': 7}, params2={'igp_metric': 2})
+    topo.addLink(r3, r1, params2={'igp_metric': 20})
+    distances = _igp_distances(topo, ['r1', 'r2', 'r3'])
+    assert distances['r1'][0] == {'r2': 5, 'r3': 12}
+    assert distances['r3'][0] == {'r2': 2, 'r1': 1}
+    assert distances['r2'][1] == {'r1', 'r3'}
+
+
 @pytest.mark.parametrize("cmd,present", [
     ("ls", True),
     ("/bin/sh", True),
@@ -93,6 +616,149 @@ def test_require_cmd(cmd, present):
                             " while it is present" % cmd
 
 
+@pytest.mark.parametrize("key,path", [
+    ("net.ipv4.ip_forward", "/proc/sys/net/ipv4/ip_forward"),
+    ("net.ipv6.conf.r1-eth0.seg6_enabled",
+     "/proc/sys/net/ipv6/conf/r1-eth0/seg6_enabled"),
+    ("net/ipv4/conf/eth0.10/rp_filter",
+     "/proc/sys/net/ipv4/conf/eth0.10/rp_filter"),
+])
+def test_sysctl_path(key, path):
+    assert _sysctl_path(key) == path
+
+
+def test_find_cmd(tmp_path, monkeypatch):
+    """
+    Check that executables are resolved to absolute paths, once per value
+    of $PATH
+    """
+    sh = utils.find_cmd('sh')
+    assert os.path.isabs(sh)
+    exe = tmp_path / 'sh'
+    exe.write_text('#!/bin/sh\n')
+    exe.chmod(0o755)
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert utils.find_cmd('sh') == str(exe)
+    exe.unlink()
+    assert utils.find_cmd('sh') == str(exe)  # Cached
+    monkeypatch.setenv('PATH', os.path.dirname(sh))
+    assert utils.find_cmd('sh') == sh
+
+
+def test_output_log(tmp_path):
+    """
+    Check that the output of a process is drained in bounded buffers and
+    rotating files
+    """
+    path = str(tmp_path / 'out')
+    output = OutputLog('test', max_lines=3, path=path, max_bytes=10,
+                       backups=1)
+    output.feed(b'one\ntwo\nthr')
+    output.feed(b'ee\nfour\nfive')
+    assert output.tail() == ['three', 'four', 'five']
+    assert output.tail(2) == ['four', 'five']
+    with open(path + '.1', 'rb') as f:
+        assert f.read() == b'one\ntwo\nthr'
+    with open(path, 'rb') as f:
+        assert f.read() == b'ee\nfour\nfive'
+    assert not os.path.exists(path + '.2')
+
+    output = OutputLog('test')
+    rfd, wfd = os.pipe()
+    output_pump.watch(rfd, output)
+    os.write(wfd, b'line\n' * 100000)
+    os.close(wfd)
+    assert len(output.tail(wait=5)) == 1000
+    assert output.closed
+
+
+def test_fork_server(tmp_path):
+    """
+    Check that processes are started and checked through the launcher
+    """
+    class LocalNode:
+        name = 'n1'
+        cwd = str(tmp_path)
+
+        def popen(self, *args, **kwargs):
+            return subprocess.Popen(*args, **kwargs)
+
+    helper = ForkServerHelper(LocalNode())
+    try:
+        assert helper.pexec(['sh', '-c', 'echo out; echo err >&2; exit 3']) \
+            == ('out\n', 'err\n', 3)
+        process = helper.get_process(helper.popen('sleep 30'))
+        assert process.poll() is None
+        exited = helper.get_process(helper.popen(['sh', '-c', 'exit 4']))
+        assert exited.wait(timeout=5) == 4
+        with pytest.raises(OSError):
+            helper.popen([str(tmp_path / 'missing')])
+        # A running command does not block the other clients
+        client = LauncherClient(helper.socket_path)
+        try:
+            start = time.monotonic()
+            slow = threading.Thread(target=client.run,
+                                    args=(['sleep', '1'],))
+            slow.start()
+            time.sleep(.1)
+            assert process.poll() is None
+            assert time.monotonic() - start < .5
+            slow.join()
+        finally:
+            client.close(stop=False)
+        with pytest.raises(OSError):
+            helper.pexec([str(tmp_path / 'missing')])
+        process.terminate()
+        assert process.wait(timeout=5) < 0
+    finally:
+        helper.terminate()
+    assert not os.path.exists(helper.socket_path)
+
+
+def test_supervisor(tmp_path):
+    """
+    Check that processes are restarted with backoff and that their resource
+    usage is sampled
+    """
+    policy = RestartPolicy(max_restarts=2, initial_delay=.05, max_delay=.1)
+    assert [policy.delay(i) for i in range(3)] == [.05, .1, None]
+    sample = sample_process(os.getpid())
+    assert sample.pid == os.getpid() and sample.rss > 0 and sample.fds > 0
+
+    class LocalNode:
+        name = 'n1'
+        cwd = str(tmp_path)
+
+        def popen(self, *args, **kwargs):
+            return subprocess.Popen(*args, **kwargs)
+
+    helper = ProcessHelper(LocalNode(), restart_policy=policy,
+                           sample_interval=.02)
+    try:
+        helper.popen(['sh', '-c', 'exit 3'], name='crash')
+        helper.popen(['sleep', '30'], name='sleep')
+        helper.popen(['true'], name='done')
+        helper.popen(['sh', '-c', 'exit 1'], name='oneshot', supervised=False)
+        deadline = time.monotonic() + 10
+        while len(helper.exits('crash')) < 3 \
+                and time.monotonic() < deadline:
+            time.sleep(.05)
+        time.sleep(.2)
+        assert [e.code for e in helper.exits('crash')] == [3, 3, 3]
+        assert not helper.exits('sleep')
+        # A process ending with code 0 is neither an error nor restarted
+        assert not helper.exits('done')
+        assert helper.get_process(helper._names['done']).poll() == 0
+        assert helper._history['done'].restarts == 0
+        assert not helper.exits('oneshot') and 'oneshot' not in helper.names
+        samples = helper.samples('sleep')
+        assert samples and samples[-1].rss > 0
+        assert helper.samples('sleep', since=samples[-1].time) \
+            == samples[-1:]
+    finally:
+        helper.terminate()
+
+
 @pytest.mark.parametrize("node,use_v4,use_v6,expected", [
     ("h1", True, True, ("10.0.0.2", "2001:1a::2")),
     ("h1", False, True, (None, "2001:1a::2")),
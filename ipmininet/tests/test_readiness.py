@@ -0,0 +1,49 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from ipmininet.readiness import PathProbe, UnixSocketProbe, CallableProbe, \
+    ReadinessError, wait_ready
+
+
+def test_wait_file(tmp_path):
+    path = str(tmp_path / 'daemon.pid')
+    probe = PathProbe(path)
+    assert not probe.ready()
+
+    timer = threading.Timer(.05, lambda: open(path, 'w').close())
+    timer.start()
+    wait_ready([probe], timeout=5)
+    timer.join()
+    assert probe.ready()
+
+
+def test_wait_unix_socket(tmp_path):
+    path = str(tmp_path / 'daemon.api')
+    probe = UnixSocketProbe(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        # The socket exists but does not accept connections yet
+        assert not probe.ready()
+        assert 'refuses connections' in probe.diagnose()
+        timer = threading.Timer(.05, sock.listen)
+        timer.start()
+        wait_ready([probe], timeout=5)
+        timer.join()
+    finally:
+        sock.close()
+        os.unlink(path)
+
+
+def test_wait_timeout(tmp_path):
+    path = str(tmp_path / 'never')
+    with pytest.raises(ReadinessError) as e:
+        wait_ready([PathProbe(path), CallableProbe(lambda: True)],
+                   timeout=.1, name='test-daemon')
+    msg = str(e.value)
+    assert 'test-daemon' in msg
+    assert 'timeout' in msg
+    assert '%s does not exist' % path in msg
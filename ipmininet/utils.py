@@ -1,5 +1,7 @@
 """utils: utility functions to manipulate host, interfaces, ..."""
 import collections
+import ctypes
+import ctypes.util
 import os
 
 from mininet.link import Intf
@@ -12,31 +14,77 @@ from ipaddress import ip_address, IPv4Address, IPv6Address, IPv4Network,\
 from typing import Type, Dict, Optional, Union, Tuple, List, TYPE_CHECKING, Set
 if TYPE_CHECKING:
     from ipmininet.link import IPIntf
+    from ipmininet.ipnet import BroadcastDomain
+
+
+_libc = None  # type: Optional[ctypes.CDLL]
+
+
+def libc() -> Optional[ctypes.CDLL]:
+    """Return a handle to the C library, or None if it cannot be loaded"""
+    global _libc
+    if _libc is None:
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        except OSError:
+            return None
+    return _libc
+
+
+# The absolute path of the executables, per value of $PATH
+_cmd_cache = {}  # type: Dict[Tuple[str, str], Optional[str]]
+
+
+def _is_exe(path: str) -> bool:
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+def find_cmd(cmd: str) -> Optional[str]:
+    """Return the absolute path of an executable. Unless cmd is already a
+    path, it is looked up in $PATH as the shell would do. The results are
+    cached for each value of $PATH.
+
+    :param cmd: the command to look for
+    :return: the path of the executable, or None if it is not available"""
+    env_path = os.environ.get('PATH', os.defpath)
+    key = (cmd, env_path)
+    try:
+        return _cmd_cache[key]
+    except KeyError:
+        pass
+    exe = None
+    if os.path.sep in cmd:
+        if _is_exe(cmd):
+            exe = os.path.abspath(cmd)
+        if not os.path.isabs(cmd):
+            return exe  # Depends on the working directory
+    else:
+        # Try to find the cmd in each directory in $PATH
+        for path in env_path.split(os.path.pathsep):
+            candidate = os.path.join(path.strip('"'), cmd)
+            if _is_exe(candidate):
+                exe = os.path.abspath(candidate)
+                break
+    _cmd_cache[key] = exe
+    return exe
 
 
 def has_cmd(cmd: str) -> bool:
     """Return whether the given executable is available on the system or not"""
-    # Check if cmd is a valid absolute path
-    if os.path.isfile(cmd) and os.access(cmd, os.X_OK):
-        return True
-    # Try to find the cmd in each directory in $PATH
-    for path in os.environ["PATH"].split(os.path.pathsep):
-        path = path.strip('"')
-        exe = os.path.join(path, cmd)
-        if os.path.isfile(exe) and os.access(exe, os.X_OK):
-            return True
-    return False
-
-
-def require_cmd(cmd: str, help_str: Optional[str] = None):
+    return find_cmd(cmd) is not None
+
+
+def require_cmd(cmd: str, help_str: Optional[str] = None) -> str:
     """
     Ensures that a command is available in $PATH
 
     :param cmd: the command to test
     :param help_str: an optional help string to display if cmd is not found
+    :return: the absolute path of the command
     """
-    if has_cmd(cmd):
-        return
+    exe = find_cmd(cmd)
+    if exe is not None:
+        return exe
 
     if help_str:
         log.error(help_str)
@@ -54,10 +102,13 @@ def realIntfList(n: Node) -> List['IPIntf']:
     return [i for i in n.intfList() if i.name != 'lo']
 
 
-def address_pair(n: Node, use_v4=True, use_v6=True) \
+def address_pair(n: Node, use_v4=True, use_v6=True, refresh=False) \
         -> Tuple[Optional[str], Optional[str]]:
     """Returns a tuple (ip, ip6) with ip/ip6 being one of the IPv4/IPv6
-       addresses of the node n"""
+       addresses of the node n
+
+    :param refresh: Read the addresses again from the kernel instead of
+                    using the address view of the interfaces"""
     from .link import IPIntf  # Prevent circular imports
     v4_str = v6_str = None
     for itf in n.intfList():
@@ -67,12 +118,12 @@ def address_pair(n: Node, use_v4=True, use_v6=True) \
         if not isinstance(itf, IPIntf):
             continue
 
-        if use_v4 and v4_str is None:
+        if refresh:
             itf.updateIP()
+        if use_v4 and v4_str is None:
             v4 = next(itf.ips(), None)
             v4_str = v4.ip.compressed if v4 is not None else v4
         if use_v6 and v6_str is None:
-            itf.updateIP6()
             v6 = next(itf.ip6s(exclude_lls=True), None)
             v6_str = v6.ip.compressed if v6 is not None else v6
         if (not use_v4 or v4_str is not None) \
@@ -145,6 +196,23 @@ def get_set(d: Dict, key, default: Type):
         return x
 
 
+def broadcast_domains_of(node: Node) -> List['BroadcastDomain']:
+    """Return the broadcast domains to which a node is attached, using the
+    domain index of the network when available
+
+    :param node: The node"""
+    domains = []  # type: List[BroadcastDomain]
+    for i in realIntfList(node):
+        d = getattr(i, 'broadcast_domain', None)
+        if d is None:
+            continue
+        if d.index is not None:
+            return d.index.domains_of(node)
+        if d not in domains:
+            domains.append(d)
+    return domains
+
+
 def find_node(start: Node, node_name: str) -> Optional[Intf]:
     """
     :param start: The starting node of the search
@@ -155,18 +223,18 @@ def find_node(start: Node, node_name: str) -> Optional[Intf]:
     if start.name == node_name:
         return start.intf()
 
-    visited = set()  # type: Set[IPIntf]
-    to_visit = realIntfList(start)
-    # Explore all interfaces recursively, until we find one
+    visited = set()  # type: Set[BroadcastDomain]
+    to_visit = list(broadcast_domains_of(start))
+    # Explore all domains recursively, until we find one
     # connected to the node
     while to_visit:
-        i = to_visit.pop()
-        if i in visited:
+        d = to_visit.pop()
+        if d in visited:
             continue
-        visited.add(i)
-        for n in i.broadcast_domain.interfaces:
-            if n.node.name == node_name:
-                return n
-            if L3Router.is_l3router_intf(n):
-                to_visit.extend(realIntfList(n.node))
+        visited.add(d)
+        itfs = d.interfaces_of(node_name)
+        if itfs:
+            return itfs[0]
+        for n in d.routers:
+            to_visit.extend(broadcast_domains_of(n.node))
     return None